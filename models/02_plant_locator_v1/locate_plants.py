@@ -19,6 +19,7 @@ from tqdm import tqdm
 
 from src.read import read_json, read_transform_and_mask
 from src.PlantLocator import PlantLocator
+from src.CoordinateService import CoordinateService
 from src.PlantDetector import PlantDetector
 
 
@@ -28,10 +29,16 @@ from src.PlantDetector import PlantDetector
 # Path to files 
 image_path = "../../data/images/orthomosaic_cropped_230609.tif" # Created with Agisoft software
 row_points_path = "../../data/features/parallel_rows_points.json"  # Extracted with the file: UC1_Crop_Monitoring/top_view/create_grid/get_plant_rows.py
-gps_path = "../../data/features/all_coords.json"  # This was extracted from the orthomosaic information (code still not provided)
-model_path = "../01_plant_disease_detection_yolov8_v1/best.pt"
+model_path = "../01_plant_disease_detection_yolov8_v1/best.pt"  # A .onnx model (exported with OnnxDetector.export) runs with ONNX Runtime
 save_images_path = "../../data/"
 row_images_path = "../../data/images_row/"
+exif_cache_path = "../../data/features/exif_index.sqlite"  # GPS of the row images, only new or modified images are read again
+
+# Plant detection parameters
+BATCH_SIZE = 8      # Row images given to the model at once
+NUM_WORKERS = 4     # Threads that read the row images ahead of the model
+NUM_THREADS = None  # CPU threads used by the model (None: default of torch / ONNX Runtime)
+SHOW = False        # If True, shows the plants detected in each row image
 
 # Load image   
 image = cv2.imread(image_path)
@@ -40,17 +47,16 @@ transform, mask = read_transform_and_mask(image_path)
 # Read the points that define each row 
 row_points = read_json(row_points_path)
 
-# Read GPS coordinates for every pixel in orthomosaic image
-print("Loading gps coordinates...")
-all_coords = read_json(gps_path)
+# Conversion between pixels and GPS coordinates with the orthomosaic transform (replaces all_coords.json)
+coords = CoordinateService.from_raster(image_path)
 
 
 # PLANT DETECTION IN ROW IMAGES 
 # ==========================================================================================
 
 # Detect the middle plant of each row image and its health status 
-det = PlantDetector(model_path, row_images_path, save_images_path)
-det.track_plants()
+det = PlantDetector(model_path, row_images_path, save_images_path, BATCH_SIZE, NUM_WORKERS, NUM_THREADS, exif_cache_path)
+det.track_plants(SHOW)
 print("\nPlant locations in row images: ", det._all_locations)  
 print("Plant status in row images: ", det._all_health_status)
 
@@ -60,15 +66,7 @@ print("Plant status in row images: ", det._all_health_status)
 
 # Init plantlocator object to perform the location operations
 print("\nStarting plant locator from row-view to global-view")
-loc = PlantLocator(image, mask, transform, all_coords, row_points, det._all_locations, det._all_health_status)
-
-# Get location in pixels of the plants in the rows
-print("Getting pixels of the plants in the rows...")
-rows_pixels_location = loc.get_row_pixels()
-
-# Get location in GPS of the plants in the rows
-print("Getting GPS location of the rows...")
-rows_location = loc.get_row_location()
+loc = PlantLocator(image, mask, transform, coords, row_points, det._all_locations, det._all_health_status, det._all_yaws)
 
 # Get location of the detected plant in the global orthomosaic view
 print("Getting plant location in the rows...")
@@ -0,0 +1,100 @@
+""" Batched YOLO inference over a folder of row images, with the images read ahead by a pool of threads """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import cv2
+import torch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BatchPredictor:
+    def __init__(self, model, batch_size=8, num_workers=4, num_threads=None):
+        """
+        Initializes the predictor. Nothing is shown on screen, so it can run headless.
+
+        Args:
+            model (ultralytics.YOLO): The YOLO model.
+            batch_size (int): Number of images given to the model at once.
+            num_workers (int): Number of threads that read (decode) the images ahead of the model.
+            num_threads (int): Number of CPU threads used by the model (torch). If None, the torch default is kept.
+        """
+        self._model = model
+        self._batch_size = max(int(batch_size), 1)
+        self._num_workers = max(int(num_workers), 1)
+
+        if num_threads is not None:
+            torch.set_num_threads(int(num_threads))
+
+
+    def read_images(self, image_paths):
+        """
+        Reads the images with a pool of threads, keeping at most two batches read ahead.
+
+        Args:
+            image_paths (list): Paths of the images.
+
+        Yields:
+            tuple: image_path (str) and frame (numpy.ndarray, None if it could not be read), in the order of image_paths.
+        """
+        max_pending = 2 * self._batch_size
+        pending = deque()
+
+        with ThreadPoolExecutor(self._num_workers) as pool:
+            for image_path in image_paths:
+                pending.append((image_path, pool.submit(cv2.imread, image_path)))
+                if len(pending) >= max_pending:
+                    image_path, future = pending.popleft()
+                    yield image_path, future.result()
+
+            while pending:
+                image_path, future = pending.popleft()
+                yield image_path, future.result()
+
+
+    def predict_batch(self, batch):
+        """
+        Runs the model on a batch of images (one call to YOLO.predict with a list of frames).
+
+        Args:
+            batch (list): List of (image_path, frame).
+
+        Yields:
+            tuple: image_path (str), frame (numpy.ndarray) and result (ultralytics Results, None if the image could
+                   not be read), in the order of the batch.
+        """
+        frames = [frame for _, frame in batch if frame is not None]
+        results = iter(self._model.predict(frames, verbose=False)) if frames else iter([])
+
+        for image_path, frame in batch:
+            yield image_path, frame, next(results) if frame is not None else None
+
+
+    def predict(self, image_paths):
+        """
+        Detects the plants in all the images, in batches. Results are given in the same order as the images, so the
+        tracking of the drone positions sees the images in sequence.
+
+        Args:
+            image_paths (list): Paths of the images.
+
+        Yields:
+            tuple: image_path (str), frame (numpy.ndarray) and result (ultralytics Results, None if the image could
+                   not be read).
+        """
+        batch = []
+        for image_path, frame in self.read_images(image_paths):
+            batch.append((image_path, frame))
+            if len(batch) == self._batch_size:
+                yield from self.predict_batch(batch)
+                batch = []
+
+        if batch:
+            yield from self.predict_batch(batch)
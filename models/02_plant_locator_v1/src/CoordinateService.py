@@ -0,0 +1,127 @@
+""" Conversion between orthomosaic pixels and GPS coordinates with the affine transform of the GeoTIFF """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import rasterio
+import numpy as np
+from pyproj import Transformer
+
+
+class CoordinateService:
+    R = 6371000  # Earth radius in meters
+
+    def __init__(self, transform, crs=None, size=None):
+        """
+        Initializes the service with the georeference of the orthomosaic. It replaces the JSON with the GPS
+        coordinates of every pixel (all_coords.json): the same values are computed from the transform when needed.
+
+        Args:
+            transform (affine.Affine): The affine transformation matrix of the orthomosaic (pixel to CRS).
+            crs (rasterio.crs.CRS): The CRS of the orthomosaic. If None or geographic, the transform already
+                                    gives longitude and latitude.
+            size (tuple): Size of the orthomosaic as (height, width), to keep the pixels inside the image.
+        """
+        self._transform = transform
+        self._inverse = ~transform
+        self._size = size
+
+        # Transformers between GPS (WGS84) and the CRS of the orthomosaic, only if it is projected
+        if crs is None or crs.is_geographic:
+            self._to_crs = None
+            self._to_gps = None
+        else:
+            self._to_crs = Transformer.from_crs("EPSG:4326", crs, always_xy=True)
+            self._to_gps = Transformer.from_crs(crs, "EPSG:4326", always_xy=True)
+
+
+    @classmethod
+    def from_raster(cls, image_path):
+        """
+        Creates the service from the georeference of a GeoTIFF (only the header is read).
+
+        Args:
+            image_path (str): The path to the GeoTIFF orthomosaic.
+
+        Returns:
+            CoordinateService: The coordinate service of the orthomosaic.
+        """
+        with rasterio.open(image_path) as src:
+            return cls(src.transform, src.crs, (src.height, src.width))
+
+
+    def pixels_to_gps(self, pixels) -> np.ndarray:
+        """
+        Converts pixel positions to GPS coordinates, all at once. Same result as np.flip(transform * pixel)
+        for each pixel.
+
+        Args:
+            pixels (array-like): Pixel positions (x, y) with shape (N, 2).
+
+        Returns:
+            gps (np.ndarray): GPS coordinates (latitude, longitude) with shape (N, 2).
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        a, b, c, d, e, f = self._transform[:6]
+        xs = a * pixels[:, 0] + b * pixels[:, 1] + c
+        ys = d * pixels[:, 0] + e * pixels[:, 1] + f
+
+        if self._to_gps is not None:
+            xs, ys = self._to_gps.transform(xs, ys)
+
+        return np.stack([ys, xs], axis=1)
+
+
+    def gps_to_pixels(self, gps) -> np.ndarray:
+        """
+        Converts GPS coordinates to the closest pixel positions, all at once. It replaces the search of the
+        closest coordinate in all_coords.json: the pixels are a regular grid in the CRS of the orthomosaic, so rounding
+        the inverse of the transform gives the closest pixel (also in meters) without a KD-tree or a distance per pixel.
+
+        Args:
+            gps (array-like): GPS coordinates (latitude, longitude) with shape (N, 2).
+
+        Returns:
+            pixels (np.ndarray): Pixel positions (x, y) with shape (N, 2), int.
+        """
+        gps = np.asarray(gps, dtype=np.float64).reshape(-1, 2)
+        xs, ys = gps[:, 1], gps[:, 0]
+
+        if self._to_crs is not None:
+            xs, ys = self._to_crs.transform(xs, ys)
+
+        a, b, c, d, e, f = self._inverse[:6]
+        pixels = np.rint(np.stack([a * xs + b * ys + c, d * xs + e * ys + f], axis=1)).astype(int)
+
+        # Positions outside the orthomosaic are moved to the closest pixel inside it
+        if self._size is not None:
+            pixels[:, 0] = np.clip(pixels[:, 0], 0, self._size[1] - 1)
+            pixels[:, 1] = np.clip(pixels[:, 1], 0, self._size[0] - 1)
+
+        return pixels
+
+
+    @staticmethod
+    def gps_distances(gps1, gps2) -> np.ndarray:
+        """
+        Calculates the great-circle (haversine) distances between GPS coordinates, all at once (arrays are broadcast,
+        e.g. one location against N locations).
+
+        Args:
+            gps1 (array-like): GPS coordinates (latitude, longitude) with shape (..., 2).
+            gps2 (array-like): GPS coordinates (latitude, longitude) with shape (..., 2).
+
+        Returns:
+            distances (np.ndarray): Distances in meters.
+        """
+        lat1, lon1 = np.moveaxis(np.radians(np.asarray(gps1, dtype=np.float64)), -1, 0)
+        lat2, lon2 = np.moveaxis(np.radians(np.asarray(gps2, dtype=np.float64)), -1, 0)
+        a = np.sin((lat1 - lat2) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon1 - lon2) / 2)**2
+
+        return CoordinateService.R * 2 * np.arcsin(np.sqrt(a))
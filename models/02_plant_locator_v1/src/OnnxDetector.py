@@ -0,0 +1,247 @@
+""" Plant detection with the YOLO model exported to ONNX and run with ONNX Runtime (CPU) """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import os
+import cv2
+import numpy as np
+import onnxruntime as ort
+
+
+class OnnxDetector:
+    def __init__(self, model_path, conf=0.25, iou=0.7, max_det=300, num_threads=None, providers=('CPUExecutionProvider',)):
+        """
+        Loads the ONNX model (exported with OnnxDetector.export). Same thresholds as YOLO.predict by default.
+
+        Args:
+            model_path (str): Path to the .onnx model.
+            conf (float): Minimum confidence of a detection.
+            iou (float): IoU threshold of the non-maximum suppression of each class.
+            max_det (int): Maximum number of detections per image.
+            num_threads (int): Number of CPU threads used by ONNX Runtime. If None, the ONNX Runtime default is kept.
+            providers (tuple): ONNX Runtime execution providers (e.g. 'OpenVINOExecutionProvider' if installed).
+        """
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = int(num_threads)
+        available = ort.get_available_providers()
+        self._session = ort.InferenceSession(model_path, options, providers=[p for p in providers if p in available] or available)
+
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None  # None if dynamic
+        self._imgsz = (model_input.shape[2], model_input.shape[3]) if isinstance(model_input.shape[2], int) else (640, 640)
+        self._conf = conf
+        self._iou = iou
+        self._max_det = max_det
+
+
+    @staticmethod
+    def letterbox(frame, imgsz=(640, 640), color=(114, 114, 114)):
+        """
+        Resizes an image keeping its aspect ratio and pads it to the model size (same as the YOLO preprocessing).
+
+        Args:
+            frame (numpy.ndarray): BGR image.
+            imgsz (tuple): Model input size as (height, width).
+            color (tuple): Color of the padding.
+
+        Returns:
+            tuple: image (numpy.ndarray) with shape imgsz, ratio (float) of the resize and pad (tuple) added at
+                   the left and top.
+        """
+        h, w = frame.shape[:2]
+        ratio = min(imgsz[0] / h, imgsz[1] / w)
+        new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+        dw, dh = (imgsz[1] - new_w) / 2, (imgsz[0] - new_h) / 2
+
+        if (new_w, new_h) != (w, h):
+            frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+        image = cv2.copyMakeBorder(frame, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+        return image, ratio, (left, top)
+
+
+    def preprocess(self, frames):
+        """
+        Letterboxes the images and stacks them into the model input (RGB, CHW, float32 in [0, 1]).
+
+        Args:
+            frames (list): BGR images.
+
+        Returns:
+            tuple: batch (numpy.ndarray) with shape (N, 3, h, w), ratios (list) and pads (list) of each image.
+        """
+        images, ratios, pads = [], [], []
+        for frame in frames:
+            image, ratio, pad = self.letterbox(frame, self._imgsz)
+            images.append(image[:, :, ::-1].transpose(2, 0, 1))
+            ratios.append(ratio)
+            pads.append(pad)
+
+        batch = np.ascontiguousarray(np.stack(images), dtype=np.float32) / 255
+
+        return batch, ratios, pads
+
+
+    def postprocess(self, prediction, frame_shape, ratio, pad):
+        """
+        Decodes the output of the model for one image (YOLOv8 head: (4 + classes, anchors) with boxes as cx, cy, w, h),
+        applies the confidence threshold and the non-maximum suppression of each class, and scales the boxes to the image.
+
+        Args:
+            prediction (numpy.ndarray): Output of the model for one image.
+            frame_shape (tuple): Shape of the original image.
+            ratio (float): Ratio of the letterbox resize.
+            pad (tuple): Padding (left, top) of the letterbox.
+
+        Returns:
+            tuple: bboxes (numpy.ndarray) as x1, y1, x2, y2 with shape (N, 4) and confidences (numpy.ndarray) with
+                   shape (N,), sorted by confidence as YOLO results.
+        """
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        classes = np.argmax(scores, axis=1)
+        confidences = scores[np.arange(len(scores)), classes]
+
+        keep = confidences > self._conf
+        boxes, confidences, classes = prediction[keep, :4], confidences[keep], classes[keep]
+        if len(boxes) == 0:
+            return np.zeros((0, 4), dtype=np.float32), np.zeros(0)
+
+        # Non-maximum suppression of each class (boxes of different classes are moved apart)
+        xywh = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, 2:]], axis=1)
+        xywh[:, :2] += classes[:, None] * 7680
+        indexes = np.array(cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(), self._conf, self._iou), dtype=int).reshape(-1)
+        indexes = indexes[np.argsort(-confidences[indexes], kind='stable')][:self._max_det]
+
+        # Boxes from the letterboxed image to the original image
+        bboxes = np.concatenate([boxes[indexes, :2] - boxes[indexes, 2:] / 2, boxes[indexes, :2] + boxes[indexes, 2:] / 2], axis=1)
+        bboxes = (bboxes - np.array([pad[0], pad[1], pad[0], pad[1]])) / ratio
+        bboxes[:, [0, 2]] = bboxes[:, [0, 2]].clip(0, frame_shape[1])
+        bboxes[:, [1, 3]] = bboxes[:, [1, 3]].clip(0, frame_shape[0])
+
+        return bboxes.astype(np.float32), confidences[indexes].astype(float)
+
+
+    @staticmethod
+    def filter_predictions(bboxes, confidences) -> np.ndarray:
+        """
+        Filters the detections with the same Non-Maximum Suppression as PlantDetector.filter_predictions.
+
+        Args:
+            bboxes (numpy.ndarray): Bounding boxes with shape (N, 4).
+            confidences (numpy.ndarray): Confidence of each bounding box.
+
+        Returns:
+            bboxes_selected (numpy.ndarray): Selected bounding boxes after filtering.
+        """
+        selected_indices = cv2.dnn.NMSBoxes(bboxes, confidences, 0.15, 0.6)
+        bboxes_selected = np.array([bboxes[i] for i in selected_indices])
+        return bboxes_selected
+
+
+    def predict(self, frames, verbose=False) -> list:
+        """
+        Detects the plants in a list of images (same call as YOLO.predict, used by BatchPredictor).
+
+        Args:
+            frames (list): BGR images.
+            verbose (bool): Not used, kept for compatibility with YOLO.predict.
+
+        Returns:
+            list: For each image, bboxes (numpy.ndarray), the bounding boxes after filter_predictions, and
+                  confidences (numpy.ndarray), the confidence of every detection (as results[0].boxes.conf).
+        """
+        if isinstance(frames, np.ndarray):
+            frames = [frames]
+        batch, ratios, pads = self.preprocess(frames)
+
+        # Dynamic models are run with all the images at once
+        if self._batch is None:
+            outputs = self._session.run(None, {self._input_name: batch})[0]
+        # Static models are run in chunks of their batch size, the last one padded with zero images (outputs dropped)
+        else:
+            n_images = len(batch)
+            padding = -n_images % self._batch
+            if padding:
+                batch = np.concatenate([batch, np.zeros((padding,) + batch.shape[1:], dtype=batch.dtype)])
+            outputs = np.concatenate([self._session.run(None, {self._input_name: batch[i:i + self._batch]})[0]
+                                      for i in range(0, len(batch), self._batch)])[:n_images]
+
+        detections = []
+        for prediction, frame, ratio, pad in zip(outputs, frames, ratios, pads):
+            bboxes, confidences = self.postprocess(prediction, frame.shape, ratio, pad)
+            detections.append((self.filter_predictions(bboxes, confidences), confidences))
+
+        return detections
+
+
+    @staticmethod
+    def export(pt_path, imgsz=640, int8=False, calibration_images=None) -> str:
+        """
+        Exports the YOLO model (.pt) to ONNX with dynamic batch, optionally quantized to INT8.
+
+        Args:
+            pt_path (str): Path to the YOLO model (.pt).
+            imgsz (int): Input size of the model.
+            int8 (bool): If True, the model is also quantized to INT8 (saved as *_int8.onnx).
+            calibration_images (list): Paths of images used to calibrate the INT8 quantization (static). If None,
+                                       the weights are quantized dynamically.
+
+        Returns:
+            str: Path to the exported model.
+        """
+        # Only needed to export the model (the quantization imports the onnx package)
+        from ultralytics import YOLO
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+        onnx_path = YOLO(pt_path).export(format='onnx', imgsz=imgsz, dynamic=True)
+        if not int8:
+            return onnx_path
+
+        int8_path = os.path.splitext(onnx_path)[0] + '_int8.onnx'
+        if calibration_images:
+            reader = ImagesCalibrationReader(calibration_images, (imgsz, imgsz))
+            quantize_static(onnx_path, int8_path, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                            weight_type=QuantType.QInt8, activation_type=QuantType.QUInt8)
+        else:
+            quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+
+        return int8_path
+
+
+
+class ImagesCalibrationReader:
+    def __init__(self, images_paths, imgsz=(640, 640), input_name='images'):
+        """
+        Gives the letterboxed row images to the static INT8 quantization of ONNX Runtime, one at a time (same
+        get_next interface as onnxruntime.quantization.CalibrationDataReader).
+
+        Args:
+            images_paths (list): Paths of the calibration images.
+            imgsz (tuple): Input size of the model as (height, width).
+            input_name (str): Name of the input of the model (YOLO exports it as 'images').
+        """
+        self._images_paths = iter(images_paths)
+        self._imgsz = imgsz
+        self._input_name = input_name
+
+
+    def get_next(self):
+        for image_path in self._images_paths:
+            frame = cv2.imread(image_path)
+            if frame is not None:
+                image, _, _ = OnnxDetector.letterbox(frame, self._imgsz)
+                batch = np.ascontiguousarray(image[None, :, :, ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255
+                return {self._input_name: batch}
+        return None
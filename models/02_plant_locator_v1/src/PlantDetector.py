@@ -14,15 +14,17 @@ import cv2
 import math
 import time 
 import numpy as np 
-from PIL import Image
-from PIL.ExifTags import TAGS
 from ultralytics import YOLO
 import matplotlib.pyplot as plt
 
+from src.BatchPredictor import BatchPredictor
+from src.OnnxDetector import OnnxDetector
+from src.ExifIndex import ExifIndex, get_yaws, read_exif
+
 
 
 class PlantDetector:
-    def __init__(self, model_path, row_images_path, save_images_folder):
+    def __init__(self, model_path, row_images_path, save_images_folder, batch_size=8, num_workers=4, num_threads=None, exif_cache_path=None):
         self._R = 6371000 
         self._add_dist = 0
         self._health_middle_plant = -1
@@ -32,7 +34,13 @@ class PlantDetector:
         self._middle_plant = []
         self._all_locations = []
         self._all_health_status = []
-        self._model = YOLO(model_path)
+        self._all_yaws = []  # Gimbal (or flight) yaw of the image of each location, nan if missing
+        self._onnx = model_path.endswith('.onnx')  # Exported model (OnnxDetector.export) run with ONNX Runtime
+        self._model = OnnxDetector(model_path, num_threads=num_threads) if self._onnx else YOLO(model_path)
+        self._predictor = BatchPredictor(self._model, batch_size, num_workers, num_threads)
+        self._exif = ExifIndex(exif_cache_path, 2 * num_workers)  # GPS of the row images, cached by path and modification time
+        self._gps = {}
+        self._yaws = {}
         self._row_images_path = row_images_path
         self._save_images_folder = save_images_folder
         self._all_images = sorted(os.listdir(row_images_path))
@@ -100,24 +108,16 @@ class PlantDetector:
 
     def get_gps_info(self, image_path) -> None:
         """
-        Extracts GPS coordinates from the EXIF metadata of an image file.
+        Extracts GPS coordinates from the EXIF metadata of an image file (from the EXIF index if the image is in it,
+        otherwise only the header of the JPEG is read).
 
         Args:
             image_path (str): Path to the input image file.
         """
 
-        # Extract EXIF information from the image
-        img = Image.open(image_path)
-        info_exif = img._getexif()
-
-        # Iterate through EXIF tags to find GPSInfo and store GPS coordinates
-        for tag, value in info_exif.items():
-            tag_name = TAGS.get(tag, tag)
-            if tag_name == 'GPSInfo':
-                lat = self.dms2dd(value[2], value[1])
-                lon = self.dms2dd(value[4], value[3])
-                self._location = [lat, lon]
-                break
+        lat, lon = self._gps[image_path] if image_path in self._gps else read_exif(image_path)[:2]
+        if not (np.isnan(lat) or np.isnan(lon)):
+            self._location = [lat, lon]
     
 
     def draw_bbox(self, frame) -> np.ndarray:
@@ -221,25 +221,37 @@ class PlantDetector:
         self._pdist = dist
     
 
-    def track_plants(self) -> None:
+    def track_plants(self, show=False) -> None:
         """
         Tracks plants in a series of images, saves their health status and locations, and displays images with detected plants.
+        The images are read ahead and detected in batches (see BatchPredictor), in order.
+
+        Args:
+            show (bool): If True, displays the images with the plants detected.
         """
 
         self._first = True
 
-        for img_path in self._all_images:
-            if(img_path == 'DJI_20230609124953_0102_D.JPG' or img_path == 'DJI_20230609125011_0111_D.JPG'):
-                continue
+        skip_images = ['DJI_20230609124953_0102_D.JPG', 'DJI_20230609125011_0111_D.JPG']
+        images_paths = [os.path.join(self._row_images_path, img_path) for img_path in self._all_images if img_path not in skip_images]
 
-            # Read row image 
-            complete_img_path = os.path.join(self._row_images_path, img_path)
-            frame = cv2.imread(complete_img_path)
+        # GPS and yaw of all the images at once, before the detection
+        exif_values = self._exif.read(images_paths)
+        self._gps = dict(zip(images_paths, exif_values[:, :2].tolist()))
+        self._yaws = dict(zip(images_paths, get_yaws(exif_values).tolist()))
 
-            # Detect plant and health status in image 
-            results = self._model.predict(frame)
-            health_status = np.array(results[0].boxes.conf.cpu().numpy().astype(float))
-            bboxes = self.filter_predictions(results)
+        for complete_img_path, frame, result in self._predictor.predict(images_paths):
+            if result is None:
+                continue
+            img_path = os.path.basename(complete_img_path)
+
+            # Detect plant and health status in image (the ONNX backend gives them already filtered)
+            if self._onnx:
+                bboxes, health_status = result
+            else:
+                results = [result]
+                health_status = np.array(results[0].boxes.conf.cpu().numpy().astype(float))
+                bboxes = self.filter_predictions(results)
 
             # Get middle plant detected 
             if(len(bboxes)):
@@ -249,16 +261,19 @@ class PlantDetector:
                 if self._health_middle_plant > -1:
                     self._all_health_status.append(self._health_middle_plant)
                     self._all_locations.append(self._location)
+                    self._all_yaws.append(self._yaws.get(complete_img_path, np.nan))
 
                     # Draw bbox around plant detected 
                     frame = self.draw_bbox(frame)
 
                     # Save and show detected plants in images
                     cv2.imwrite(self._save_images_folder + img_path, frame)
-                    cv2.imshow("Plant detected", cv2.resize(frame, None, fx=0.1, fy=0.1))
-                    if cv2.waitKey(1) & 0xFF == ord('s'):
-                        break
-        cv2.destroyAllWindows()
+                    if show:
+                        cv2.imshow("Plant detected", cv2.resize(frame, None, fx=0.1, fy=0.1))
+                        if cv2.waitKey(1) & 0xFF == ord('s'):
+                            break
+        if show:
+            cv2.destroyAllWindows()
 
 
 
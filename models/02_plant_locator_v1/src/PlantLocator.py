@@ -10,13 +10,13 @@ __status__ = "Production"
 __license__ = "MIT"
 
 import cv2
-import math
 import numpy as np
-from tqdm import tqdm
+
+from src.RayIntersection import angle2vector, intersect_rays_segments, yaw2angle
 
 
 class PlantLocator:
-    def __init__(self, image, mask, transform, all_coords, row_points, all_locations, all_health_status):
+    def __init__(self, image, mask, transform, coords, row_points, all_locations, all_health_status, all_yaws=None):
 
         self.R = 6371000 
         self._length = 3000  
@@ -26,21 +26,21 @@ class PlantLocator:
         self._alpha = 0.4
         self._INT_MAX = np.iinfo(np.int64).max
         self._angle = np.rad2deg(0.22673090865593348)      # This value is extracted from the image metadata (still not integrated in the flow)
-        self._drone_angle = np.radians(self._offset - 8.3) # This value is extracted from the image metadata (still not integrated in the flow
+        self._drone_yaw = -8.3  # Yaw of the images without gimbal or flight yaw in their metadata
+        self._drone_angle = yaw2angle(self._drone_yaw, self._offset)
 
         self._image = image
         self._mask = mask
         self._transform = transform
         self._size = image.shape[0:2]
-        self.__all_pixels = np.indices((self._size[0], self._size[1])).reshape(2, -1).T
 
-        self._all_coords = all_coords
+        self._coords = coords  # CoordinateService, conversion between pixels and GPS with the orthomosaic transform
         self._row_points = row_points
         self._all_locations = all_locations
         self._all_health_status = all_health_status
-        self._rows_pixels_location = None 
-        self._rows_location = None
-        self._blank_rows = self.draw_rows()
+        # Orientation of each drone from the yaw of its image (PlantDetector._all_yaws), the default one if missing
+        all_yaws = np.full(len(all_locations), np.nan) if all_yaws is None else np.asarray(all_yaws, dtype=np.float64)
+        self._drones_angles = yaw2angle(np.where(np.isnan(all_yaws), self._drone_yaw, all_yaws), self._offset)
 
 
     def draw_rows(self):
@@ -59,125 +59,109 @@ class PlantLocator:
         return blank_rows
     
 
-    def get_row_pixels(self): 
-        """
-        Retrieves the pixel locations of rows.
-
-        Returns:
-            list: List of row pixel locations.
+    def calculate_gps_distance(self, plocation, location) -> float:
         """
+        Calculates the great-circle distance between two GPS coordinates.
 
-        all_pixels = []
-        rows_mask = cv2.bitwise_and(self._blank_rows, self._blank_rows, mask=self._mask)
-        all_pixels_yx = np.transpose(np.where(rows_mask == 255))
-        self._rows_pixels_location = [np.flip(pixel) for pixel in all_pixels_yx]
-        
-        return self._rows_pixels_location
-    
-
-    def get_row_location(self) -> np.ndarray: 
-        """
-        Transforms row pixel locations to their corresponding locations in GPS.
+        Args:
+            plocation (tuple): Tuple of (latitude, longitude) for the first location.
+            location (tuple): Tuple of (latitude, longitude) for the second location.
 
         Returns:
-            numpy.ndarray: Array of row locations.
+            float: The calculated distance between the two locations.
         """
 
-        self._rows_location = np.array([np.flip(self._transform * pixel) for pixel in tqdm(self._rows_pixels_location)])
-        
-        return self._rows_location
+        return float(self._coords.gps_distances(plocation, location))
 
 
-    def calculate_gps_distance(self, plocation, location) -> float:
+    def get_possible_plant_locations(self, drones_pixel_loc, drones_angles=None) -> tuple[np.ndarray, np.ndarray]: 
         """
-        Calculates the great-circle distance between two GPS coordinates.
+        Retrieves possible pixel locations based on the drones' orientation: the intersections of the orientation
+        ray of every drone with every row, computed analytically (no image is drawn per drone).
 
         Args:
-            plocation (tuple): Tuple of (latitude, longitude) for the first location.
-            location (tuple): Tuple of (latitude, longitude) for the second location.
+            drones_pixel_loc (numpy.ndarray): Pixel locations (x, y) of the drones with shape (D, 2).
+            drones_angles (numpy.ndarray): Orientation of each drone in radians with shape (D,). If None, the
+                                           default orientation is used for all the drones.
 
         Returns:
-            float: The calculated distance between the two locations.
+            tuple: possible_pixels_loc (numpy.ndarray), pixel of each intersection with shape (D, R, 2), and
+                   valid (numpy.ndarray), True where the ray hits the row inside the vineyard mask, shape (D, R).
         """
 
-        plat, plon, lat, lon = map(math.radians, [plocation[0], plocation[1], location[0], location[1]])
-        dlat = plat - lat
-        dlon = plon - lon
-        a = math.sin(dlat/2)**2 + math.cos(lat) * math.cos(plat) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        distance = self.R * c
-        return distance
+        drones_pixel_loc = np.asarray(drones_pixel_loc).reshape(-1, 2)
+        row_points = np.asarray(self._row_points).reshape(-1, 2, 2)
+        drones_angles = self._drone_angle if drones_angles is None else drones_angles
+        distances, hits = intersect_rays_segments(drones_pixel_loc, angle2vector(drones_angles),
+                                                  row_points[:, 0], row_points[:, 1], self._length)
+
+        # Pixels of the intersections, only the ones inside the image and the vineyard mask
+        possible_pixels_loc = np.rint(hits).astype(int)
+        xs, ys = possible_pixels_loc[:, :, 0], possible_pixels_loc[:, :, 1]
+        valid = np.isfinite(distances) & (xs >= 0) & (xs < self._size[1]) & (ys >= 0) & (ys < self._size[0])
+        valid[valid] = self._mask[ys[valid], xs[valid]] > 0
+
+        return possible_pixels_loc, valid
 
 
-    def get_possible_plant_locations(self, drone_pixel_loc) -> list: 
+    def get_plants_locations(self, drones_pixel_loc, drones_loc, drones_angles=None) -> tuple[np.ndarray, np.ndarray]:
         """
-        Retrieves possible pixel locations based on the drone's orientation.
+        Determines the final location of all the plants at once: the intersection of each drone orientation with a
+        row that is closest to the drone's GPS location. Drones without intersections keep their own location.
 
         Args:
-            drone_pixel_loc (tuple): Tuple of (x, y) representing the drone's pixel location.
+            drones_pixel_loc (numpy.ndarray): Pixel locations (x, y) of the drones with shape (D, 2).
+            drones_loc (numpy.ndarray): GPS locations (latitude, longitude) of the drones with shape (D, 2).
+            drones_angles (numpy.ndarray): Orientation of each drone in radians with shape (D,). If None, the
+                                           default orientation is used for all the drones.
 
         Returns:
-            list: List of possible pixel locations.
+            tuple: Arrays with the final pixel locations (D, 2) and the corresponding GPS locations (D, 2).
         """
 
-        blank_orientation = np.zeros((self._size[0], self._size[1], 1), dtype=np.uint8)
+        drones_pixel_loc = np.asarray(drones_pixel_loc).reshape(-1, 2)
+        drones_loc = np.asarray(drones_loc, dtype=np.float64).reshape(-1, 2)
+        possible_pixels_loc, valid = self.get_possible_plant_locations(drones_pixel_loc, drones_angles)
+        if not valid.any():
+            return drones_pixel_loc, drones_loc
 
-        # Calculate the line representing the drone's orientation in the image 
-        x2 = int(drone_pixel_loc[0] + self._length * np.cos(self._drone_angle))
-        y2 = int(drone_pixel_loc[1] + self._length * np.sin(self._drone_angle))
-        blank_orientation = cv2.line(blank_orientation, (drone_pixel_loc[0], drone_pixel_loc[1]), (x2, y2), (255), 1)
-        
-        # Find positions of pixels where the intersection occurred between the drone orientation line and the vineyards row
-        blank_final = cv2.bitwise_and(blank_orientation, self._blank_rows)
-        pos_pixels_found = np.where(blank_final == 255)
-        possible_pixels_loc = list(zip(pos_pixels_found[1], pos_pixels_found[0])) # List of possible plant positions 
+        # GPS location of every intersection pixel and distance to the drone's location
+        possible_locs = self._coords.pixels_to_gps(possible_pixels_loc.reshape(-1, 2)).reshape(possible_pixels_loc.shape)
+        distances = np.where(valid, self._coords.gps_distances(drones_loc[:, None, :], possible_locs), np.inf)
 
-        return possible_pixels_loc
+        # Closest intersection of each drone (the first one if there are several)
+        idx = np.argmin(distances, axis=1)
+        found = valid.any(axis=1)[:, None]
+        drones = np.arange(len(drones_loc))
+        final_pixels_plant_loc = np.where(found, possible_pixels_loc[drones, idx], drones_pixel_loc)
+        final_plants_loc = np.where(found, possible_locs[drones, idx], drones_loc)
 
+        return final_pixels_plant_loc, final_plants_loc
 
-    def get_plant_location(self, drone_pixel_loc, drone_loc):
+
+    def get_plant_location(self, drone_pixel_loc, drone_loc, drone_angle=None):
         """
         Determines the final location of the drone and the nearest row based on its pixel location and GPS coordinates.
 
         Args:
             drone_pixel_loc (tuple): Tuple of (x, y) representing the drone's pixel location.
             drone_loc (tuple): Tuple of (latitude, longitude) representing the drone's GPS coordinates.
+            drone_angle (float): Orientation of the drone in radians. If None, the default orientation is used.
 
         Returns:
             tuple: Tuple containing the final pixel location and the corresponding GPS location.
         """
 
-        # Init variables
-        min_dist = self._INT_MAX
-        final_plant_loc = drone_loc
-        final_pixel_plant_loc = drone_pixel_loc
-
-        # Generate a list of possible plant locations 
-        possible_pixels_loc = self.get_possible_plant_locations(drone_pixel_loc)
-
-        # For each possible pixel location
-        for pos in possible_pixels_loc:
-            # For each row's pixel location and corresponding row location
-            for pixel_loc, row_loc in zip(self._rows_pixels_location, self._rows_location):
-                # Check if the current pixel location matches the possible position
-                if((pixel_loc == pos).all()):
-                    break
-
-            # Calculate distance between drone's location and the row's location
-            dist = self.calculate_gps_distance(drone_loc, row_loc)
-
-            # Update location if distance is smaller
-            if(dist < min_dist): 
-                min_dist = dist        
-                final_pixel_plant_loc = pixel_loc
-                final_plant_loc = row_loc
+        drone_angle = None if drone_angle is None else [drone_angle]
+        final_pixels_plant_loc, final_plants_loc = self.get_plants_locations([drone_pixel_loc], [drone_loc], drone_angle)
 
-        return final_pixel_plant_loc, final_plant_loc
+        return final_pixels_plant_loc[0], final_plants_loc[0]
 
 
     def get_drone_location(self, location):
         """
-        Determines the drone's pixel and GPS locations based on the provided GPS location.
+        Determines the drone's pixel and GPS locations based on the provided GPS location: the closest pixel of the
+        orthomosaic (inverse of the transform) and the GPS location of that pixel.
 
         Args:
             location (tuple): Tuple of (latitude, longitude) representing the target GPS location.
@@ -186,17 +170,25 @@ class PlantLocator:
             tuple: Tuple containing the drone's pixel location and its GPS location.
         """
 
-        min_dist = self._INT_MAX
+        drone_pixel_loc = self._coords.gps_to_pixels(location)[0]
+        drone_loc = self._coords.pixels_to_gps(drone_pixel_loc)[0]
 
-        for idx_coord, coord in tqdm(enumerate(self._all_coords), total = len(self._all_coords)):
-            dist = self.calculate_gps_distance(coord, location)
+        return drone_pixel_loc, drone_loc
 
-            if(dist < min_dist):
-                min_dist = dist
-                drone_loc = coord
-                drone_pixel_loc = self.__all_pixels[idx_coord]
 
-        return drone_pixel_loc, drone_loc
+    def get_drones_locations(self):
+        """
+        Determines the pixel and GPS locations of all the drone positions at once (same as get_drone_location
+        for each location, in one batched call).
+
+        Returns:
+            tuple: Arrays with the drones' pixel locations (N, 2) and their GPS locations (N, 2).
+        """
+
+        drones_pixel_loc = self._coords.gps_to_pixels(self._all_locations)
+        drones_loc = self._coords.pixels_to_gps(drones_pixel_loc)
+
+        return drones_pixel_loc, drones_loc
 
 
     def get_all_final_plant_locations(self):
@@ -207,18 +199,15 @@ class PlantLocator:
             tuple: Tuple containing lists of all pixel locations of the drone, final pixel locations of the plants, and GPS locations of the plants.
         """
 
-        all_pixel_drone_loc = []
-        all_pixel_plant_loc = []
-        all_plant_loc = []
+        # Pixel and GPS locations of all the drone positions
+        drones_pixel_loc, drones_loc = self.get_drones_locations()
 
-        for location in tqdm(self._all_locations):
+        # Plant locations of all the drone positions at once, each one with the orientation of its image
+        final_pixels_loc, final_locs = self.get_plants_locations(drones_pixel_loc, drones_loc, self._drones_angles)
 
-            drone_pixel_loc, drone_loc = self.get_drone_location(location)
-            final_pixel_loc, final_loc = self.get_plant_location(drone_pixel_loc, drone_loc)
-            
-            all_pixel_drone_loc.append(drone_pixel_loc)
-            all_pixel_plant_loc.append(final_pixel_loc)
-            all_plant_loc.append(final_loc)
+        all_pixel_drone_loc = list(drones_pixel_loc)
+        all_pixel_plant_loc = list(final_pixels_loc)
+        all_plant_loc = list(final_locs)
 
         return all_pixel_drone_loc, all_pixel_plant_loc, all_plant_loc
 
@@ -0,0 +1,128 @@
+""" Benchmark of the plant detector on the row images: YOLO (.pt) against the ONNX Runtime backend (FP32 and INT8) """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+
+import os
+import time
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from src.OnnxDetector import OnnxDetector
+
+
+# LOAD VARIABLES
+# ==========================================================================================
+
+model_path = "../01_plant_disease_detection_yolov8_v1/best.pt"
+row_images_path = "../../data/images_row/"
+
+MAX_IMAGES = 50          # Row images used in the benchmark (None: all)
+CALIBRATION_IMAGES = 20  # Row images used to calibrate the INT8 model
+IMGSZ = 640              # Input size of the exported model
+NUM_THREADS = None       # CPU threads used by ONNX Runtime (None: default)
+IOU_MATCH = 0.5          # Minimum IoU to match a detection of the ONNX model with one of the .pt model
+
+
+def box_iou(boxes1, boxes2):
+    """
+    Calculates the IoU between every pair of boxes (x1, y1, x2, y2).
+
+    Args:
+        boxes1 (numpy.ndarray): Boxes with shape (N, 4).
+        boxes2 (numpy.ndarray): Boxes with shape (M, 4).
+
+    Returns:
+        numpy.ndarray: IoU with shape (N, M).
+    """
+    boxes1, boxes2 = np.reshape(boxes1, (-1, 4)), np.reshape(boxes2, (-1, 4))
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+
+    return intersection / np.maximum(area1[:, None] + area2[None, :] - intersection, 1e-9)
+
+
+def middle_plant(frame, bboxes):
+    """ Index of the bounding box closest to the center of the frame (as GridPlantLocator.get_middle_plant) """
+    centers = (bboxes[:, :2] + bboxes[:, 2:]) / 2
+    return int(np.argmin(np.linalg.norm(centers - np.array([frame.shape[1] // 2, frame.shape[0] // 2]), axis=1)))
+
+
+def predict_pt(model, frame):
+    """ Detections of the YOLO model with the same filter as PlantDetector.filter_predictions """
+    result = model.predict([frame], verbose=False)[0]
+    confidences = np.array(result.boxes.conf.cpu().numpy().astype(float))
+    bboxes = np.array(result.boxes.xyxy.cpu().numpy())
+    return OnnxDetector.filter_predictions(bboxes, confidences), confidences
+
+
+def compare(reference, detections, frames):
+    """
+    Compares the detections of a backend with the reference (.pt) detections.
+
+    Returns:
+        dict: precision and recall of the boxes (IoU >= IOU_MATCH), mean absolute difference of the confidence of
+              the matched boxes and ratio of images where the middle plant and its (rounded) health are the same.
+    """
+    tp, n_detections, n_reference, conf_diffs, same_middle, n_middle = 0, 0, 0, [], 0, 0
+    for (ref_bboxes, ref_conf), (bboxes, conf), frame in zip(reference, detections, frames):
+        n_detections += len(bboxes)
+        n_reference += len(ref_bboxes)
+        if len(bboxes) and len(ref_bboxes):
+            iou = box_iou(bboxes, ref_bboxes)
+            matched = np.flatnonzero(iou.max(axis=1) >= IOU_MATCH)
+            tp += len(matched)
+            # Health of a box as read by the locators (confidence at the index of the filtered box)
+            conf_diffs.extend(np.abs(conf[matched] - ref_conf[iou.argmax(axis=1)[matched]]))
+
+        if len(ref_bboxes):
+            n_middle += 1
+            if len(bboxes):
+                idx_ref, idx = middle_plant(frame, ref_bboxes), middle_plant(frame, bboxes)
+                same_middle += int(box_iou(bboxes[idx], ref_bboxes[idx_ref])[0, 0] >= IOU_MATCH and
+                                   np.round(conf[idx]) == np.round(ref_conf[idx_ref]))
+
+    return {'precision': tp / max(n_detections, 1), 'recall': tp / max(n_reference, 1),
+            'conf_diff': float(np.mean(conf_diffs)) if conf_diffs else 0.0, 'middle_plant': same_middle / max(n_middle, 1)}
+
+
+def main():
+    images_paths = [os.path.join(row_images_path, img) for img in sorted(os.listdir(row_images_path))][:MAX_IMAGES]
+    frames = [frame for frame in (cv2.imread(path) for path in images_paths) if frame is not None]
+
+    onnx_path = OnnxDetector.export(model_path, IMGSZ)
+    int8_path = OnnxDetector.export(model_path, IMGSZ, int8=True, calibration_images=images_paths[:CALIBRATION_IMAGES])
+
+    # Reference: YOLO (.pt)
+    model = YOLO(model_path)
+    predict_pt(model, frames[0])  # Warm up
+    start = time.perf_counter()
+    reference = [predict_pt(model, frame) for frame in frames]
+    pt_time = (time.perf_counter() - start) / len(frames)
+    print(f".pt: {1000 * pt_time:.1f} ms/image")
+
+    for name, path in [('ONNX FP32', onnx_path), ('ONNX INT8', int8_path)]:
+        detector = OnnxDetector(path, num_threads=NUM_THREADS)
+        detector.predict([frames[0]])  # Warm up
+        start = time.perf_counter()
+        detections = [detector.predict([frame])[0] for frame in frames]
+        onnx_time = (time.perf_counter() - start) / len(frames)
+
+        metrics = compare(reference, detections, frames)
+        print(f"{name}: {1000 * onnx_time:.1f} ms/image ({pt_time / onnx_time:.2f}x), precision {metrics['precision']:.3f}, "
+              f"recall {metrics['recall']:.3f}, confidence difference {metrics['conf_diff']:.4f}, "
+              f"same middle plant {metrics['middle_plant']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+""" Benchmark of the intersection between drone lines and vineyard rows (LinesIntersection) with synthetic data """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+
+import time
+import numpy as np
+from src.LinesIntersection import LinesIntersection
+
+
+# LOAD VARIABLES
+# ==========================================================================================
+
+SIZES = [(1000, 100), (10000, 1000), (100000, 1000)]  # Number of drone images and number of rows
+FILTER_SIZES = [500, 1000, 2000]   # Number of drone images to compare filter_drones with the previous implementations
+PARCELS_PER_ROW = 50               # Parcels in each row
+IMAGE_SIZE = (20000, 20000)        # Size (height, width) of the synthetic orthomosaic in pixels
+DRONE_ANGLE = np.radians(-90 - 8.3)
+
+
+def create_data(n_drones, n_rows, rng):
+    """
+    Creates synthetic rows (almost horizontal lines), parcel centers along the rows and drone positions.
+
+    Args:
+        n_drones (int): Number of drone positions.
+        n_rows (int): Number of rows.
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        tuple: drones_pixels (N, 2), row_points (R, 2, 2) and centers (R * PARCELS_PER_ROW, 2).
+    """
+    h, w = IMAGE_SIZE
+    ys = np.linspace(0, h, n_rows, endpoint=False)
+    row_points = np.stack([np.stack([np.zeros(n_rows), ys], axis=1), np.stack([np.full(n_rows, w), ys + 0.02 * w], axis=1)], axis=1)
+
+    xs = np.linspace(0, w, PARCELS_PER_ROW, endpoint=False) + w / PARCELS_PER_ROW / 2
+    centers = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+    centers[:, 1] += 0.02 * centers[:, 0]
+
+    drones_pixels = np.stack([rng.integers(0, w, n_drones), rng.integers(0, h, n_drones)], axis=1)
+
+    return drones_pixels, row_points, centers
+
+
+def main():
+    rng = np.random.default_rng(0)
+
+    for n_drones, n_rows in SIZES:
+        drones_pixels, row_points, centers = create_data(n_drones, n_rows, rng)
+        parcels_points = np.zeros((len(centers), 4, 2), dtype=np.int32)
+
+        start = time.perf_counter()
+        inter = LinesIntersection(drones_pixels, DRONE_ANGLE, row_points, parcels_points, centers, [])
+        init_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        intersections = inter.get_drone_intersections()
+        intersections_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parcels_intersected = inter.get_parcels_intersected()
+        parcels_time = time.perf_counter() - start
+
+        n_found = int(np.sum(np.array(parcels_intersected) != -1))
+        print(f"{n_drones} drones x {n_rows} rows ({len(centers)} parcels): init {init_time:.3f} s, "
+              f"intersections {intersections_time:.3f} s, parcels {parcels_time:.3f} s, {n_found} drones with parcel")
+
+        start = time.perf_counter()
+        inter.filter_drones()
+        filter_time = time.perf_counter() - start
+        print(f"  filter_drones {filter_time:.3f} s")
+
+    # filter_drones against the previous implementations: the linear one has the same result as the quadratic one,
+    # while filter_drones keeps the image with the smallest distance of every parcel
+    for n_drones in FILTER_SIZES:
+        drones_pixels, row_points, centers = create_data(n_drones, 100, rng)
+        inter = LinesIntersection(drones_pixels, DRONE_ANGLE, row_points, np.zeros((len(centers), 4, 2)), centers, [])
+        inter.get_drone_intersections()
+        parcels = inter.get_parcels_intersected()
+        distances = inter.get_distances_intersected()
+
+        start = time.perf_counter()
+        selected = list(inter.filter_drones())
+        filter_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        selected_previous = LinesIntersection.select_drones_previous(parcels, distances)
+        previous_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        selected_quadratic = list(inter.filter_drones_quadratic())
+        quadratic_time = time.perf_counter() - start
+
+        best = {}
+        for idx, (parcel, distance) in enumerate(zip(parcels, distances)):
+            if parcel != -1 and (parcel not in best or distance < distances[best[parcel]]):
+                best[parcel] = idx
+        expected = len(parcels) * [-1]
+        for parcel, idx in best.items():
+            expected[idx] = parcel
+
+        print(f"filter_drones with {n_drones} drones: {filter_time:.4f} s, best image per parcel: {selected == expected}; "
+              f"previous implementation {quadratic_time:.3f} s (linear {previous_time:.4f} s, same result: {selected_previous == selected_quadratic})")
+
+if __name__ == "__main__":
+    main()
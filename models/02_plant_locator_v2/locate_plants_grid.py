@@ -11,9 +11,12 @@ __license__ = "MIT"
 
 
 import cv2 
-from src.read import read_json, read_list_json, read_transform_and_mask
+from src.read import read_json, read_list_json, read_grid, read_transform_and_mask
 from src.GridPlantLocator import GridPlantLocator
+from src.CoordinateService import CoordinateService
 from src.Output import Output
+from src.ResultStore import ResultStore
+from src.PlantPipeline import PlantPipeline
 
 
 # LOAD VARIABLES 
@@ -24,47 +27,57 @@ image_path = "../../data/images/orthomosaic_cropped_230609.tif" # Created with A
 row_points_path = "../../data/features/parallel_rows_points1.json"  # Extracted with the file: UC1_Crop_Monitoring/top_view/create_grid/get_plant_rows.py
 parcels_points_path = "../../data/features/parcel_points1.json" 
 centers_parcels_path = "../../data/features/parcel_centers_points1.json" 
+grid_path = None  # Binary grid (rows, parcels and centers) used instead of the JSON files above, e.g. "../../data/features/parcel_grid_oriented.npz"
+                  # written by create_grid: it is the same grid as the *_oriented.json files, not the *1.json files
 date = image_path.split('/')[-1].split('.')[0].split('_')[-1]
 
-gps_path = "../../data/features/all_coords.json"  # This was extracted from the orthomosaic information (code still not provided)
-model_path = "../01_plant_disease_detection_yolov8_v1/best.pt"
+model_path = "../01_plant_disease_detection_yolov8_v1/best.pt"  # A .onnx model (exported with OnnxDetector.export) runs with ONNX Runtime
 save_images_path = "../../data/"
 row_images_path = "../../data/images_row/"
+exif_cache_path = "../../data/features/exif_index.sqlite"  # GPS of the row images, only new or modified images are read again
+pipeline_store_path = "../../data/features/plant_pipeline.sqlite"  # Results of each stage for each row image, a re-run only processes the new images
 #"/run/media/noumena/nmn_dufry/ICAERUS/01-MEDIA/RAW_IMAGES/ROWS/230609_D/"
 
+# Plant detection parameters
+BATCH_SIZE = 8      # Row images given to the model at once
+NUM_WORKERS = 4     # Threads that read the row images ahead of the model
+NUM_THREADS = None  # CPU threads used by the model (None: default of torch / ONNX Runtime)
+
 # Load image   
 image = cv2.imread(image_path)
 transform, mask = read_transform_and_mask(image_path)
 
 # Read the points that define each row 
-row_points = read_json(row_points_path)
-parcels_points = read_list_json(parcels_points_path)
-centers_parcels = read_list_json(centers_parcels_path)
+if grid_path is not None:
+    grid = read_grid(grid_path)
+    row_points, parcels_points, centers_parcels = grid['row_points'], grid['quads'], grid['centers']
+    grid_files = [grid_path]
+else:
+    row_points = read_json(row_points_path)
+    parcels_points = read_list_json(parcels_points_path)
+    centers_parcels = read_list_json(centers_parcels_path)
+    grid_files = [row_points_path, parcels_points_path, centers_parcels_path]
 
-# Read GPS coordinates for every pixel in orthomosaic image
-print("Loading gps coordinates...")
-all_coords = read_json(gps_path)
+# Conversion between pixels and GPS coordinates with the orthomosaic transform (replaces all_coords.json)
+coords = CoordinateService.from_raster(image_path)
 
 
 # PROCESSING
 # ==========================================================================================
 
 # Create GridPlantLocator class variable
-gridPlant = GridPlantLocator(image, transform, model_path, all_coords, row_points, row_images_path, parcels_points, centers_parcels, save_images_path)
-
-# Get GPS position of the drones from the row images
-all_row_images, all_drone_gps_locations = gridPlant.get_drones_gps_location(row_images_path)
-
-
-# Get pixel location of the drones transforming its GPS location to pixel using the transform matrix of the orthomosaic 
-all_drone_pixels_locations = gridPlant.get_drones_pixels_locations()
-
-# Match the pixel position of the drone in the orthomosaic to the closest parcel depending on the orientation of the drone
-print("Matching parcels to drone images")
-parcels_selected, parcels_points_flatten = gridPlant.match_parcel_to_row_image()
-
-# For each drone position, perform yolo detection of the image and classify plants into the global image  
-all_health_status = gridPlant.track_plants(False)
+gridPlant = GridPlantLocator(image, transform, model_path, coords, row_points, row_images_path, parcels_points, centers_parcels, save_images_path, BATCH_SIZE, NUM_WORKERS, NUM_THREADS, exif_cache_path)
+
+# Results of each stage are recomputed only if the orthomosaic, the grid or the model change
+locate_params = ResultStore.params(image_path, *grid_files)
+detect_params = ResultStore.params(model_path)
+pipeline = PlantPipeline(gridPlant, ResultStore(pipeline_store_path), locate_params, detect_params)
+
+# For each row image not processed yet: get the GPS position of the drone, transform it to pixel using the transform
+# matrix of the orthomosaic, match it to the closest parcel depending on the orientation of the drone and perform
+# the yolo detection of the image. Then one image per parcel is selected with the results of all the images
+all_row_images, all_drone_gps_locations, all_drone_pixels_locations, parcels_selected, all_health_status = pipeline.run(row_images_path)
+parcels_points_flatten = gridPlant.calc.get_parcels_points_flatten()
 
 
 
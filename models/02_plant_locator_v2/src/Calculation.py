@@ -15,8 +15,8 @@ __license__ = "MIT"
 import cv2 
 import math
 import numpy as np 
-from PIL import Image
-from PIL.ExifTags import TAGS
+
+from src.ExifIndex import read_exif
 
 
 class Calculation:
@@ -24,8 +24,13 @@ class Calculation:
 
         self._image = image
         self._transform = transform
-        self._parcels_points_flatten = [parcel for row in parcels_points for parcel in row]
-        self._centers_points_flatten = [center for row in centers_parcels for center in row]
+        # Parcels and centers of the binary grid are already flat arrays (N, 4, 2) and (N, 2), the JSON ones are nested by rows
+        if isinstance(parcels_points, np.ndarray):
+            self._parcels_points_flatten = parcels_points
+            self._centers_points_flatten = np.asarray(centers_parcels)
+        else:
+            self._parcels_points_flatten = [parcel for row in parcels_points for parcel in row]
+            self._centers_points_flatten = [center for row in centers_parcels for center in row]
 
         self._R = 6371000 
         self._tri_size = 25
@@ -55,24 +60,16 @@ class Calculation:
 
     def get_gps_info(self, image_path) -> None:
         """
-        Extracts GPS coordinates from the EXIF metadata of an image file.
+        Extracts GPS coordinates from the EXIF metadata of an image file (only the header of the JPEG is read).
 
         Args:
             image_path (str): Path to the input image file.
         """
 
-        # Extract EXIF information from the image
-        img = Image.open(image_path)
-        info_exif = img._getexif()
-
-        # Iterate through EXIF tags to find GPSInfo and store GPS coordinates
-        for tag, value in info_exif.items():
-            tag_name = TAGS.get(tag, tag)
-            if tag_name == 'GPSInfo':
-                lat = self.dms2dd(value[2], value[1])
-                lon = self.dms2dd(value[4], value[3])
-                return [lat, lon]
-        return [-1, -1]
+        lat, lon = read_exif(image_path)[:2]
+        if np.isnan(lat) or np.isnan(lon):
+            return [-1, -1]
+        return [lat, lon]
 
 
     def calculate_gps_distance(self, ploc, loc) -> float:
@@ -0,0 +1,225 @@
+""" Index of the GPS, altitude and yaw of the row images, read from the JPEG headers only and cached in SQLite """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import os
+import re
+import struct
+import sqlite3
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+EXIF_INDEX_VERSION = 1  # Increase it when FIELDS or the parsing change, the cache is then rebuilt
+FIELDS = ('lat', 'lon', 'alt', 'relative_alt', 'gimbal_yaw', 'flight_yaw')
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8}
+_XMP_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+_DJI_TAGS = re.compile(rb'drone-dji:(\w+)(?:="|>)\s*([-+]?[0-9.]+)')
+
+
+def read_app1(image_path):
+    """
+    Reads the EXIF and XMP (APP1) segments of a JPEG, without reading the compressed image: the markers are
+    followed until the start of the scan and the other segments (e.g. the DJI previews) are skipped.
+
+    Args:
+        image_path (str): Path to the JPEG image.
+
+    Returns:
+        tuple: exif (bytes), the TIFF structure of the EXIF segment, and xmp (bytes), the XMP packet. None if missing.
+    """
+    exif, xmp = None, None
+    with open(image_path, 'rb') as f:
+        if f.read(2) != b'\xff\xd8':
+            return exif, xmp
+
+        while exif is None or xmp is None:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):  # End of image or start of scan
+                break
+            if 0xD0 <= marker[1] <= 0xD7 or marker[1] == 0x01:  # Markers without length
+                continue
+
+            length = struct.unpack('>H', f.read(2))[0]
+            if marker[1] == 0xE1:
+                data = f.read(length - 2)
+                if data.startswith(b'Exif\x00\x00'):
+                    exif = data[6:]
+                elif data.startswith(_XMP_HEADER):
+                    xmp = data[len(_XMP_HEADER):]
+            else:
+                f.seek(length - 2, 1)
+
+    return exif, xmp
+
+
+def _read_ifd(tiff, offset, endian):
+    """ Entries of an IFD of the TIFF structure as {tag: value} (rationals as floats) """
+    entries = {}
+    if offset <= 0 or offset + 2 > len(tiff):
+        return entries
+
+    n_entries = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    for k in range(n_entries):
+        entry = offset + 2 + 12 * k
+        if entry + 12 > len(tiff):
+            break
+        tag, typ, count = struct.unpack_from(endian + 'HHI', tiff, entry)
+        size = _TYPE_SIZES.get(typ, 0) * count
+        if size == 0:
+            continue
+        value_offset = entry + 8 if size <= 4 else struct.unpack_from(endian + 'I', tiff, entry + 8)[0]
+        if value_offset + size > len(tiff):
+            continue
+
+        if typ in (5, 10):
+            values = struct.unpack_from(endian + ('I' if typ == 5 else 'i') * 2 * count, tiff, value_offset)
+            entries[tag] = [num / den if den else np.nan for num, den in zip(values[::2], values[1::2])]
+        elif typ == 2:
+            entries[tag] = tiff[value_offset:value_offset + size].split(b'\x00')[0].decode('ascii', 'ignore')
+        elif typ in (3, 4, 9):
+            entries[tag] = list(struct.unpack_from(endian + {3: 'H', 4: 'I', 9: 'i'}[typ] * count, tiff, value_offset))
+        else:
+            entries[tag] = tiff[value_offset:value_offset + size]
+
+    return entries
+
+
+def _dms2dd(dms, geodir):
+    """ Degrees, minutes and seconds to decimal degrees (negative to the south and west) """
+    if dms is None or len(dms) < 3:
+        return np.nan
+    dd = -1 if geodir in ['S', 'W', 'O'] else 1
+    return (dms[0] + dms[1] / 60 + dms[2] / 3600) * dd
+
+
+def parse_exif(exif, xmp=None) -> tuple:
+    """
+    Extracts the GPS position and altitude from the EXIF segment, and the relative altitude and yaw of the gimbal
+    and of the drone from the DJI XMP packet.
+
+    Args:
+        exif (bytes): TIFF structure of the EXIF segment.
+        xmp (bytes): XMP packet.
+
+    Returns:
+        tuple: Values in the order of FIELDS (lat, lon, alt, relative_alt, gimbal_yaw, flight_yaw), nan if missing.
+    """
+    lat, lon, alt = np.nan, np.nan, np.nan
+    if exif and len(exif) >= 8 and exif[:2] in (b'II', b'MM'):
+        endian = '<' if exif[:2] == b'II' else '>'
+        ifd0 = _read_ifd(exif, struct.unpack_from(endian + 'I', exif, 4)[0], endian)
+        gps = _read_ifd(exif, ifd0[0x8825][0], endian) if 0x8825 in ifd0 else {}
+
+        lat = _dms2dd(gps.get(2), gps.get(1))
+        lon = _dms2dd(gps.get(4), gps.get(3))
+        if 6 in gps:
+            alt = gps[6][0] * (-1 if gps.get(5, b'\x00')[:1] == b'\x01' else 1)
+
+    dji = {name.decode(): float(value) for name, value in _DJI_TAGS.findall(xmp)} if xmp else {}
+
+    return (lat, lon, alt, dji.get('RelativeAltitude', np.nan), dji.get('GimbalYawDegree', np.nan),
+            dji.get('FlightYawDegree', np.nan))
+
+
+def read_exif(image_path) -> tuple:
+    """
+    Reads the GPS position, altitude and yaw of an image from its header only.
+
+    Args:
+        image_path (str): Path to the JPEG image.
+
+    Returns:
+        tuple: Values in the order of FIELDS, nan if missing.
+    """
+    try:
+        return parse_exif(*read_app1(image_path))
+    except (OSError, struct.error):
+        return (np.nan,) * len(FIELDS)
+
+
+def get_yaws(exif_values, default_yaw=np.nan) -> np.ndarray:
+    """
+    Gets the yaw of the camera of each image: the gimbal yaw, or the flight yaw if the gimbal yaw is missing.
+
+    Args:
+        exif_values (numpy.ndarray): Values with shape (N, len(FIELDS)), as given by ExifIndex.read.
+        default_yaw (float): Yaw of the images without gimbal nor flight yaw.
+
+    Returns:
+        numpy.ndarray: Yaws in degrees with shape (N,).
+    """
+    exif_values = np.asarray(exif_values, dtype=np.float64).reshape(-1, len(FIELDS))
+    gimbal_yaw = exif_values[:, FIELDS.index('gimbal_yaw')]
+    flight_yaw = exif_values[:, FIELDS.index('flight_yaw')]
+
+    return np.where(np.isnan(gimbal_yaw), np.where(np.isnan(flight_yaw), default_yaw, flight_yaw), gimbal_yaw)
+
+
+
+class ExifIndex:
+    def __init__(self, cache_path=None, num_workers=8):
+        """
+        Opens the sidecar SQLite cache of the EXIF values (one row per image, keyed by path, modification time and
+        size). Images already in the cache and not modified are not opened again: a re-run only costs a stat() per image.
+
+        Args:
+            cache_path (str): Path to the SQLite file. If None, the values are only kept in memory.
+            num_workers (int): Number of threads that read the headers of the new or modified images.
+        """
+        self._num_workers = max(int(num_workers), 1)
+        self._db = sqlite3.connect(cache_path if cache_path is not None else ':memory:')
+
+        # The cache of a previous format is rebuilt
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != EXIF_INDEX_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS exif')
+            self._db.execute(f'PRAGMA user_version = {EXIF_INDEX_VERSION}')
+        self._db.execute('CREATE TABLE IF NOT EXISTS exif (path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, '
+                         + ', '.join(f'{field} REAL' for field in FIELDS) + ')')
+        self._db.commit()
+
+
+    def read(self, images_paths) -> np.ndarray:
+        """
+        Gets the EXIF values of the images, reading (in parallel) only the headers of the images that are not in the
+        cache or have been modified, and saving them in the cache.
+
+        Args:
+            images_paths (list): Paths of the images.
+
+        Returns:
+            numpy.ndarray: Values with shape (N, len(FIELDS)), in the order of FIELDS and of images_paths, nan if missing.
+        """
+        paths = [os.path.abspath(image_path) for image_path in images_paths]
+        stats = [os.stat(path) for path in paths]
+        keys = [(stat.st_mtime_ns, stat.st_size) for stat in stats]
+
+        cached = {}
+        for k in range(0, len(paths), 500):
+            chunk = paths[k:k + 500]
+            query = f'SELECT * FROM exif WHERE path IN ({", ".join("?" * len(chunk))})'
+            cached.update({row[0]: row[1:] for row in self._db.execute(query, chunk)})
+
+        stale = [k for k, path in enumerate(paths) if path not in cached or tuple(cached[path][:2]) != keys[k]]
+        if stale:
+            with ThreadPoolExecutor(self._num_workers) as pool:
+                parsed = list(pool.map(read_exif, [paths[k] for k in stale]))
+
+            rows = [(paths[k], *keys[k], *[None if np.isnan(v) else float(v) for v in values]) for k, values in zip(stale, parsed)]
+            with self._db:
+                self._db.executemany(f'INSERT OR REPLACE INTO exif VALUES ({", ".join("?" * (3 + len(FIELDS)))})', rows)
+            cached.update({row[0]: row[1:] for row in rows})
+
+        return np.array([cached[path][2:] for path in paths], dtype=np.float64).reshape(-1, len(FIELDS))
+
+
+    def close(self) -> None:
+        self._db.close()
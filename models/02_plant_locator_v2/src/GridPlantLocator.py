@@ -13,31 +13,37 @@ import os
 import cv2 
 import numpy as np 
 from ultralytics import YOLO
-from scipy.spatial import KDTree
 
 from src.LinesIntersection import LinesIntersection
+from src.RayIntersection import angle2vector, intersect_rays_segments, yaw2angle
 from src.Display import Display
 from src.Calculation import Calculation
+from src.BatchPredictor import BatchPredictor
+from src.OnnxDetector import OnnxDetector
+from src.ExifIndex import ExifIndex, get_yaws
 
 
 class GridPlantLocator:
-    def __init__(self, image, transform, model_path, all_coords, row_points, row_images_path, parcels_points, centers_points, save_images_folder):
+    def __init__(self, image, transform, model_path, coords, row_points, row_images_path, parcels_points, centers_points, save_images_folder, batch_size=8, num_workers=4, num_threads=None, exif_cache_path=None):
         
         self._image = image
         self._size = image.shape[0:2]
-        self._all_pixels = np.indices((self._size[0], self._size[1])).reshape(2, -1).T
         self._transform = transform
-        self._model = YOLO(model_path)
-        self._all_coords = all_coords
+        self._onnx = model_path.endswith('.onnx')  # Exported model (OnnxDetector.export) run with ONNX Runtime
+        self._model = OnnxDetector(model_path, num_threads=num_threads) if self._onnx else YOLO(model_path)
+        self._predictor = BatchPredictor(self._model, batch_size, num_workers, num_threads)  # Batched inference of the row images
+        self._exif = ExifIndex(exif_cache_path, 2 * num_workers)  # GPS of the row images, cached by path and modification time
+        self._coords = coords  # CoordinateService, conversion between pixels and GPS with the orthomosaic transform
         self._row_points = row_points
         self._row_images_path = row_images_path
         self._all_images = sorted(os.listdir(row_images_path))
         
         self._length = 3000  
         self._offset = -90
-        self._drone_angle = np.radians(self._offset - 8.3) # This value is extracted from the image metadata (still not integrated in the flow
+        self._drone_yaw = -8.3  # Yaw of the images without gimbal or flight yaw in their metadata
+        self._drone_angle = yaw2angle(self._drone_yaw, self._offset)
+        self._drone_angles = None  # Angle of each drone, from the yaw of each row image (get_drones_gps_location)
         self._INT_MAX = np.iinfo(np.int64).max
-        self._first = True
 
         self.calc = Calculation(image, row_points, parcels_points, centers_points)
         self._parcels_points_flatten = self.calc.get_parcels_points_flatten()
@@ -56,86 +62,98 @@ class GridPlantLocator:
         for image_name in sorted(os.listdir(row_images_path)):
             image_path = row_images_path + image_name
             self._all_row_images.append(image_path)
-            self._drone_gps_locations.append(self.calc.get_gps_info(image_path))
+
+        # GPS of all the images at once from the EXIF index ([-1, -1] if an image has no GPS, as Calculation.get_gps_info)
+        exif_values = self._exif.read(self._all_row_images)
+        gps = exif_values[:, :2]
+        self._drone_gps_locations = np.where(np.isnan(gps).any(axis=1, keepdims=True), -1, gps).tolist()
+
+        # Orientation of each drone from the gimbal (or flight) yaw of its image
+        self._drone_angles = yaw2angle(get_yaws(exif_values, self._drone_yaw), self._offset)
         
         return self._all_row_images, self._drone_gps_locations
 
 
     def get_drones_pixels_locations(self):
         """
-        Determines the drone's pixel location based on its GPS position and the orthomosaic GPS relation between pixels.
+        Determines the drone's pixel location based on its GPS position and the orthomosaic transform
+        (closest pixel to every drone location, all at once).
         """
 
-        # Build a KDTree for the orthomosaic coordinates
-        tree = KDTree(self._all_coords)
-
-        # Find the closest coordinates from orthomosaic coordinates to the drones locations
-        distances, indexes = tree.query(self._drone_gps_locations)
-
-        # Get the drone coordinates related to the orthomosaic and its pixels
-        drone_orthomosaic = self._all_coords[indexes]
-        self._drone_pixels_locations = self._all_pixels[indexes]
+        self._drone_pixels_locations = self._coords.gps_to_pixels(self._drone_gps_locations)
 
         return self._drone_pixels_locations
 
 
-    def drone_in_parcel(self, parcel_image, drone_pixel) -> list: 
+    def drone_in_parcel(self, parcel_image, drone_pixel, drone_angle=None) -> list: 
 
-        drone_inside = False
         all_selected_parcels = []
         all_distances = []
-        blank_orientation = np.zeros((self._size[0], self._size[1], 1), dtype=np.uint8)
 
-        # Calculate the line representing the drone's orientation in the image 
-        x2 = int(drone_pixel[0] + self._length * np.cos(self._drone_angle))
-        y2 = int(drone_pixel[1] + self._length * np.sin(self._drone_angle))
-        blank_orientation = cv2.line(blank_orientation, (drone_pixel[0], drone_pixel[1]), (x2, y2), (255), 1)
-        
-        # Find positions of pixels where the intersection occurred between the drone orientation line and actual parcel
-        blank_final = cv2.bitwise_and(blank_orientation, self._blank_rows)
-
-        #blank_final = cv2.bitwise_and(blank_orientation, parcel_image)
-        pos_pixels_found = np.where(blank_final == 255)
-        possible_pixels_loc = list(zip(pos_pixels_found[1], pos_pixels_found[0])) # List of possible plant positions 
-        if(possible_pixels_loc):
-            drone_inside = True
-            
-            if(self._first):
-                self._first = False
-                self._blank_or = cv2.bitwise_or(blank_orientation, self._blank_rows)
-            else: 
-                self._blank_or = cv2.bitwise_or(self._blank_or, blank_orientation)
-                
-            min_dist = self._INT_MAX
-            selected_parcel = -1
-            for possible_drone_pixel in possible_pixels_loc: 
-
-                distances = np.linalg.norm(np.array(self._centers_points_flatten) - np.array(possible_drone_pixel), axis=1)
-                idx_center = np.argmin(distances)
-                center_parcel = self._centers_points_flatten[idx_center]
-
-                dist_original = np.linalg.norm(possible_drone_pixel - drone_pixel)
-
-                if(dist_original < min_dist):
-                    min_dist = dist_original
-                    selected_parcel = center_parcel
-                    idx_parcel = idx_center
-
-            all_selected_parcels.append(selected_parcel) 
-            all_distances.append(min_dist)
+        # Intersections between the drone orientation ray and the rows, computed analytically (no image drawn per drone)
+        row_points = np.asarray(self._row_points).reshape(-1, 2, 2)
+        drone_angle = self._drone_angle if drone_angle is None else drone_angle
+        distances, hits = intersect_rays_segments(drone_pixel, angle2vector(drone_angle), row_points[:, 0], row_points[:, 1], self._length)
+
+        if np.isfinite(distances).any():
+            # Intersection closest to the drone and the parcel whose center is closest to it
+            idx_row = np.argmin(distances[0])
+            distances_centers = np.linalg.norm(np.asarray(self._centers_points_flatten) - hits[0, idx_row], axis=1)
+            idx_center = np.argmin(distances_centers)
+
+            all_selected_parcels.append(self._centers_points_flatten[idx_center]) 
+            all_distances.append(distances[0, idx_row])
 
         return all_selected_parcels, all_distances
         
         
     def match_parcel_to_row_image(self):
       
-        inter = LinesIntersection(self._drone_pixels_locations, self._drone_angle, self._row_points, self._parcels_points_flatten, self._centers_points_flatten, self._all_row_images) 
+        drone_angles = self._drone_angle if self._drone_angles is None else self._drone_angles
+        inter = LinesIntersection(self._drone_pixels_locations, drone_angles, self._row_points, self._parcels_points_flatten, self._centers_points_flatten, self._all_row_images) 
         inter.get_drone_intersections()
         self._parcels_drones = inter.get_parcels_intersected()
         self._parcels_selected = inter.filter_drones()
         self.display.draw_drones_and_parcels(self._drone_pixels_locations, self._parcels_selected)
 
         return self._parcels_selected, self._parcels_points_flatten
+
+
+    def locate_images(self, images_paths):
+        """
+        Locates a group of row images at once (first stage of PlantPipeline): GPS and orientation from the EXIF index,
+        pixel in the orthomosaic and parcel intersected by the drone. The selection of one image per parcel
+        (LinesIntersection.select_drones) needs all the images, so it is not done here.
+
+        Args:
+            images_paths (list): Paths of the row images.
+
+        Returns:
+            tuple: gps (list) [lat, lon] of each image ([-1, -1] if missing), pixels (numpy.ndarray) with shape (N, 2),
+                   parcels (list) intersected (-1 if none) and distances (list) between the intersection and the parcel center.
+        """
+
+        exif_values = self._exif.read(images_paths)
+        gps = exif_values[:, :2]
+        gps = np.where(np.isnan(gps).any(axis=1, keepdims=True), -1, gps).tolist()
+        pixels = self._coords.gps_to_pixels(gps)
+        angles = yaw2angle(get_yaws(exif_values, self._drone_yaw), self._offset)
+
+        inter = LinesIntersection(pixels, angles, self._row_points, self._parcels_points_flatten, self._centers_points_flatten, images_paths)
+        inter.get_drone_intersections()
+        parcels = inter.get_parcels_intersected()
+
+        return gps, pixels, parcels, inter.get_distances_intersected()
+
+
+    def load_results(self, drone_pixels_locations, parcels_selected, all_health_status):
+        """
+        Sets the results of all the row images (e.g. the ones collected by PlantPipeline) to draw them with draw_grid.
+        """
+
+        self._drone_pixels_locations = drone_pixels_locations
+        self._parcels_selected = parcels_selected
+        self._all_health_status = all_health_status
     
 
     def filter_predictions(self, results) -> np.ndarray:
@@ -176,29 +194,56 @@ class GridPlantLocator:
         return middle_plant, health_status
     
 
+    def detect_images(self, images_paths):
+        """
+        Detects the middle plant of each row image and its health status (second stage of PlantPipeline).
+        The images are read ahead and detected in batches (see BatchPredictor), in order.
+
+        Args:
+            images_paths (list): Paths of the row images.
+
+        Yields:
+            tuple: image_path (str), frame (numpy.ndarray, None if the image could not be read), middle_plant
+                   (numpy.ndarray, None if no plant is detected) and health_status (float, -1 if no plant is detected).
+        """
+
+        for complete_img_path, frame, result in self._predictor.predict(images_paths):
+            if result is None:
+                yield complete_img_path, None, None, -1
+                continue
+
+            # Detect plant and health status in image (the ONNX backend gives them already filtered)
+            if self._onnx:
+                bboxes, health_status_frame = result
+            else:
+                results = [result]
+                health_status_frame = np.array(results[0].boxes.conf.cpu().numpy().astype(float))
+                bboxes = self.filter_predictions(results)
+
+            # Get middle plant detected 
+            if(len(bboxes)):
+                middle_plant, health_status = self.get_middle_plant(complete_img_path, frame, bboxes, health_status_frame)
+                yield complete_img_path, frame, middle_plant, health_status
+            else:
+                yield complete_img_path, frame, None, -1
+    
+
     def track_plants(self, show=False) -> None:
         """
         Tracks plants in a series of images, saves their health status and locations, and displays images with detected plants.
+        The images are read ahead and detected in batches (see BatchPredictor), in order.
         """
 
         self._all_health_status = len(self._all_images) * [-1]
+        images_paths = [os.path.join(self._row_images_path, img_path) for img_path in self._all_images]
 
-        for idx, img_path in enumerate(self._all_images):
+        for idx, (complete_img_path, frame, middle_plant, health_status) in enumerate(self.detect_images(images_paths)):
+            img_path = self._all_images[idx]
             
-            if(self._parcels_selected != -1):
-
-                # Read row image 
-                complete_img_path = os.path.join(self._row_images_path, img_path)
-                frame = cv2.imread(complete_img_path)
-
-                # Detect plant and health status in image 
-                results = self._model.predict(frame)
-                health_status_frame = np.array(results[0].boxes.conf.cpu().numpy().astype(float))
-                bboxes = self.filter_predictions(results)
+            if(self._parcels_selected != -1 and frame is not None):
 
                 # Get middle plant detected 
-                if(len(bboxes)):
-                    middle_plant, health_status = self.get_middle_plant(complete_img_path, frame, bboxes, health_status_frame)
+                if(middle_plant is not None):
                     self._all_health_status[idx] = health_status
                     
                     if(show):
@@ -13,17 +13,21 @@ __license__ = "MIT"
 import cv2
 import numpy as np
 from tqdm import tqdm 
+from scipy.spatial import cKDTree
 
 
 class LinesIntersection:
-    def __init__(self, drones_pixels, drone_angle, row_points, parcel_points_flatten, center_parcels_flatten, row_images):
+    def __init__(self, drones_pixels, drone_angle, row_points, parcel_points_flatten, center_parcels_flatten, row_images, chunk_size=4096):
         self._drones_pixels = drones_pixels
         self._drone_angle = drone_angle
         self._drone_vector = self.drone2vector()
-        self._row_lines = [self.points2line(p1, p2) for p1, p2 in row_points]
+        row_points = np.asarray(row_points, dtype=np.float64).reshape(-1, 2, 2)
+        self._row_lines = self.points2line(row_points[:, 0], row_points[:, 1])  # Arrays A, B, C with shape (R,)
         self._row_images = row_images
         self._parcels_points_flatten = np.array(parcel_points_flatten)
         self._center_parcels_flatten = np.array(center_parcels_flatten)
+        self._centers_tree = cKDTree(self._center_parcels_flatten.reshape(-1, 2))  # Closest parcel center to a point
+        self._chunk_size = chunk_size  # Drones solved at once, bounds the memory of the (drones, rows) matrices
         self._INT_MAX = np.iinfo(np.int64).max
 
         self._intersections = []
@@ -31,75 +35,169 @@ class LinesIntersection:
         self._distances_intersected = []
 
 
+    # Direction of the drones: (2,) for one angle for all the drones, (D, 2) for an angle per drone (from the image yaw)
     def drone2vector(self):
-        d = np.array([np.cos(self._drone_angle), np.sin(self._drone_angle)])
+        drone_angle = np.asarray(self._drone_angle, dtype=np.float64)
+        d = np.stack([np.cos(drone_angle), np.sin(drone_angle)], axis=-1)
         return d
 
 
     def points2line(self, p1, p2):
         """
-        Transforms row lines defined by two points to line equation: Ax + By = C
+        Transforms row lines defined by two points to line equation: Ax + By = C (points (2,) or arrays (R, 2))
         """
-        x1, y1 = p1
-        x2, y2 = p2
+        x1, y1 = np.asarray(p1)[..., 0], np.asarray(p1)[..., 1]
+        x2, y2 = np.asarray(p2)[..., 0], np.asarray(p2)[..., 1]
         A = y2 - y1
         B = x1 - x2
         C = A * x1 + B * y1
         return A, B, C
 
 
-    # Calculates intersection between drone vector and row lines
-    def intersection_drone_row(self, A, B, C, drone_pixel):
-        numerador = C - A * drone_pixel[0] - B * drone_pixel[1]
-        denominador = A * self._drone_vector[0] + B * self._drone_vector[1]
-        if denominador != 0:
-            return numerador / denominador
-        else:
-            return float('inf')  # No hay intersección si el denominador es 0
+    # Calculates intersection between drone vector and row lines, for all drones (D, 2) and rows (R,) at once: t with shape (D, R)
+    def intersection_drone_row(self, A, B, C, drone_pixel, drone_vector=None):
+        drone_pixel = np.asarray(drone_pixel, dtype=np.float64).reshape(-1, 2)
+        drone_vector = np.broadcast_to(self._drone_vector if drone_vector is None else drone_vector, drone_pixel.shape)
+        numerador = C[None, :] - A[None, :] * drone_pixel[:, 0, None] - B[None, :] * drone_pixel[:, 1, None]
+        denominador = A[None, :] * drone_vector[:, 0, None] + B[None, :] * drone_vector[:, 1, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = numerador / denominador
+        return np.where(denominador != 0, t, np.inf)  # No hay intersección si el denominador es 0
 
 
 
     def get_drone_intersections(self): 
-        
-        for drone_pixel in tqdm(self._drones_pixels): 
+        """
+        Gets the first intersection (smallest t >= 0) between the line of each drone and a row, [-1, -1] if there is none.
+        All drones x rows are solved with one broadcast per chunk of drones, each drone with its own direction if an
+        angle per drone is given (flights with mixed headings).
+        """
+        drones_pixels = np.asarray(self._drones_pixels, dtype=np.float64).reshape(-1, 2)
+        drones_vectors = np.broadcast_to(self._drone_vector, drones_pixels.shape)
+        A, B, C = self._row_lines
+        self._intersections = np.full((len(drones_pixels), 2), -1.0)
+
+        for start in range(0, len(drones_pixels), self._chunk_size): 
+            pixels = drones_pixels[start:start + self._chunk_size]
+            vectors = drones_vectors[start:start + self._chunk_size]
+
             # Look for the first intersection between the drone line and a row
-            t_min = float('inf')
-            linea_interseccion = None
-
-            for row in self._row_lines:
-                A, B, C = row
-                t = self.intersection_drone_row(A, B, C, drone_pixel)
-                if 0 <= t < t_min:
-                    t_min = t
-                    line_intersected = row
-
-            if line_intersected:
-                self._intersections.append(drone_pixel + t_min * self._drone_vector)
-            else:
-                self._intersections.append([-1,-1])
+            t = self.intersection_drone_row(A, B, C, pixels, vectors)
+            t_min = np.where(t >= 0, t, np.inf).min(axis=1, initial=np.inf)
+            line_intersected = np.isfinite(t_min)
+
+            self._intersections[start:start + len(pixels)][line_intersected] = pixels[line_intersected] + t_min[line_intersected, None] * vectors[line_intersected]
         
         return self._intersections
 
 
     def get_parcels_intersected(self): 
+        """
+        Gets the parcel whose center is closest to each drone intersection (one KD-tree query for all the drones).
+        Drones that are too close to that parcel are filtered (-1).
+        """
+        intersections = np.asarray(self._intersections, dtype=np.float64).reshape(-1, 2)
+        drones_pixels = np.asarray(self._drones_pixels, dtype=np.float64).reshape(-1, 2)
+        parcels_intersected = np.full(len(intersections), -1, dtype=np.int64)
+        distances_intersected = np.full(len(intersections), self._INT_MAX, dtype=np.float64)
+
+        valid = np.flatnonzero(np.any(intersections != -1, axis=1))
+        if len(valid) and len(self._center_parcels_flatten):
+            distances, idx_centers = self._centers_tree.query(intersections[valid])
+
+            # Filter drones that are too close to any parcel 
+            dist_drone_position = np.linalg.norm(self._center_parcels_flatten[idx_centers] - drones_pixels[valid], axis=1)
+            selected = dist_drone_position > 20
 
-        self._parcels_intersected = len(self._intersections) * [-1]
-        self._distances_intersected = len(self._intersections) * [self._INT_MAX]
+            parcels_intersected[valid[selected]] = idx_centers[selected]
+            distances_intersected[valid[selected]] = distances[selected]
 
-        for id_, (drone_intersection, drone_pixel) in tqdm(enumerate(zip(self._intersections, self._drones_pixels)), total=len(self._intersections), desc="Getting parcels intersected"): 
-            if not np.array_equal(drone_intersection, np.array([-1, -1])):
-                distances = np.linalg.norm(self._center_parcels_flatten - drone_intersection, axis=1)
-                idx_center = np.argmin(distances)
-                
-                # Filter drones that are too close to any parcel 
-                dist_drone_position = np.linalg.norm(self._center_parcels_flatten[idx_center] - drone_pixel)
+        self._parcels_intersected = parcels_intersected.tolist()
+        self._distances_intersected = distances_intersected.tolist()
 
-                if(dist_drone_position > 20):
-                    self._parcels_intersected[id_] = idx_center
-                    self._distances_intersected[id_] = distances[idx_center]
+        return self._parcels_intersected
+
+
+    def get_distances_intersected(self):
+        return self._distances_intersected
 
 
     def filter_drones(self):
+        """
+        Keeps one drone image per parcel (see select_drones) with the parcels intersected by the drones.
+        """
+        self._parcels_selected = self.select_drones(self._parcels_intersected, self._distances_intersected)
+
+        return self._parcels_selected
+
+
+    @staticmethod
+    def select_drones(parcels_intersected, distances_intersected):
+        """
+        Keeps one drone image per parcel: the image with the smallest distance to the parcel center (stable argmin,
+        ties go to the first image). The images are grouped by parcel with a single sort, O(n log n).
+
+        Args:
+            parcels_intersected (list): Parcel intersected by each drone image (-1 if none), in the order of the images.
+            distances_intersected (list): Distance between the intersection of each drone and its parcel center.
+
+        Returns:
+            list: Parcel selected for each drone image, -1 if the image is not selected.
+        """
+        parcels = np.asarray(parcels_intersected, dtype=np.int64).reshape(-1)
+        distances = np.asarray(distances_intersected, dtype=np.float64).reshape(-1)
+        parcels_selected = np.full(len(parcels), -1, dtype=np.int64)
+
+        valid = np.flatnonzero(parcels != -1)
+        if len(valid):
+            # Images sorted by parcel, then distance, then image index: the first one of each parcel is the best
+            order = valid[np.lexsort((valid, distances[valid], parcels[valid]))]
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = parcels[order[1:]] != parcels[order[:-1]]
+            parcels_selected[order[first]] = parcels[order[first]]
+
+        return parcels_selected.tolist()
+
+
+    @staticmethod
+    def select_drones_previous(parcels_intersected, distances_intersected):
+        """
+        Previous selection in linear time, kept as a reference to benchmark select_drones. Same result as
+        filter_drones_quadratic, which does not keep one image per parcel: only the first and the last image of a
+        parcel are compared, and every later image (also of other parcels or without parcel) overwrites the last
+        selected index with its own parcel, e.g. parcels [5, 7, 5] give [5, 5, -1] and [5, 7, -1] give [5, -1, -1].
+
+        Args:
+            parcels_intersected (list): Parcel intersected by each drone image (-1 if none), in the order of the images.
+            distances_intersected (list): Distance between the intersection of each drone and its parcel center.
+
+        Returns:
+            list: Parcel selected for each drone image, -1 if the image is not selected.
+        """
+        # Last image of each parcel
+        last_index = {}
+        for idx, parcel in enumerate(parcels_intersected):
+            last_index[parcel] = idx
+
+        parcels_filtered = set()
+        parcels_selected = len(parcels_intersected) * [-1]
+        sel_idx = None
+        for idx1, parcel in enumerate(parcels_intersected):
+            if parcel != -1 and parcel not in parcels_filtered:
+                idx2 = last_index[parcel]
+                sel_idx = idx1 if distances_intersected[idx1] < distances_intersected[idx2] else idx2
+
+            parcels_filtered.add(parcel)
+            if sel_idx is not None:
+                parcels_selected[sel_idx] = parcel
+
+        return parcels_selected
+
+
+    def filter_drones_quadratic(self):
+        """
+        Previous O(n^2) implementation of filter_drones, kept as a reference to check and benchmark it.
+        """
 
         parcels_filtered = []
         self._parcels_selected = len(self._parcels_intersected) * [-1]
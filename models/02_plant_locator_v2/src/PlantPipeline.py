@@ -0,0 +1,141 @@
+""" Streaming and resumable pipeline to locate the plants of the row images, with the results of each stage stored """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import os
+import numpy as np
+from tqdm import tqdm
+
+from src.LinesIntersection import LinesIntersection
+from src.ResultStore import ResultStore
+
+
+class PlantPipeline:
+    def __init__(self, grid_plant, store, locate_params, detect_params, chunk_size=256, commit_every=32):
+        """
+        Initializes the pipeline. The row images are streamed in chunks through the stages 'locate' (EXIF, pixel
+        and parcel of each image) and 'detect' (middle plant and health status), and the results are appended to the
+        store as they are obtained. A re-run (e.g. after a crash or with new images) only processes the images
+        without results.
+
+        Args:
+            grid_plant (GridPlantLocator): Locator that computes the stages.
+            store (ResultStore): Store of the results.
+            locate_params (str): Parameters of the 'locate' stage (see ResultStore.params), e.g. orthomosaic and grid.
+            detect_params (str): Parameters of the 'detect' stage, e.g. the model.
+            chunk_size (int): Number of images that go through the stages at once.
+            commit_every (int): Number of detections saved at once (detections lost at most in a crash).
+        """
+        self._grid_plant = grid_plant
+        self._store = store
+        self._locate_params = locate_params
+        self._detect_params = detect_params
+        self._chunk_size = max(int(chunk_size), 1)
+        self._commit_every = max(int(commit_every), 1)
+
+
+    def locate(self, images_paths, keys) -> dict:
+        """
+        Runs the 'locate' stage for a group of images and saves the results.
+
+        Returns:
+            dict: Result of each image, by key.
+        """
+        gps, pixels, parcels, distances = self._grid_plant.locate_images(images_paths)
+        results = [{'gps': [float(v) for v in g], 'pixel': [int(v) for v in p], 'parcel': int(parcel), 'distance': float(distance)}
+                   for g, p, parcel, distance in zip(gps, pixels, parcels, distances)]
+        self._store.append('locate', keys, results, self._locate_params)
+
+        return dict(zip(keys, results))
+
+
+    def detect(self, images_paths, keys) -> dict:
+        """
+        Runs the 'detect' stage for a group of images, saving the results every commit_every images.
+
+        Returns:
+            dict: Result of each image, by key.
+        """
+        detected = {}
+        pending_keys, pending_results = [], []
+        for key, (_, frame, middle_plant, health_status) in zip(keys, self._grid_plant.detect_images(images_paths)):
+            result = {'readable': frame is not None, 'middle_plant': None if middle_plant is None else [float(v) for v in middle_plant],
+                      'health': float(health_status)}
+            detected[key] = result
+            pending_keys.append(key)
+            pending_results.append(result)
+
+            if len(pending_keys) >= self._commit_every:
+                self._store.append('detect', pending_keys, pending_results, self._detect_params)
+                pending_keys, pending_results = [], []
+
+        if pending_keys:
+            self._store.append('detect', pending_keys, pending_results, self._detect_params)
+
+        return detected
+
+
+    def collect(self, images_paths, keys, located, detected):
+        """
+        Joins the results of all the images (in order) and keeps one image per parcel, as match_parcel_to_row_image
+        and track_plants do. The results are also loaded in the locator to draw them (GridPlantLocator.draw_grid).
+
+        Returns:
+            tuple: all_row_images (list), all_drone_gps_locations (list), all_drone_pixels_locations (numpy.ndarray),
+                   parcels_selected (list) and all_health_status (list).
+        """
+        all_drone_gps_locations = [located[key]['gps'] for key in keys]
+        all_drone_pixels_locations = np.array([located[key]['pixel'] for key in keys], dtype=int).reshape(-1, 2)
+        parcels_selected = LinesIntersection.select_drones([located[key]['parcel'] for key in keys], [located[key]['distance'] for key in keys])
+
+        # Images without plants detected are not selected
+        all_health_status = len(keys) * [-1]
+        for idx, key in enumerate(keys):
+            if detected[key]['readable']:
+                if detected[key]['middle_plant'] is not None:
+                    all_health_status[idx] = detected[key]['health']
+                else:
+                    parcels_selected[idx] = -1
+
+        self._grid_plant.load_results(all_drone_pixels_locations, parcels_selected, all_health_status)
+
+        return images_paths, all_drone_gps_locations, all_drone_pixels_locations, parcels_selected, all_health_status
+
+
+    def run(self, row_images_path):
+        """
+        Processes the row images that do not have results yet, chunk by chunk, and collects the results of all of them.
+
+        Args:
+            row_images_path (str): Folder of the row images.
+
+        Returns:
+            tuple: Same as collect.
+        """
+        images_paths = [row_images_path + image_name for image_name in sorted(os.listdir(row_images_path))]
+        keys = ResultStore.image_keys(images_paths)
+        located = self._store.completed('locate', keys, self._locate_params)
+        detected = self._store.completed('detect', keys, self._detect_params)
+
+        pending = [idx for idx, key in enumerate(keys) if key not in located or key not in detected]
+        print(f"{len(keys) - len(pending)} row images already processed, {len(pending)} to process")
+
+        for start in tqdm(range(0, len(pending), self._chunk_size), desc="Pipeline chunks"):
+            chunk = pending[start:start + self._chunk_size]
+
+            to_locate = [idx for idx in chunk if keys[idx] not in located]
+            if to_locate:
+                located.update(self.locate([images_paths[idx] for idx in to_locate], [keys[idx] for idx in to_locate]))
+
+            to_detect = [idx for idx in chunk if keys[idx] not in detected]
+            if to_detect:
+                detected.update(self.detect([images_paths[idx] for idx in to_detect], [keys[idx] for idx in to_detect]))
+
+        return self.collect(images_paths, keys, located, detected)
@@ -0,0 +1,81 @@
+""" Functions to intersect the drone orientation rays with the vineyard rows analytically """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import numpy as np
+
+
+def angle2vector(angle):
+    """
+    Transforms an orientation angle into a unit direction vector.
+
+    Args:
+        angle (float or numpy.ndarray): Angle or angles (N,) in radians, in image coordinates.
+
+    Returns:
+        numpy.ndarray: Direction vectors (x, y) with shape (2,) or (N, 2).
+    """
+    angle = np.asarray(angle, dtype=np.float64)
+    return np.stack([np.cos(angle), np.sin(angle)], axis=-1)
+
+
+def yaw2angle(yaw, offset=-90):
+    """
+    Transforms the yaw of the drone or gimbal (degrees clockwise from north, as in the DJI metadata) into the
+    orientation angle in the image, for an orthomosaic with the north up.
+
+    Args:
+        yaw (float or numpy.ndarray): Yaw or yaws (N,) in degrees.
+        offset (float): Angle of the north in the image in degrees (-90: up).
+
+    Returns:
+        float or numpy.ndarray: Angle or angles (N,) in radians, in image coordinates.
+    """
+    return np.radians(offset + np.asarray(yaw, dtype=np.float64))
+
+
+def intersect_rays_segments(origins, directions, points1, points2, max_length=np.inf):
+    """
+    Intersects every ray with every segment at once (all drones x all rows), without drawing them on an image.
+    Ray d: origins[d] + t * directions[d], segment r: points1[r] + u * (points2[r] - points1[r]), with u in [0, 1].
+
+    Args:
+        origins (numpy.ndarray): Origins of the rays (x, y) with shape (D, 2), e.g. the drones' pixel locations.
+        directions (numpy.ndarray): Directions of the rays with shape (2,) (same for all the rays) or (D, 2).
+        points1 (numpy.ndarray): Start points of the segments (x, y) with shape (R, 2), e.g. the rows.
+        points2 (numpy.ndarray): End points of the segments (x, y) with shape (R, 2).
+        max_length (float): Maximum length of the rays (e.g. the length of the drawn orientation line).
+
+    Returns:
+        tuple: distances (numpy.ndarray), distance along each ray to each segment with shape (D, R), inf where
+               the ray does not hit the segment, and hits (numpy.ndarray), intersection points with shape (D, R, 2).
+    """
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    directions = np.broadcast_to(np.asarray(directions, dtype=np.float64), origins.shape)
+    directions = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    points1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+    points2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+
+    # Cross products of the 2x2 system (D, R): origin + t * direction = point1 + u * segment
+    segments = points2 - points1
+    w_x = points1[None, :, 0] - origins[:, None, 0]
+    w_y = points1[None, :, 1] - origins[:, None, 1]
+    denominator = directions[:, None, 0] * segments[None, :, 1] - directions[:, None, 1] * segments[None, :, 0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (w_x * segments[None, :, 1] - w_y * segments[None, :, 0]) / denominator
+        u = (w_x * directions[:, None, 1] - w_y * directions[:, None, 0]) / denominator
+
+    # Parallel rays (denominator 0) do not intersect
+    hit = (denominator != 0) & (t >= 0) & (t <= max_length) & (u >= 0) & (u <= 1)
+    distances = np.where(hit, t, np.inf)
+    hits = origins[:, None, :] + np.where(hit, t, 0)[:, :, None] * directions[:, None, :]
+
+    return distances, hits
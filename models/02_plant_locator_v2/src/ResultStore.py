@@ -0,0 +1,112 @@
+""" Append-only store of the results of each stage of the plant locator pipeline, one row per image, in SQLite """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2023, Noumena"
+__credits__ = ["Esther Vera, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import os
+import json
+import sqlite3
+
+
+RESULT_STORE_VERSION = 1  # Increase it when the results of a stage change, the store is then rebuilt
+
+
+class ResultStore:
+    def __init__(self, store_path):
+        """
+        Opens (or creates) the store. Results are only appended: the result of an image is identified by the stage,
+        the path, the modification time and size of the image and the parameters of the stage (e.g. the model),
+        so a modified image or a new model gives new rows and the previous ones are kept.
+
+        Args:
+            store_path (str): Path to the SQLite file.
+        """
+        self._db = sqlite3.connect(store_path)
+        self._db.execute('PRAGMA journal_mode = WAL')  # Committed results survive a crash of the process
+
+        if self._db.execute('PRAGMA user_version').fetchone()[0] != RESULT_STORE_VERSION:
+            self._db.execute('DROP TABLE IF EXISTS results')
+            self._db.execute(f'PRAGMA user_version = {RESULT_STORE_VERSION}')
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (stage TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, '
+                         'params TEXT, data TEXT, PRIMARY KEY (stage, path, mtime_ns, size, params))')
+        self._db.commit()
+
+
+    @staticmethod
+    def image_keys(images_paths) -> list:
+        """
+        Gets the key of each image: absolute path, modification time and size (one stat() per image).
+
+        Args:
+            images_paths (list): Paths of the images.
+
+        Returns:
+            list: Keys (path, mtime_ns, size).
+        """
+        keys = []
+        for image_path in images_paths:
+            stat = os.stat(image_path)
+            keys.append((os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size))
+        return keys
+
+
+    @staticmethod
+    def params(*paths, **values) -> str:
+        """
+        Describes the parameters of a stage with the files it depends on (path and modification time) and other
+        values, so the results are computed again when one of them changes.
+
+        Args:
+            *paths (str): Files used by the stage (e.g. the model or the orthomosaic). Missing files are skipped.
+            **values: Other parameters of the stage.
+
+        Returns:
+            str: Parameters of the stage.
+        """
+        files = {os.path.abspath(path): os.stat(path).st_mtime_ns for path in paths if os.path.exists(path)}
+        return json.dumps({'files': files, **values}, sort_keys=True)
+
+
+    def completed(self, stage, keys, params) -> dict:
+        """
+        Gets the results of a stage for the images that have already been processed with the same parameters.
+
+        Args:
+            stage (str): Name of the stage.
+            keys (list): Keys of the images (see image_keys).
+            params (str): Parameters of the stage (see params).
+
+        Returns:
+            dict: Result of each processed image, by key.
+        """
+        keys = set(keys)
+        results = {}
+        for path, mtime_ns, size, data in self._db.execute('SELECT path, mtime_ns, size, data FROM results WHERE stage = ? AND params = ?', (stage, params)):
+            if (path, mtime_ns, size) in keys:
+                results[(path, mtime_ns, size)] = json.loads(data)
+        return results
+
+
+    def append(self, stage, keys, results, params) -> None:
+        """
+        Appends the results of a stage for some images, in one transaction.
+
+        Args:
+            stage (str): Name of the stage.
+            keys (list): Keys of the images (see image_keys).
+            results (list): Result of each image (JSON serializable).
+            params (str): Parameters of the stage (see params).
+        """
+        rows = [(stage, *key, params, json.dumps(result)) for key, result in zip(keys, results)]
+        with self._db:
+            self._db.executemany('INSERT OR IGNORE INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+
+    def close(self) -> None:
+        self._db.close()
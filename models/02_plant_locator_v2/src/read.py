@@ -10,9 +10,13 @@ __status__ = "Production"
 __license__ = "MIT"
 
 import json 
+import struct
+import zipfile
 import rasterio 
 import numpy as np 
 
+GRID_FORMAT_VERSION = 1  # Version of the parcel grid file (.npz) written by top_view/create_grid
+
 
 def read_json(json_path): 
     """
@@ -46,6 +50,53 @@ def read_list_json(json_path):
     return data
 
 
+def read_grid(grid_path): 
+    """
+    Reads the parcel grid file (.npz) saved with UC1_Crop_Monitoring/top_view/create_grid/get_plant_rows.py.
+    The arrays are memory-mapped, so no Python object is created per parcel as when reading the JSON files.
+
+    Args:
+        grid_path (str): The path to the .npz file.
+
+    Returns:
+        grid (dict): Grid arrays: quads (N, 4, 2), centers (N, 2), areas (N,), rows (N,), cols (N,),
+                     row_offsets (R + 1,) and row_points (K, 2, 2).
+    """
+    grid = {}
+    with zipfile.ZipFile(grid_path) as archive, open(grid_path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+
+            # Compressed members can not be memory-mapped
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    grid[name] = np.lib.format.read_array(member)
+                continue
+
+            # The .npy file starts after the local file header (30 bytes, file name and extra field)
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if len(shape) == 0 or np.prod(shape) == 0:
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                grid[name] = np.lib.format.read_array(f)
+            else:
+                grid[name] = np.memmap(grid_path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                       order='F' if fortran_order else 'C')
+
+    version = int(grid.pop('format_version', 0))
+    if version != GRID_FORMAT_VERSION:
+        raise ValueError(f"Unsupported parcel grid version {version} in {grid_path}, expected {GRID_FORMAT_VERSION}")
+
+    return grid
+
+
 def read_transform_and_mask(image_path): 
     """
     Reads an image file using rasterio and extracts its transformation matrix and mask.
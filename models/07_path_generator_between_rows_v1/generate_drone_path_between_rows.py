@@ -19,12 +19,12 @@ import cv2
 # VARIABLES 
 # ===============================================================================================
 
-# If true, the start point for the first row can be defined manually; if false, it will use the predefined coordinate
+# If true, the start point for the first row can be defined manually; if false, it will be estimated from the vegetation mask
 select_points = False 
 
 # Depending on the vineyard or the image size, this should be defined 
 VINEYARD_HEIGHT = 85  # Height of the vineyard row (original ortho size)
-VINEYARD_SEP = 296    # Separation between vineyards rows (original ortho size)
+VINEYARD_SEP = None   # Separation between vineyards rows (original ortho size). None to estimate it from the vegetation mask (296 for 230609)
 
 # Paths to saved data
 base_path = './../../data/'
@@ -15,6 +15,8 @@ import numpy as np
 from tqdm import tqdm
 import matplotlib.pyplot as plt
 
+from src.RowEstimator import RowEstimator
+
 
 class VineyardRowDetector:
     def __init__(self, ortho_image, mask, VINEYARD_HEIGHT, VINEYARD_SEP) -> None:
@@ -25,17 +27,22 @@ class VineyardRowDetector:
             ortho_image (np.ndarray): The orthomosaic image of the vineyard.
             mask (np.ndarray): The mask defining the vineyard area.
             VINEYARD_HEIGHT (int): Height parameter for vineyard row visualization.
-            VINEYARD_SEP (float): Separation between vineyard rows in pixels.
+            VINEYARD_SEP (float): Separation between vineyard rows in pixels. If None, it is estimated from the vegetation mask.
         """
         self._lower_red = np.array([0, 120, 70])
         self._upper_red = np.array([10, 255, 255])
         self._coordinates = []
+        self._row_estimator = None
         self._vineyard_height = VINEYARD_HEIGHT    
         self._vineyard_sep = VINEYARD_SEP    
         self._ortho_image = ortho_image
         self._mask = mask
         self._ortho_image_rows = copy.deepcopy(ortho_image)
         self._smoothed_mask = self.smooth_mask()
+        # Vineyard area, and vineyard area grown 3 px (long lines of thickness 2 are drawn up to ~2.5 px away
+        # from their ideal position), to check if a row is visible
+        self._visible_area = self._smoothed_mask > 0
+        self._visible_area_dilated = cv2.dilate(self._smoothed_mask, np.ones((7, 7), np.uint8)) > 0
         self._h, self._w, _ = self._ortho_image_rows.shape
 
 
@@ -82,7 +89,8 @@ class VineyardRowDetector:
 
         Args:
             select_points (bool): If True, allows manual point selection via mouse clicks;
-                                  if False, uses predefined coordinates in self._coordinates.
+                                  if False, the row closest to the center of the vineyard is estimated
+                                  from the vegetation mask.
         """
         # Manual selection 
         if select_points:
@@ -103,9 +111,85 @@ class VineyardRowDetector:
         else:
             # self._coordinates = [[69, 750], [2298, 237]]    # Image size 50%
             # self._coordinates = [[568, 867], [1215, 718]]   # Image size (4692, 3610)
-            self._coordinates = [[2250, 3453], [4876, 2855]]  # Original size image (14441, 18767)
+            # self._coordinates = [[2250, 3453], [4876, 2855]]  # Original size image (14441, 18767)
+            self._coordinates = self.get_row_estimator().get_row_coordinates()
             self._angle = np.arctan2(self._coordinates[1][1] - self._coordinates[0][1], self._coordinates[1][0] - self._coordinates[0][0])
 
+        # Separation between rows estimated from the vegetation mask if it is not defined
+        if self._vineyard_sep is None:
+            self._vineyard_sep = self.get_row_estimator().spacing
+
+
+    def get_row_estimator(self) -> RowEstimator:
+        """
+        Estimates the orientation, separation and position of the rows from the vegetation mask (only once).
+
+        Returns:
+            row_estimator (RowEstimator): Estimator with the angle, spacing and offset of the rows.
+        """
+        if self._row_estimator is None:
+            self._row_estimator = RowEstimator(self._ortho_image, self._mask)
+            self._row_estimator.estimate()
+
+        return self._row_estimator
+
+
+    def get_visible_lines(self, points1, points2) -> np.ndarray:
+        """
+        Checks which lines cross the vineyard area. The smoothed mask is sampled along all the lines at once
+        (one vectorized gather, at most one pixel between samples) instead of drawing each line on a blank image.
+        Only the lines that touch the border of the vineyard area, where sampling and drawing a line of thickness 2
+        can differ, are drawn to get the same result.
+
+        Args:
+            points1 (np.ndarray): Start points (x, y) of the lines, with shape (K, 2).
+            points2 (np.ndarray): End points (x, y) of the lines, with shape (K, 2).
+
+        Returns:
+            np.ndarray: Boolean array with shape (K,), True where the line is visible.
+        """
+        p1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+        p2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+        d = p2 - p1
+
+        # Clip the lines to the image plus a margin of 4 px, lines just outside can still reach the image (Liang-Barsky)
+        t_min = np.zeros(len(p1))
+        t_max = np.ones(len(p1))
+        sides = [(-d[:, 0], p1[:, 0] + 4), (d[:, 0], (self._w + 3) - p1[:, 0]),
+                 (-d[:, 1], p1[:, 1] + 4), (d[:, 1], (self._h + 3) - p1[:, 1])]
+        for p, q in sides:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = q / p
+            t_min = np.where(p < 0, np.maximum(t_min, r), t_min)
+            t_max = np.where(p > 0, np.minimum(t_max, r), t_max)
+            t_max = np.where((p == 0) & (q < 0), -1, t_max)
+        inside = t_min <= t_max
+        if not np.any(inside):
+            return inside
+
+        # Sample the clipped segments
+        c1 = p1 + t_min[:, None] * d
+        c2 = p1 + t_max[:, None] * d
+        n_samples = int(np.ceil(np.abs(c2 - c1)[inside].max())) + 1
+        steps = np.linspace(0, 1, n_samples)
+        xs = np.rint(c1[:, 0, None] + steps * (c2[:, 0] - c1[:, 0])[:, None]).astype(np.intp)
+        ys = np.rint(c1[:, 1, None] + steps * (c2[:, 1] - c1[:, 1])[:, None]).astype(np.intp)
+        in_image = (xs >= 0) & (xs < self._w) & (ys >= 0) & (ys < self._h)
+        xs = np.clip(xs, 0, self._w - 1)
+        ys = np.clip(ys, 0, self._h - 1)
+
+        # Lines whose center crosses the vineyard area are visible, lines close to it must be checked
+        visible = inside & (self._visible_area[ys, xs] & in_image).any(axis=1)
+        border = inside & ~visible & self._visible_area_dilated[ys, xs].any(axis=1)
+
+        # Lines in the border of the vineyard area are drawn as before
+        for k in np.flatnonzero(border):
+            blank_rows = np.zeros((self._h, self._w), dtype=np.uint8)
+            cv2.line(blank_rows, tuple(points1[k]), tuple(points2[k]), 255, 2)
+            visible[k] = np.any(cv2.bitwise_and(blank_rows, blank_rows, mask=self._smoothed_mask))
+
+        return visible
+
 
     def get_parallel_rows(self) -> list:
         """
@@ -116,7 +200,6 @@ class VineyardRowDetector:
             The coordinates of these rows are not adjusted for the actual length of the rows in the image, they are larger. 
         """
         added_length = 20000 # Added length to initial row to cover the whole image 
-        reached = False      # Varible to stop drawing parallel lines
         self._parallel_rows_points = []
 
         #  Init and final coordinates of the selected row
@@ -131,42 +214,31 @@ class VineyardRowDetector:
         v_dir_normalized = (v_dir[0] / length, v_dir[1] / length)
         v_perp = (-v_dir_normalized[1], v_dir_normalized[0]) 
 
-        # Draws parallel lines until it reaches the limits of the image
-        it = -1
-        while True:
-            # Draws the parallel lines in each direction (up - down)
-            if(reached):
-                it -= 1
-            else:
-                it += 1
-
-            # Calculates the points of the new parallel line (not adjusted for the image size)
-            x1_parallel = x1 + it * self._vineyard_sep * v_perp[0] - added_length * v_dir_normalized[0]
-            y1_parallel = y1 + it * self._vineyard_sep * v_perp[1] - added_length * v_dir_normalized[1]
-            x2_parallel = x2 + it * self._vineyard_sep * v_perp[0] + added_length * v_dir_normalized[0]
-            y2_parallel = y2 + it * self._vineyard_sep * v_perp[1] + added_length * v_dir_normalized[1]
-
-            point1 = (int(x1_parallel), int(y1_parallel))
-            point2 = (int(x2_parallel), int(y2_parallel))
-
-            # Check if the line is visible 
-            blank_rows = np.zeros((self._h, self._w, 1), dtype=np.uint8)
-            cv2.line(blank_rows, point1, point2, (255), 2)
-            rows_mask = cv2.bitwise_and(blank_rows, blank_rows, mask=self._smoothed_mask)
-            visible_pixels_yx = np.transpose(np.where(rows_mask == 255))
-
-            # If line is not visible, change the direction of drawing new parallel lines
-            if(len(visible_pixels_yx) == 0 and not reached):
-                reached = True
-                it = 0
-
-            # If line is not visible, and we already changed the direction, stop drawing parallel rows
-            elif(len(visible_pixels_yx) == 0 and reached):
-                break
-
-            else:   # Saves the rows points and draw a red line marking the row
+        # Candidate parallel lines: every offset whose line can cross the image
+        corners = np.array([[0, 0], [self._w, 0], [0, self._h], [self._w, self._h]]) - [x1, y1]
+        projections = corners @ np.array(v_perp) / self._vineyard_sep
+        its = np.arange(int(np.floor(projections.min())) - 1, int(np.ceil(projections.max())) + 2)
+
+        # Calculates the points of all the parallel lines (not adjusted for the image size)
+        offsets = its[:, None] * self._vineyard_sep * np.array(v_perp)
+        extension = added_length * np.array(v_dir_normalized)
+        points1 = np.trunc([x1, y1] + offsets - extension).astype(int)
+        points2 = np.trunc([x2, y2] + offsets + extension).astype(int)
+
+        # Check which lines are visible, all of them at once
+        visible = self.get_visible_lines(points1, points2)
+        index = {it: k for k, it in enumerate(its.tolist())}
+
+        # Keeps the parallel lines in each direction (up - down) until the first one that is not visible
+        for it, it_step in [(0, 1), (-1, -1)]:
+            while it in index and visible[index[it]]:
+                point1 = tuple(points1[index[it]].tolist())
+                point2 = tuple(points2[index[it]].tolist())
+
+                # Saves the rows points and draw a red line marking the row
                 self._parallel_rows_points.append([point1, point2])
                 cv2.line(self._ortho_image_rows, point1, point2, (0,0,255), self._vineyard_height)
+                it += it_step
 
         # The coordinates of these rows are not adjusted for the actual length of the rows in the image, they are larger. 
         return self._parallel_rows_points
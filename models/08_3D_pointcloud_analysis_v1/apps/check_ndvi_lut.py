@@ -0,0 +1,59 @@
+"""
+Check of ColorAnalysis.rgb_to_ndvi (inverse LUT) against the brute-force argmin over the LUT of every color.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from extract_analysis.analysis import ColorAnalysis
+
+N_RANDOM = 100000  # Random colors of the test set
+N_NEAR = 50000     # Colors close to the LUT entries (where the nearest entries are close to each other)
+
+
+def rgb_to_ndvi_brute_force(colors, lut):
+    """
+    Previous implementation of rgb_to_ndvi: distance of each color to every LUT entry (uint8 difference lut - c)
+    """
+    rgb_255 = (colors * 255).astype(np.uint8)
+    ndvi_est = []
+
+    for c in rgb_255:
+        dists = np.linalg.norm(lut - c, axis=1)
+        idx = np.argmin(dists)
+        ndvi_val = (idx / 255.0) * 2 - 1  # map index to [-1, 1]
+        ndvi_est.append(ndvi_val)
+
+    return np.array(ndvi_est)
+
+
+def main():
+    rng = np.random.default_rng(0)
+    lut = ColorAnalysis.build_rainbow_lut()
+
+    # Random colors, colors around the LUT entries and the corners of the RGB cube, as [0, 1] values
+    random_rgb = rng.integers(0, 256, (N_RANDOM, 3))
+    near_rgb = lut[rng.integers(0, len(lut), N_NEAR)].astype(int) + rng.integers(-6, 7, (N_NEAR, 3))
+    corners_rgb = np.array(np.meshgrid([0, 1, 254, 255], [0, 1, 254, 255], [0, 1, 254, 255])).reshape(3, -1).T
+    rgb = np.clip(np.concatenate([random_rgb, near_rgb, lut, corners_rgb]), 0, 255)
+    colors = (rgb + 0.5) / 255
+
+    start = time.time()
+    expected = rgb_to_ndvi_brute_force(colors, lut)
+    print(f"Brute force: {len(colors)} colors in {time.time() - start:.1f} s")
+
+    # Two calls: the second one reuses the colors resolved by the first one
+    half = len(colors) // 2
+    start = time.time()
+    ndvi = np.concatenate([ColorAnalysis.rgb_to_ndvi(colors[:half], lut), ColorAnalysis.rgb_to_ndvi(colors, lut)[half:]])
+    print(f"Inverse LUT: {len(colors)} colors in {time.time() - start:.2f} s")
+
+    mismatches = int(np.sum(ndvi != expected))
+    print(f"{len(colors) - mismatches}/{len(colors)} colors with the same NDVI as the brute force")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""
+Main application for converting the text point clouds to the binary cache (.cloud.npz) used by load_cloud.
+"""
+
+import os
+import sys
+import time
+from tqdm import tqdm
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pointcloud.pointcloud_cache import PointCloudCache
+from utils.utils import load_config
+
+
+def main():
+
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+    config_path = os.path.join(base_dir, 'config.yaml')
+    config = load_config(config_path)
+    io_cfg = config["io"]
+    paths_cfg = config["paths"]
+    dates = config.get("dates", [])
+    suffix = '_down'
+
+    for date in tqdm(dates):
+        year = "20"+date[0:2]
+
+        # Downsampled and original point clouds
+        cloud_paths = [os.path.join(base_dir, io_cfg["downsample_dir"].format(suffix=suffix), f"{year}/vineyard_{date}{suffix}.txt"),
+                       paths_cfg["pointcloud"].format(zenodo_base=io_cfg["zenodo_base_dir"], year=year, date=date)]
+
+        for cloud_path in cloud_paths:
+            if not os.path.exists(cloud_path):
+                continue
+            if PointCloudCache.is_valid(cloud_path):
+                print(f"[SKIP] Up to date: {cloud_path}")
+                continue
+
+            start = time.time()
+            cache_path = PointCloudCache.convert(cloud_path)
+            print(f"  Converted {cloud_path} → {cache_path} in {time.time() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
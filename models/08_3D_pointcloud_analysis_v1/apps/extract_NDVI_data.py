@@ -3,13 +3,34 @@ import sys
 import time
 import numpy as np
 import open3d as o3d
-from tqdm import tqdm
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from extract_analysis.analysis import ColorAnalysis
+from extract_analysis.analysis import ColorAnalysis, ParcelAnalysis
 from grid.grid_operations import GridOperations
-from utils.utils import load_json, load_config, save_json
+from extract_analysis.analysis_runner import AnalysisRunner
+from utils.utils import load_config
+
+
+def compute_ndvi(date, inputs, params):
+    """NDVI analysis of a date: inputs are the NDVI plant cloud and grid files"""
+    plant_path, grid_path = inputs
+    plant_cloud = o3d.io.read_point_cloud(plant_path)
+    line_sets = GridOperations.deserialize_line_sets(grid_path)
+    lut = ColorAnalysis.build_rainbow_lut()
+
+    print(f"\n\nProcessing {date}")
+    start_time = time.time()
+
+    ndvi_parcels, mean_ndvi = ParcelAnalysis.analyse(plant_cloud, line_sets, ['ndvi'], lut=lut)['ndvi']
+
+    elapsed = time.time() - start_time
+    print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
+
+    return {
+        "color_plant": mean_ndvi,
+        "color_parcel_plant": ndvi_parcels
+    }
 
 
 def run_ndvi_analysis(config, base_dir):
@@ -21,39 +42,24 @@ def run_ndvi_analysis(config, base_dir):
 
     suffix = '_down' if config.get("downsample", True) else ""
     analysis_path = os.path.join(base_dir, f"data/analysis_data/NDVI_analysis{suffix}.json")
-    data = load_json(analysis_path)
-    lut = ColorAnalysis.build_rainbow_lut()  # Build LUT once
 
-    for date in tqdm(dates): 
+    tasks = {}
+    for date in dates: 
         year = "20"+date[0:2]
-        if date in data or date in skip_dates:
+        if date in skip_dates:
             continue
 
         plant_path = os.path.join(base_dir, io_cfg[f"plant_cloud_dir_NDVI{suffix}"], f"{year}/plant_cloud_{date}_NDVI{suffix}.ply")
+        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
         
-        if not os.path.exists(plant_path):
+        if not os.path.exists(plant_path) or not os.path.exists(grid_path):
             print(f"\n[SKIP] Missing NDVI plant cloud for {date}")
             continue
 
-        plant_cloud = o3d.io.read_point_cloud(plant_path)
-        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
-        line_sets = GridOperations.deserialize_line_sets(grid_path)
-
-        print(f"\n\nProcessing {date}")
-        start_time = time.time()
-
-        ndvi_parcels, mean_ndvi = ColorAnalysis.mean_ndvi_per_parcel(plant_cloud, line_sets, lut)
-
-        elapsed = time.time() - start_time
-        print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
-
-        data[date] = {
-            "color_plant": mean_ndvi,
-            "color_parcel_plant": ndvi_parcels
-        }
+        tasks[date] = ([plant_path, grid_path], {})
 
-        save_json(analysis_path, data)
-        print(f"[INFO] {date} saved in {analysis_path}")
+    runner = AnalysisRunner(analysis_path, config.get("analysis_workers", 1))
+    runner.run("NDVI", tasks, compute_ndvi)
 
 
 def main():
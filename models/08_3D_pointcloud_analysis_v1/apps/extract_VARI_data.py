@@ -3,13 +3,34 @@ import sys
 import time
 import numpy as np
 import open3d as o3d
-from tqdm import tqdm
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from extract_analysis.analysis import ColorAnalysis
+from extract_analysis.analysis import ParcelAnalysis
 from grid.grid_operations import GridOperations
-from utils.utils import load_json, load_config, save_json
+from extract_analysis.analysis_runner import AnalysisRunner
+from utils.utils import load_config
+
+
+def compute_vari(date, inputs, params):
+    """VARI analysis of a date: inputs are the plant cloud and grid files"""
+    plant_path, grid_path = inputs
+    plant_cloud = o3d.io.read_point_cloud(plant_path)
+    line_sets = GridOperations.deserialize_line_sets(grid_path)
+
+    print(f"\n\nProcessing {date}")
+    start_time = time.time()
+
+    # VARI calculation
+    vari_parcels, mean_vari = ParcelAnalysis.analyse(plant_cloud, line_sets, ['vari'])['vari']
+
+    elapsed = time.time() - start_time
+    print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
+
+    return {
+        "color_plant": mean_vari,
+        "color_parcel_plant": vari_parcels
+    }
 
 
 def run_vari_analysis(config, base_dir):
@@ -21,40 +42,23 @@ def run_vari_analysis(config, base_dir):
 
     suffix = '_down' if config.get("downsample", True) else ""
     analysis_path = os.path.join(base_dir, f"data/analysis_data/VARI_analysis{suffix}.json")
-    data = load_json(analysis_path)
 
-    for date in tqdm(dates): 
+    tasks = {}
+    for date in dates: 
         year = "20"+date[0:2]
-        if date in data or date in skip_dates:
+        if date in skip_dates:
             continue
 
         plant_path = os.path.join(base_dir, io_cfg[f"plant_cloud_dir{suffix}"], f"{year}/plant_cloud_{date}{suffix}.ply")
-        if not os.path.exists(plant_path):
+        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
+        if not os.path.exists(plant_path) or not os.path.exists(grid_path):
             print(f"[SKIP] Missing plant cloud for {date}")
             continue
 
-        plant_cloud = o3d.io.read_point_cloud(plant_path)
-
-        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
-        line_sets = GridOperations.deserialize_line_sets(grid_path)
-
-        print(f"\n\nProcessing {date}")
-        start_time = time.time()
-
-        # VARI calculation
-        vari_parcels, mean_vari = ColorAnalysis.vari_per_parcel(plant_cloud, line_sets)
-
-        elapsed = time.time() - start_time
-        print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
-
-        # Store results
-        data[date] = {
-            "color_plant": mean_vari,
-            "color_parcel_plant": vari_parcels
-        }
+        tasks[date] = ([plant_path, grid_path], {})
 
-        save_json(analysis_path, data)
-        print(f"[INFO] {date} saved in {analysis_path}")
+    runner = AnalysisRunner(analysis_path, config.get("analysis_workers", 1))
+    runner.run("VARI", tasks, compute_vari)
 
 
 def main():
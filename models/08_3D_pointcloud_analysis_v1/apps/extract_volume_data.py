@@ -3,13 +3,47 @@ import sys
 import time
 import numpy as np
 import open3d as o3d
-from tqdm import tqdm
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from extract_analysis.analysis import VolumeAnalysis
+from extract_analysis.analysis import ParcelAnalysis
 from grid.grid_operations import GridOperations
-from utils.utils import load_json, load_config, save_json
+from extract_analysis.analysis_runner import AnalysisRunner
+from utils.utils import load_config
+
+
+def compute_volume_density(date, inputs, params):
+    """Volume and density analysis of a date: inputs are the plant cloud and grid files"""
+    plant_path, grid_path = inputs
+
+    # Load plant cloud
+    plant_cloud = o3d.io.read_point_cloud(plant_path)
+
+    # Load grid
+    line_sets = GridOperations.deserialize_line_sets(grid_path)
+
+    print(f"\n\nProcessing {date}")
+    start_time = time.time()
+
+    # Volume and density analysis per plant
+    volume_parcel_plants, density_parcel_plants, _ = ParcelAnalysis.analyse(
+        plant_cloud, line_sets, ['volume'], voxel_size=params["voxel_size"], padding=params["padding"]
+    )['volume']
+
+    # Aggregate metrics
+    volume_plants = float(np.sum(volume_parcel_plants))
+    density_plants = float(np.mean(density_parcel_plants))
+
+    elapsed = time.time() - start_time
+    print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
+
+    # Results (no porosity)
+    return {
+        "volume_plants": volume_plants,
+        "volume_parcel_plant": volume_parcel_plants,
+        "density_plants": density_plants,
+        "density_parcel_plant": density_parcel_plants
+    }
 
 
 def run_volume_density_analysis(config, base_dir):
@@ -22,51 +56,24 @@ def run_volume_density_analysis(config, base_dir):
 
     suffix = '_down' if config.get("downsample", True) else ""
     analysis_path = os.path.join(base_dir, f"data/analysis_data/volume_density_analysis{suffix}.json")
-    data = load_json(analysis_path)
 
-    for date in tqdm(dates): 
+    tasks = {}
+    for date in dates: 
         year = "20"+date[0:2]
-        if date in data or date in skip_dates:
+        if date in skip_dates:
             continue
 
         # Plant cloud path (should be with the downsampled as it is standardized)
         plant_path = os.path.join(base_dir, io_cfg[f"plant_cloud_dir{suffix}"], f"{year}/plant_cloud_{date}{suffix}.ply")
-        if not os.path.exists(plant_path):
+        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
+        if not os.path.exists(plant_path) or not os.path.exists(grid_path):
             print(f"[SKIP] Missing plant cloud for {date}")
             continue
 
-        # Load plant cloud
-        plant_cloud = o3d.io.read_point_cloud(plant_path)
-
-        # Load grid
-        grid_path = os.path.join(base_dir, paths_cfg['grid'].format(year=year, date=date))
-        line_sets = GridOperations.deserialize_line_sets(grid_path)
-
-        print(f"\n\nProcessing {date}")
-        start_time = time.time()
-
-        # Volume and density analysis per plant
-        volume_parcel_plants, density_parcel_plants, _ = VolumeAnalysis.volume_and_density_per_plant(
-            plant_cloud, line_sets, voxel_size, padding=0.0
-        )
-
-        # Aggregate metrics
-        volume_plants = np.sum(volume_parcel_plants)
-        density_plants = np.mean(density_parcel_plants)
-
-        elapsed = time.time() - start_time
-        print(f"[INFO] {date} processed in {elapsed:.2f}s ({elapsed/60:.2f} min)")
-
-        # Store results (no porosity)
-        data[date] = {
-            "volume_plants": volume_plants,
-            "volume_parcel_plant": volume_parcel_plants,
-            "density_plants": density_plants,
-            "density_parcel_plant": density_parcel_plants
-        }
+        tasks[date] = ([plant_path, grid_path], {"voxel_size": voxel_size, "padding": 0.0})
 
-        save_json(analysis_path, data)
-        print(f"[INFO] {date} saved in {analysis_path}")
+    runner = AnalysisRunner(analysis_path, config.get("analysis_workers", 1))
+    runner.run("volume_density", tasks, compute_volume_density)
 
 
 def main():
@@ -34,7 +34,7 @@ def get_ground_and_plant_pointclouds(config, base_dir):
 
         print(cloud_path)
         print(plant_path)
-        if not os.path.exists(cloud_path) or not os.path.exists(plant_path):
+        if not PointCloudLoader.cloud_exists(cloud_path) or not os.path.exists(plant_path):
             print(f"[SKIP] Missing cloud file for {date}")
             continue
 
@@ -52,7 +52,7 @@ def visualize_original_pointclouds(config, base_dir):
                 zenodo_base=io_cfg["zenodo_base_dir"], year=year, date=date)            
         grid_path = f"{base_dir}/data/grids{suffix_grid}/{year}/grid_{date}{suffix_grid}.npz"
 
-        if not os.path.exists(cloud_path) or not os.path.exists(grid_path):
+        if not PointCloudLoader.cloud_exists(cloud_path) or not os.path.exists(grid_path):
             print(f"[SKIP] Missing files for {date}")
             continue
 
@@ -1,6 +1,5 @@
 import cv2
 import numpy as np
-import open3d as o3d
 import matplotlib.pyplot as plt
 
 
@@ -8,6 +7,8 @@ import matplotlib.pyplot as plt
 # COLOR ANALYSIS
 # =========================
 class ColorAnalysis:
+    _inverse_luts = {}  # Inverse lookup of each LUT (get_inverse_lut)
+
     @staticmethod
     def get_color_analysis(pointcloud, grayscale=True):
         """
@@ -51,22 +52,7 @@ class ColorAnalysis:
         """
         Compute a vegetation health proxy per parcel using the green channel.
         """
-        health_parcels = []
-
-        for cube in line_sets:
-            bbox = o3d.geometry.OrientedBoundingBox.create_from_points(o3d.utility.Vector3dVector(cube.points))
-            mask = bbox.get_point_indices_within_bounding_box(cloud.points)
-            
-            if len(mask) == 0:
-                health_parcels.append(np.nan)
-                continue
-
-            cloud_in_cube = cloud.select_by_index(mask)
-            colors = np.asarray(cloud_in_cube.colors)
-            mean_green = np.mean(colors[:, 1])
-            health_parcels.append(mean_green)
-
-        return health_parcels
+        return ParcelAnalysis.analyse(cloud, line_sets, ['health'])['health']
 
     # VARI ANALYSIS
     # ========================
@@ -91,25 +77,7 @@ class ColorAnalysis:
             vari_parcels: list of VARI per parcel
             mean_vari: overall mean VARI
         """
-        vari_parcels = []
-
-        for cube in line_sets:
-            bbox = o3d.geometry.OrientedBoundingBox.create_from_points(
-                o3d.utility.Vector3dVector(cube.points)
-            )
-            mask = bbox.get_point_indices_within_bounding_box(cloud.points)
-            if len(mask) == 0:
-                vari_parcels.append(np.nan)
-                continue
-
-            cloud_in_cube = cloud.select_by_index(mask)
-            colors = np.asarray(cloud_in_cube.colors)
-
-            vari_vals = ColorAnalysis.compute_vari(colors)
-            vari_parcels.append(np.nanmean(vari_vals))
-
-        mean_vari = np.nanmean(vari_parcels)
-        return vari_parcels, mean_vari
+        return ParcelAnalysis.analyse(cloud, line_sets, ['vari'])['vari']
     
     # NDVI ANALYSIS
     # =========================
@@ -124,44 +92,87 @@ class ColorAnalysis:
         return lut
 
     @staticmethod
-    def rgb_to_ndvi(colors, lut):
+    def build_inverse_lut(lut, block=8):
         """
-        Convert RGB colors (Nx3 [0,1]) to approximate NDVI using the LUT.
+        Precompute the exact inverse lookup RGB -> LUT index: the distance of every channel value to every LUT
+        entry, and for each block of block^3 colors the LUT entries that can be the nearest to one of its colors
+        (lower bound of the distance not above the smallest upper bound of the block). The table of the 2^24
+        colors is filled by rgb_to_ndvi as new colors are found.
         """
-        rgb_255 = (colors * 255).astype(np.uint8)
-        ndvi_est = []
+        lut = np.asarray(lut, dtype=np.uint8)
+        values = np.arange(256, dtype=np.uint8)
+        dists = ((lut[None, :, :] - values[:, None, None]).astype(np.int32)) ** 2  # uint8 difference, as lut - c
+
+        n_blocks = 256 // block
+        low = dists.reshape(n_blocks, block, len(lut), 3).min(axis=1)
+        high = dists.reshape(n_blocks, block, len(lut), 3).max(axis=1)
+        lower = low[:, None, None, :, 0] + low[None, :, None, :, 1] + low[None, None, :, :, 2]
+        upper = high[:, None, None, :, 0] + high[None, :, None, :, 1] + high[None, None, :, :, 2]
+        candidates = (lower <= upper.min(axis=-1, keepdims=True)).reshape(n_blocks**3, len(lut))
+
+        return {
+            "dists": dists,
+            "order": np.argsort(~candidates, axis=1, kind='stable'),  # Candidates first, in LUT order
+            "counts": candidates.sum(axis=1),
+            "block": block,
+            "table": np.zeros(1 << 24, dtype=np.uint8),  # LUT index of each resolved color
+            "resolved": np.zeros(1 << 24, dtype=bool),
+            "pending": np.zeros(1 << 24, dtype=bool)  # Scratch mask of the new colors of a call
+        }
 
-        for c in rgb_255:
-            dists = np.linalg.norm(lut - c, axis=1)
-            idx = np.argmin(dists)
-            ndvi_val = (idx / 255.0) * 2 - 1  # map index to [-1, 1]
-            ndvi_est.append(ndvi_val)
+    @staticmethod
+    def get_inverse_lut(lut):
+        """
+        Get the inverse lookup of a LUT, built once per LUT and reused (with its resolved colors) by every call.
+        """
+        lut = np.asarray(lut, dtype=np.uint8)
+        key = lut.tobytes()
+        if key not in ColorAnalysis._inverse_luts:
+            ColorAnalysis._inverse_luts[key] = ColorAnalysis.build_inverse_lut(lut)
+        return ColorAnalysis._inverse_luts[key]
 
-        return np.array(ndvi_est)
+    @staticmethod
+    def rgb_to_ndvi(colors, lut, inverse=None):
+        """
+        Convert RGB colors (Nx3 [0,1]) to approximate NDVI using the LUT.
+        inverse: inverse lookup of the LUT (build_inverse_lut), get_inverse_lut(lut) if None
+        """
+        rgb_255 = (np.asarray(colors).reshape(-1, 3) * 255).astype(np.uint8)
+        keys = (rgb_255[:, 0].astype(np.int32) << 16) | (rgb_255[:, 1].astype(np.int32) << 8) | rgb_255[:, 2]
+
+        inverse = ColorAnalysis.get_inverse_lut(lut) if inverse is None else inverse
+        dists, order, counts, block = inverse["dists"], inverse["order"], inverse["counts"], inverse["block"]
+        table = inverse["table"]
+
+        # Each color not resolved by a previous call is resolved once, against the candidates of its block only
+        pending = inverse["pending"]
+        pending[keys[~inverse["resolved"][keys]]] = True
+        unique = np.flatnonzero(pending)
+        pending[unique] = False
+        r, g, b = unique >> 16, (unique >> 8) & 255, unique & 255
+        n_blocks = 256 // block
+        cells = ((r // block) * n_blocks + g // block) * n_blocks + b // block
+
+        size_low = 0
+        for size in (32, 64, 128, len(order[0])):
+            selected = np.flatnonzero((counts[cells] > size_low) & (counts[cells] <= size))
+            for start in range(0, len(selected), 16384):
+                idx = selected[start:start + 16384]
+                cand = order[cells[idx], :size]
+                d = dists[r[idx, None], cand, 0] + dists[g[idx, None], cand, 1] + dists[b[idx, None], cand, 2]
+                d[np.arange(size)[None, :] >= counts[cells[idx], None]] = np.iinfo(np.int32).max
+                table[unique[idx]] = cand[np.arange(len(idx)), np.argmin(d, axis=1)]
+            size_low = size
+        inverse["resolved"][unique] = True
+
+        return (table[keys] / 255.0) * 2 - 1  # map index to [-1, 1]
 
     @staticmethod
     def mean_ndvi_per_parcel(cloud, line_sets, lut):
         """
         Compute mean NDVI per parcel.
         """
-        ndvi_parcels = []
-
-        for cube in line_sets:
-            bbox = o3d.geometry.OrientedBoundingBox.create_from_points(
-                o3d.utility.Vector3dVector(cube.points)
-            )
-            mask = bbox.get_point_indices_within_bounding_box(cloud.points)
-            if len(mask) == 0:
-                ndvi_parcels.append(np.nan)
-                continue
-
-            cloud_in_cube = cloud.select_by_index(mask)
-            colors = np.asarray(cloud_in_cube.colors)
-            ndvi_vals = ColorAnalysis.rgb_to_ndvi(colors, lut)
-            ndvi_parcels.append(np.mean(ndvi_vals))
-
-        mean_ndvi = np.nanmean(ndvi_parcels)
-        return ndvi_parcels, mean_ndvi
+        return ParcelAnalysis.analyse(cloud, line_sets, ['ndvi'], lut=lut)['ndvi']
 
 # =========================
 # VOLUME ANALYSIS
@@ -172,58 +183,14 @@ class VolumeAnalysis:
         """
         Count total points and points per parcel.
         """
-        total_points = 0
-        points_per_parcel = []
-
-        for cube in line_sets:
-            bbox = o3d.geometry.OrientedBoundingBox.create_from_points(o3d.utility.Vector3dVector(cube.points))
-            mask = bbox.get_point_indices_within_bounding_box(cloud.points)
-            num_points = len(mask)
-
-            total_points += num_points
-            points_per_parcel.append(num_points)
-
-        return total_points, points_per_parcel
+        return ParcelAnalysis.analyse(cloud, line_sets, ['points'])['points']
 
     @staticmethod
     def volume_and_density_per_plant(cloud, line_sets, voxel_size=0.05, padding=0.0):
         """
         Compute volume, density, and porosity per plant.
         """
-        volumes = []
-        densities = []
-        porosities = []
-
-        for cube in line_sets:
-            bbox_cube = o3d.geometry.OrientedBoundingBox.create_from_points(o3d.utility.Vector3dVector(cube.points))
-            mask = bbox_cube.get_point_indices_within_bounding_box(cloud.points)
-
-            if len(mask) == 0:
-                volumes.append(0.0)
-                densities.append(0.0)
-                porosities.append(1.0)
-                continue
-
-            cloud_in_cube = cloud.select_by_index(mask)
-            voxel_grid = o3d.geometry.VoxelGrid.create_from_point_cloud(cloud_in_cube, voxel_size=voxel_size)
-            n_voxels_ocupados = len(voxel_grid.get_voxels())
-            vol = n_voxels_ocupados * voxel_size**3
-            volumes.append(vol)
-
-            bbox = cloud_in_cube.get_axis_aligned_bounding_box()
-            if padding > 0:
-                bbox = bbox.expand(padding)
-            extent = bbox.get_extent()
-            vol_prisma = extent[0] * extent[1] * extent[2]
-
-            n_voxels_totales = max(vol_prisma / (voxel_size**3), 1)
-            density = min(n_voxels_ocupados / n_voxels_totales, 1.0)
-            porosity = 1 - density
-
-            densities.append(density)
-            porosities.append(porosity)
-
-        return volumes, densities, porosities
+        return ParcelAnalysis.analyse(cloud, line_sets, ['volume'], voxel_size=voxel_size, padding=padding)['volume']
 
 
 # =========================
@@ -248,15 +215,209 @@ class HeightAnalysis:
         """
         Compute height per parcel and overall 99th percentile.
         """
-        height_parcels = []
+        return ParcelAnalysis.analyse(cloud, line_sets, ['height'])['height']
+
+
+# =========================
+# PARCEL ANALYSIS
+# =========================
+class ParcelAnalysis:
+    """
+    Single pass analysis of the parcels: every point is assigned to its parcel once (point-in-quad test in the
+    plane of the grid, as the cubes are extruded quads) and all the metrics are computed with grouped reductions
+    """
+    METRICS = ('points', 'health', 'vari', 'ndvi', 'height', 'volume')
+
+    @staticmethod
+    def parcel_grid(line_sets):
+        """
+        Get the quads of the cubes in the plane of the grid.
+
+        Returns:
+            frame: (3, 3) axes of the grid (two in the plane, the last one vertical), rows
+            quads: (P, 4, 2) bottom quads in the plane
+            heights: (P, 2) min and max height of the cubes along the vertical axis
+        """
+        cubes = np.array([np.asarray(cube.points) for cube in line_sets]).reshape(-1, 8, 3)
+
+        # Vertical axis from the bottom to the top face (the grid can be rotated with the point cloud)
+        up = np.mean(cubes[:, 4:].mean(axis=1) - cubes[:, :4].mean(axis=1), axis=0) if len(cubes) else np.array([0, 0, 1.0])
+        up = up / np.linalg.norm(up)
+        axis_x = np.array([1.0, 0, 0]) - up[0] * up
+        if np.linalg.norm(axis_x) < 1e-6:
+            axis_x = np.array([0, 1.0, 0]) - up[1] * up
+        axis_x = axis_x / np.linalg.norm(axis_x)
+        frame = np.array([axis_x, np.cross(up, axis_x), up])
+
+        projected = cubes @ frame.T
+        quads = projected[:, :4, :2]
+        heights = np.stack([projected[..., 2].min(axis=1), projected[..., 2].max(axis=1)], axis=1)
+        return frame, quads, heights
 
-        for cube in line_sets:
-            bbox = o3d.geometry.OrientedBoundingBox.create_from_points(o3d.utility.Vector3dVector(cube.points))
-            mask = bbox.get_point_indices_within_bounding_box(cloud.points)
-            cloud_in_cube = cloud.select_by_index(mask)
+    @staticmethod
+    def points_in_quad(xy, quad):
+        """
+        Check which points are inside a quad (crossing number, points (M, 2), quad (4, 2))
+        """
+        x, y = xy[:, 0], xy[:, 1]
+        inside = np.zeros(len(xy), dtype=bool)
+        for k in range(4):
+            (x0, y0), (x1, y1) = quad[k], quad[(k + 1) % 4]
+            crosses = (y0 > y) != (y1 > y)
+            if y1 != y0:
+                inside ^= crosses & (x < x0 + (y - y0) * (x1 - x0) / (y1 - y0))
+        return inside
+
+    @staticmethod
+    def label_points(points, grid):
+        """
+        Assign every point to its parcel (see label_xy).
 
-            height = HeightAnalysis.calculate_height(np.asarray(cloud_in_cube.points))
-            height_parcels.append(height)
+        Returns:
+            labels: (N,) index of the parcel of each point, -1 outside the grid
+        """
+        frame, quads, heights = grid
+        projected = np.asarray(points, dtype=np.float64).reshape(-1, 3) @ frame.T
+        return ParcelAnalysis.label_xy(projected[:, :2], quads, projected[:, 2], heights)
 
-        height_rows = np.percentile(height_parcels, 99)
-        return height_rows, height_parcels
+    @staticmethod
+    def label_xy(xy, quads, h=None, heights=None):
+        """
+        Assign every point of the plane of the grid to its quad. The points are indexed in square cells of about the
+        size of a parcel, so each quad is only tested against the points of the cells its bounding box covers.
+
+        Args:
+            xy: (N, 2) points in the plane of the grid
+            quads: (P, 4, 2) quads in the plane of the grid
+            h, heights: (N,) height of the points and (P, 2) height range of each cube, not checked if None
+
+        Returns:
+            labels: (N,) index of the quad of each point, -1 outside the grid
+        """
+        labels = np.full(len(xy), -1, dtype=np.int64)
+        if len(quads) == 0 or len(xy) == 0:
+            return labels
+
+        low, high = quads.min(axis=1), quads.max(axis=1)
+        cell = max(float(np.median((high - low).max(axis=1))), 1e-6)
+        origin = low.min(axis=0)
+        n_cells = np.floor((high.max(axis=0) - origin) / cell).astype(np.int64) + 1
+
+        point_cells = np.floor((xy - origin) / cell).astype(np.int64)
+        valid = np.all((point_cells >= 0) & (point_cells < n_cells), axis=1)
+        cell_ids = np.where(valid, point_cells[:, 1] * n_cells[0] + point_cells[:, 0], n_cells[0] * n_cells[1])
+        order = np.argsort(cell_ids, kind='stable')
+        starts = np.searchsorted(cell_ids[order], np.arange(n_cells[0] * n_cells[1] + 1))
+
+        quad_low = np.floor((low - origin) / cell).astype(np.int64)
+        quad_high = np.floor((high - origin) / cell).astype(np.int64)
+        for i in range(len(quads)):
+            candidates = np.concatenate([order[starts[cy * n_cells[0] + quad_low[i, 0]]:starts[cy * n_cells[0] + quad_high[i, 0] + 1]]
+                                         for cy in range(quad_low[i, 1], quad_high[i, 1] + 1)])
+            candidates = candidates[labels[candidates] < 0]  # A point on a shared edge goes to the first parcel
+            inside = ParcelAnalysis.points_in_quad(xy[candidates], quads[i])
+            if h is not None:
+                inside &= (h[candidates] >= heights[i, 0]) & (h[candidates] <= heights[i, 1])
+            labels[candidates[inside]] = i
+
+        return labels
+
+    @staticmethod
+    def _grouped_mean(labels, values, n_parcels):
+        """Mean of the finite values of each parcel, nan if it has none"""
+        finite = np.isfinite(values)
+        count = np.bincount(labels[finite], minlength=n_parcels)
+        total = np.bincount(labels[finite], weights=values[finite], minlength=n_parcels)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+
+    @staticmethod
+    def analyse(cloud, line_sets=None, metrics=METRICS, grid=None, lut=None, voxel_size=0.05, padding=0.0):
+        """
+        Compute the requested metrics of all the parcels in one pass over the point cloud.
+
+        Args:
+            cloud: open3d point cloud
+            line_sets: cubes of the grid (not needed if grid is given)
+            metrics: names of the metrics, from METRICS
+            grid: result of parcel_grid, to reuse it with several clouds
+            lut: rainbow LUT of the NDVI colors (build_rainbow_lut if None)
+            voxel_size, padding: parameters of the volume and density
+
+        Returns:
+            dict with the results of each metric, as the per metric methods:
+                points: (total_points, points_per_parcel)
+                health: health_parcels
+                vari: (vari_parcels, mean_vari)
+                ndvi: (ndvi_parcels, mean_ndvi)
+                height: (height_rows, height_parcels)
+                volume: (volumes, densities, porosities)
+        """
+        unknown = set(metrics) - set(ParcelAnalysis.METRICS)
+        if unknown:
+            raise ValueError(f"Unknown metrics {sorted(unknown)}, expected some of {ParcelAnalysis.METRICS}")
+
+        grid = ParcelAnalysis.parcel_grid(line_sets) if grid is None else grid
+        n_parcels = len(grid[1])
+        points = np.asarray(cloud.points)
+        labels = ParcelAnalysis.label_points(points, grid)
+
+        # Only the points inside the grid, sorted by parcel
+        order = np.flatnonzero(labels >= 0)
+        order = order[np.argsort(labels[order], kind='stable')]
+        labels = labels[order]
+        points = points[order]
+        colors = np.asarray(cloud.colors)[order] if ('health' in metrics or 'vari' in metrics or 'ndvi' in metrics) else None
+
+        count = np.bincount(labels, minlength=n_parcels)
+        starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+        filled = count > 0
+        results = {}
+
+        if 'points' in metrics:
+            results['points'] = (int(count.sum()), count.tolist())
+
+        if 'health' in metrics:
+            results['health'] = ParcelAnalysis._grouped_mean(labels, colors[:, 1], n_parcels).tolist()
+
+        if 'vari' in metrics:
+            vari_parcels = ParcelAnalysis._grouped_mean(labels, ColorAnalysis.compute_vari(colors), n_parcels)
+            results['vari'] = (vari_parcels.tolist(), float(np.nanmean(vari_parcels)))
+
+        if 'ndvi' in metrics:
+            lut = ColorAnalysis.build_rainbow_lut() if lut is None else lut
+            ndvi_parcels = ParcelAnalysis._grouped_mean(labels, ColorAnalysis.rgb_to_ndvi(colors, lut), n_parcels)
+            results['ndvi'] = (ndvi_parcels.tolist(), float(np.nanmean(ndvi_parcels)))
+
+        if 'height' in metrics:
+            # 99th percentile (linear interpolation) of the heights over the minimum of each parcel
+            z = points[:, 2][np.lexsort((points[:, 2], labels))]
+            position = 0.99 * np.maximum(count - 1, 0)
+            below = np.floor(position).astype(np.int64)
+            above = np.minimum(below + 1, np.maximum(count - 1, 0))
+            idx_min, idx_below, idx_above = starts[filled], (starts + below)[filled], (starts + above)[filled]
+            height_parcels = np.zeros(n_parcels)
+            height_parcels[filled] = (z[idx_below] + (position - below)[filled] * (z[idx_above] - z[idx_below])) - z[idx_min]
+            results['height'] = (float(np.percentile(height_parcels, 99)), height_parcels.tolist())
+
+        if 'volume' in metrics:
+            volumes, densities, porosities = np.zeros(n_parcels), np.zeros(n_parcels), np.ones(n_parcels)
+            if filled.any():
+                low = np.minimum.reduceat(points, starts[filled], axis=0)
+                high = np.maximum.reduceat(points, starts[filled], axis=0)
+                parcel_low, parcel_labels = np.zeros((n_parcels, 3)), np.flatnonzero(filled)
+                parcel_low[filled] = low
+
+                # Occupied voxels, with the voxel grid of each parcel starting half a voxel before its points (as open3d)
+                voxels = np.floor((points - parcel_low[labels] + voxel_size / 2) / voxel_size).astype(np.int64)
+                occupied = np.unique(np.column_stack([labels, voxels]), axis=0)
+                n_voxels = np.bincount(occupied[:, 0], minlength=n_parcels)[filled]
+                volumes[filled] = n_voxels * voxel_size**3
+
+                extent = high - low + 2 * padding
+                n_voxels_total = np.maximum(np.prod(extent, axis=1) / voxel_size**3, 1)
+                densities[parcel_labels] = np.minimum(n_voxels / n_voxels_total, 1.0)
+                porosities[parcel_labels] = 1 - densities[parcel_labels]
+            results['volume'] = (volumes.tolist(), densities.tolist(), porosities.tolist())
+
+        return results
@@ -0,0 +1,150 @@
+"""
+Incremental runner of the per date analysis: results keyed by the content of their inputs and their parameters
+"""
+import os
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils.utils import load_json, load_npz, save_npz, save_json
+
+ANALYSIS_STORE_VERSION = 1  # Version of the analysis store (.npz), increase it when the results of a metric change
+
+
+class AnalysisRunner:
+    """
+    Computes the dates of a metric whose result is missing or stale. The result of a date is keyed by the content
+    hash of its input files (plant clouds, point clouds, grid), the parameters (e.g. voxel size) and the version of
+    the store, so a changed input or parameter recomputes only that date. The results are saved after each date in
+    a columnar .npz store (one column per field, one row per date) and exported to the analysis JSON, both written
+    atomically. Independent dates are computed in a process pool.
+    """
+
+    def __init__(self, json_path, num_workers=1):
+        self._json_path = json_path
+        self._store_path = os.path.splitext(json_path)[0] + '.npz'
+        self._num_workers = max(int(num_workers), 1)
+        self._results, self._hashes = self._load_store()
+        self._hashes_changed = False
+
+    def _load_store(self):
+        """
+        Load the results {date: (key, result)} and the hashes of the input files {path: (mtime_ns, size, hash)}.
+        The dates of the analysis JSON that are not in the store (e.g. computed before the store existed) are kept
+        with an empty key: they are computed again if they are in the tasks of a run, and kept as they are otherwise.
+        """
+        results, hashes = {}, {}
+        store = load_npz(self._store_path) if os.path.exists(self._store_path) else {}
+        if int(store.get('format_version', 0)) == ANALYSIS_STORE_VERSION:
+            fields = json.loads(str(store['fields']))
+            for i, (date, key) in enumerate(zip(store['dates'].tolist(), store['keys'].tolist())):
+                result = {}
+                for field, is_list in fields.items():
+                    if is_list:
+                        result[field] = store[field][i, :int(store[f'{field}__len'][i])].tolist()
+                    else:
+                        result[field] = store[field][i].item()
+                results[date] = (key, result)
+
+            hashes = {path: (int(mtime_ns), int(size), value) for path, mtime_ns, size, value in
+                      zip(store['hash_paths'].tolist(), store['hash_mtimes'], store['hash_sizes'], store['hash_values'].tolist())}
+
+        if os.path.exists(self._json_path):
+            for date, result in load_json(self._json_path).items():
+                results.setdefault(date, ('', result))
+        return results, hashes
+
+    def _save_store(self):
+        """
+        Save the results in columns (lists padded, with their lengths) and export them to the JSON, by date
+        """
+        dates = sorted(self._results)
+        columns = {}
+        fields = {}
+        for field in sorted({field for _, result in self._results.values() for field in result}):
+            values = [self._results[date][1].get(field, np.nan) for date in dates]
+            fields[field] = any(isinstance(value, (list, tuple, np.ndarray)) for value in values)
+            if fields[field]:
+                values = [np.atleast_1d(value) for value in values]
+                lengths = np.array([len(value) for value in values], dtype=np.int64)
+                flat = np.concatenate(values) if lengths.sum() else np.zeros(0)
+                column = np.zeros((len(values), max(lengths.max(initial=0), 1)), dtype=flat.dtype)
+                for i, value in enumerate(values):
+                    column[i, :len(value)] = value
+                columns[field] = column
+                columns[f'{field}__len'] = lengths
+            else:
+                columns[field] = np.array(values)
+
+        paths = sorted(self._hashes)
+        save_npz(self._store_path,
+                 format_version=np.array(ANALYSIS_STORE_VERSION),
+                 fields=np.array(json.dumps(fields)),
+                 dates=np.array(dates, dtype=str),
+                 keys=np.array([self._results[date][0] for date in dates], dtype=str),
+                 hash_paths=np.array(paths, dtype=str),
+                 hash_mtimes=np.array([self._hashes[path][0] for path in paths], dtype=np.int64),
+                 hash_sizes=np.array([self._hashes[path][1] for path in paths], dtype=np.int64),
+                 hash_values=np.array([self._hashes[path][2] for path in paths], dtype=str),
+                 **columns)
+        save_json(self._json_path, {date: self._results[date][1] for date in dates})
+
+    def file_hash(self, path):
+        """
+        Content hash of a file. It is only read again if its modification time or size changed
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(16 * 1024 * 1024), b''):
+                digest.update(chunk)
+        self._hashes[path] = (stat.st_mtime_ns, stat.st_size, digest.hexdigest())
+        self._hashes_changed = True
+        return self._hashes[path][2]
+
+    def task_key(self, metric, inputs, params):
+        """
+        Key of the result of a date: metric, content of the input files and parameters
+        """
+        description = {'version': ANALYSIS_STORE_VERSION, 'metric': metric, 'params': params,
+                       'inputs': [self.file_hash(path) for path in inputs]}
+        return hashlib.blake2b(json.dumps(description, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def run(self, metric, tasks, compute):
+        """
+        Compute the stale dates of a metric and save the results after each one.
+
+        Args:
+            metric: name of the metric
+            tasks: {date: (inputs, params)}, input files and parameters (JSON serializable) of each date
+            compute: function compute(date, inputs, params) -> result (dict), defined at module level (process pool)
+
+        Returns:
+            results: {date: result} of all the dates in the store
+        """
+        keys = {date: self.task_key(metric, inputs, params) for date, (inputs, params) in tasks.items()}
+        stale = [date for date in tasks if date not in self._results or self._results[date][0] != keys[date]]
+        print(f"[INFO] {metric}: {len(tasks) - len(stale)} dates up to date, {len(stale)} to compute")
+
+        if self._num_workers == 1 or len(stale) <= 1:
+            for date in stale:
+                self._results[date] = (keys[date], compute(date, *tasks[date]))
+                self._save_store()
+                print(f"[INFO] {date} saved in {self._json_path}")
+        else:
+            with ProcessPoolExecutor(min(self._num_workers, len(stale))) as pool:
+                futures = {pool.submit(compute, date, *tasks[date]): date for date in stale}
+                for future in as_completed(futures):
+                    date = futures[future]
+                    self._results[date] = (keys[date], future.result())
+                    self._save_store()
+                    print(f"[INFO] {date} saved in {self._json_path}")
+
+        if not stale and self._hashes_changed:
+            self._save_store()  # Hashes of the inputs touched but not modified
+        return {date: result for date, (_, result) in self._results.items()}
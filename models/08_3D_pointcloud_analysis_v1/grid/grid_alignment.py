@@ -2,10 +2,12 @@
 Grid alignment and optimization utilities
 """
 
+import cv2
 import numpy as np
 import open3d as o3d
 from tqdm import tqdm
 from typing import List, Tuple
+from extract_analysis.analysis import ParcelAnalysis
 from grid.grid_operations import GridOperations
 
 
@@ -92,52 +94,117 @@ class GridAlignment:
         return np.all(point >= bbox_min) and np.all(point <= bbox_max)
 
     @staticmethod
-    def perform_best_translation(line_sets, green_pcd, visualize = False):
+    def footprint_raster(quads, origin, cell_size, shape):
         """
-        Find optimal translation for line sets to maximize green points inside
+        Rasterize the quads of the grid (1 inside a quad, 0 outside), cells of cell_size from origin
         """
-        dx_range = np.linspace(-1.0, 1.0, 11)
-        dy_range = np.linspace(-1.0, 1.0, 11)
+        footprint = np.zeros(shape, dtype=np.uint8)
+        polygons = [np.round(((quad - origin) / cell_size - 0.5) * 16).astype(np.int32) for quad in quads]
+        cv2.fillPoly(footprint, polygons, 1, lineType=cv2.LINE_8, shift=4)
+        return footprint
 
-        best_translation = np.array([0.0, 0.0, 0.0])
-        best_count = -1
-
-        for dx in tqdm(dx_range, desc="Optimizing translation"):
-            for dy in dy_range:
-                offset = np.array([dx, dy, 0.0])
-                total = 0
-                visual_objs = []
-
-                for cube in line_sets:
-                    cube.translate(offset)
-                    bbox = o3d.geometry.OrientedBoundingBox.create_from_points(
-                        o3d.utility.Vector3dVector(cube.points)
-                    )
-                    inside_pcd = green_pcd.crop(bbox)
-
-                    if len(inside_pcd.points) > 0:
-                        inside_points = np.asarray(inside_pcd.points)
-                        total += len(inside_points)
-
-                        if visualize:
-                            bbox.color = (1, 0, 1)  # Magenta
-                            inside_pcd.paint_uniform_color([0, 1, 0])  # Green
-                            visual_objs.append(inside_pcd)
-                            visual_objs.append(bbox)
+    @staticmethod
+    def rotate_points(xy, angle, center):
+        """
+        Rotate 2D points by an angle (degrees) around a center
+        """
+        c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+        return (xy - center) @ np.array([[c, s], [-s, c]]) + center
 
-                    cube.translate(-offset)
+    @staticmethod
+    def correlate_footprint(xy, footprint, origin, cell_size, max_shift):
+        """
+        Count the points inside the footprint for every shift of the footprint of up to max_shift cells, at once:
+        cross-correlation (FFT) of the 2D occupancy histogram of the points with the footprint raster.
 
-                if visualize and total > 0:
-                    o3d.visualization.draw_geometries(visual_objs)
-                    
-                print(f"dx={dx:.2f}, dy={dy:.2f} ➤ points inside: {total}")
+        Returns:
+            counts: (2 * max_shift + 1, 2 * max_shift + 1) points inside for each shift, indexed [dx, dy]
+        """
+        cells = np.floor((xy - origin) / cell_size).astype(np.int64)
+        valid = np.all((cells >= 0) & (cells < np.array(footprint.shape[::-1])), axis=1)
+        histogram = np.bincount(cells[valid, 1] * footprint.shape[1] + cells[valid, 0],
+                                minlength=footprint.size).reshape(footprint.shape).astype(np.float64)
 
-                if total > best_count:
-                    best_count = total
-                    best_translation = offset.copy()
+        correlation = np.fft.irfft2(np.fft.rfft2(histogram) * np.conj(np.fft.rfft2(footprint)), s=footprint.shape)
+        shifts = np.arange(-max_shift, max_shift + 1)
+        return np.rint(correlation[np.ix_(shifts % footprint.shape[0], shifts % footprint.shape[1])]).T
 
-        print(f"Best translation: {best_translation} with {best_count} points inside")
+    @staticmethod
+    def perform_best_translation(line_sets, green_pcd, visualize = False, search_range=1.0, cell_size=0.05,
+                                 min_step=0.005, angles=(0.0,)):
+        """
+        Find optimal translation (and rotation) for line sets to maximize green points inside.
+        The points inside the quads (plane of the grid) are counted for all the offsets of up to search_range at
+        once by correlating the histogram of the green points with the footprint of the grid (cells of cell_size),
+        for each angle (degrees, around the center of the grid). The best offset and angle are then refined with
+        exact counts, from steps of cell_size halving until min_step.
+        """
+        frame, quads, heights = ParcelAnalysis.parcel_grid(line_sets)
+        projected = np.asarray(green_pcd.points, dtype=np.float64) @ frame.T
+        in_height = (projected[:, 2] >= heights[:, 0].min()) & (projected[:, 2] <= heights[:, 1].max())
+        xy = projected[in_height, :2]
+        center = quads.reshape(-1, 2).mean(axis=0)
+
+        # Coarse search: all the offsets of each angle at once
+        max_shift = int(np.floor(search_range / cell_size))
+        origin = quads.reshape(-1, 2).min(axis=0) - (max_shift + 2) * cell_size
+        shape = tuple((np.ceil((quads.reshape(-1, 2).max(axis=0) + (max_shift + 2) * cell_size - origin) / cell_size)).astype(int)[::-1])
+        footprint = GridAlignment.footprint_raster(quads, origin, cell_size, shape)
+
+        best_count, best_angle, best_shift = -1, 0.0, np.zeros(2)
+        for angle in tqdm(angles, desc="Optimizing translation"):
+            rotated = GridAlignment.rotate_points(xy, -angle, center)
+            counts = GridAlignment.correlate_footprint(rotated, footprint, origin, cell_size, max_shift)
+            idx_x, idx_y = np.unravel_index(np.argmax(counts), counts.shape)
+            if counts[idx_x, idx_y] > best_count:
+                best_count, best_angle = counts[idx_x, idx_y], angle
+                # Shift of the rotated points -> shift of the rotated grid
+                best_shift = GridAlignment.rotate_points(np.array([[idx_x - max_shift, idx_y - max_shift]]) * cell_size, angle, 0)[0]
+
+        # Refinement with exact counts. Only the points near the edges of the quads can change, the others keep
+        # their coarse status (inside or outside)
+        angle_step = float(np.min(np.diff(np.sort(angles)))) / 2 if len(angles) > 1 else 0.0
+        radius = np.max(np.linalg.norm(quads.reshape(-1, 2) - center, axis=1))
+        margin = 2 * cell_size + np.deg2rad(2 * angle_step) * radius
+        kernel = np.ones((2 * int(np.ceil(margin / cell_size)) + 3,) * 2, dtype=np.uint8)
+        edges = cv2.dilate(footprint, kernel) != cv2.erode(footprint, kernel)
+
+        def grid_points(points, angle, shift):
+            # Points in the frame of the grid rotated by angle and shifted by shift
+            return GridAlignment.rotate_points(points - shift, -angle, center)
+
+        cells = np.floor((grid_points(xy, best_angle, best_shift) - origin) / cell_size).astype(np.int64)
+        cells = np.clip(cells, 0, np.array(shape[::-1]) - 1)
+        near_edges = edges[cells[:, 1], cells[:, 0]]
+        fixed_count = int(np.count_nonzero(footprint[cells[:, 1], cells[:, 0]][~near_edges]))
+        xy_edges = xy[near_edges]
+
+        def count_inside(angle, shift):
+            return fixed_count + int(np.count_nonzero(ParcelAnalysis.label_xy(grid_points(xy_edges, angle, shift), quads) >= 0))
+
+        best_count = count_inside(best_angle, best_shift)
+        step = cell_size
+        while step >= min_step:
+            candidates = [(best_angle + da, best_shift + np.array([dx, dy]))
+                          for da in ((-angle_step, 0.0, angle_step) if angle_step > 0 else (0.0,))
+                          for dx in (-step, 0.0, step) for dy in (-step, 0.0, step)]
+            for angle, shift in candidates:
+                count = count_inside(angle, shift)
+                if count > best_count:
+                    best_count, best_angle, best_shift = count, angle, shift
+            step, angle_step = step / 2, angle_step / 2
+
+        # Apply the rotation (around the vertical axis of the grid) and the translation to the line sets
+        best_translation = frame[:2].T @ best_shift
+        if best_angle != 0:
+            c, s = np.cos(np.deg2rad(best_angle)), np.sin(np.deg2rad(best_angle))
+            rotation = frame.T @ np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]]) @ frame
+            line_sets = GridOperations.rotate_grid(line_sets, rotation, frame[:2].T @ center)
+
+        print(f"Best translation: {best_translation}, rotation: {best_angle:.3f} deg with {best_count} points inside")
         line_sets = GridOperations.line_sets_translation(line_sets, best_translation)
 
-        return line_sets, best_translation
+        if visualize:
+            o3d.visualization.draw_geometries([green_pcd] + line_sets)
 
+        return line_sets, best_translation
@@ -12,6 +12,7 @@ from orthomosaic.orthomosaic_loader import OrthomosaicLoader
 from pointcloud.pointcloud_loader import PointCloudLoader
 from grid.grid_operations import GridOperations
 from grid.grid_alignment import GridAlignment
+from utils.utils import load_grid
 
 
 class GridProcessor:
@@ -32,7 +33,17 @@ class GridProcessor:
             self.suffix = '_NDVI'
 
     def _load_parcel_points(self):
-        """Load parcel points from JSON file"""
+        """
+        Load parcel points from the binary grid file (one array of quads per row, memory-mapped),
+        or from the JSON file if the grid file does not exist
+        """
+        grid_file = self.config['data_sources'].get('parcel_grid_file')
+        grid_path = os.path.join(self._data_dir, grid_file) if grid_file else None
+        if grid_path and os.path.exists(grid_path):
+            grid = load_grid(grid_path)
+            row_offsets = grid['row_offsets']
+            return [grid['quads'][start:end] for start, end in zip(row_offsets[:-1], row_offsets[1:]) if end > start]
+
         parcel_points_path = os.path.join(self._data_dir, self.config['data_sources']['parcel_points_file'])
         try:
             with open(parcel_points_path, "r") as f:
@@ -0,0 +1,179 @@
+"""
+Binary cache of the text point clouds (x y z r g b nx ny nz) and parallel text parser for the first load
+"""
+import io
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils.utils import load_npz, save_npz
+
+CLOUD_FORMAT_VERSION = 1  # Version of the binary point cloud file (.cloud.npz)
+CHUNK_SIZE = 32 * 1024 * 1024  # Bytes of text parsed by each task
+
+
+def _parse_text_chunk(args):
+    """
+    Parse the lines of a byte range of a text point cloud with format: x y z r g b nx ny nz
+    """
+    filename, start, end = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        text = f.read(end - start).decode()
+
+    if not text.strip():
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.uint8), np.zeros((0, 3), dtype=np.float32)
+
+    data = np.loadtxt(io.StringIO(text), ndmin=2)
+    return data[:, :3], data[:, 3:6].astype(np.uint8), data[:, 6:9].astype(np.float32)
+
+
+class PointCloudCache:
+    """
+    Compact binary layout of a point cloud, saved next to the text file as an uncompressed .npz: xyz as float32
+    offsets from an origin (float64), rgb as uint8 and normals quantised to int8 (18 bytes per point instead of
+    72 bytes of float64). Its arrays are memory-mapped (load_raw), so the file is not read into memory before they
+    are decoded; decoding them (load, or PointCloudLoader.load_cloud into open3d) builds the full arrays in memory.
+    """
+
+    @staticmethod
+    def cache_path(filename):
+        """Get the binary cache path of a text point cloud"""
+        return os.path.splitext(filename)[0] + '.cloud.npz'
+
+    @staticmethod
+    def parse_text(filename, num_workers=None):
+        """
+        Parse a text point cloud with several processes, each one with a range of lines of the file
+        Returns xyz (N, 3) float64, rgb (N, 3) uint8 and normals (N, 3) float32
+        """
+        num_workers = num_workers or os.cpu_count() or 1
+        size = os.path.getsize(filename)
+        n_chunks = max(1, -(-size // CHUNK_SIZE))
+
+        # Byte ranges that start and end at the beginning of a line
+        bounds = [0]
+        with open(filename, 'rb') as f:
+            for k in range(1, n_chunks):
+                f.seek(max(size * k // n_chunks, bounds[-1]))
+                f.readline()
+                bounds.append(min(f.tell(), size))
+        bounds.append(size)
+        tasks = [(filename, start, end) for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+
+        if num_workers == 1 or len(tasks) == 1:
+            parts = [_parse_text_chunk(task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(min(num_workers, len(tasks))) as pool:
+                parts = list(pool.map(_parse_text_chunk, tasks))
+
+        if not parts:
+            return _parse_text_chunk((filename, 0, 0))
+        return tuple(np.concatenate([part[k] for part in parts]) for k in range(3))
+
+    @staticmethod
+    def encode(xyz, rgb, normals):
+        """
+        Get the arrays of the binary layout: origin (3,) float64, xyz offsets (N, 3) float32, rgb (N, 3) uint8 and
+        normals (N, 3) int8 (scaled by 127)
+        """
+        xyz = np.asarray(xyz, dtype=np.float64).reshape(-1, 3)
+        origin = xyz.min(axis=0) if len(xyz) else np.zeros(3)
+        return (origin,
+                (xyz - origin).astype(np.float32),
+                np.clip(np.asarray(rgb).reshape(-1, 3), 0, 255).astype(np.uint8),
+                np.clip(np.rint(np.asarray(normals).reshape(-1, 3) * 127), -127, 127).astype(np.int8))
+
+    @staticmethod
+    def decode(origin, xyz, rgb, normals):
+        """
+        Decode the arrays of the binary layout to full arrays in memory
+        Returns xyz (N, 3) float64, rgb (N, 3) uint8 and normals (N, 3) float32
+        """
+        return xyz + origin, np.asarray(rgb), normals.astype(np.float32) / 127
+
+    @staticmethod
+    def save(cache_file, xyz, rgb, normals, source_mtime_ns=None):
+        """
+        Save a point cloud in the binary layout (written to a temporary file and renamed, so a cache is never partial)
+        source_mtime_ns: modification time of the text cloud it was parsed from (now if it was not parsed)
+        """
+        origin, xyz, rgb, normals = PointCloudCache.encode(xyz, rgb, normals)
+        source_mtime_ns = time.time_ns() if source_mtime_ns is None else source_mtime_ns
+
+        save_npz(cache_file,
+                 format_version=np.array(CLOUD_FORMAT_VERSION),
+                 source_mtime_ns=np.array(source_mtime_ns, dtype=np.int64),
+                 origin=origin,
+                 xyz=xyz,
+                 rgb=rgb,
+                 normals=normals)
+
+    @staticmethod
+    def load_raw(cache_file):
+        """
+        Load the arrays of a binary point cloud memory-mapped, as stored (see encode), without copying them
+        """
+        data = load_npz(cache_file)
+        version = int(data.get('format_version', 0))
+        if version != CLOUD_FORMAT_VERSION:
+            raise ValueError(f"Unsupported point cloud version {version} in {cache_file}, expected {CLOUD_FORMAT_VERSION}")
+
+        return np.asarray(data['origin']), data['xyz'], data['rgb'], data['normals']
+
+    @staticmethod
+    def load(cache_file):
+        """
+        Load a binary point cloud decoded to full arrays in memory (see load_raw to keep them memory-mapped)
+        Returns xyz (N, 3) float64, rgb (N, 3) uint8 and normals (N, 3) float32
+        """
+        return PointCloudCache.decode(*PointCloudCache.load_raw(cache_file))
+
+    @staticmethod
+    def is_valid(filename):
+        """Check if the binary cache of a text point cloud exists and is not older than the text file"""
+        cache_file = PointCloudCache.cache_path(filename)
+        if not os.path.exists(cache_file):
+            return False
+        if not os.path.exists(filename):
+            return True
+
+        data = load_npz(cache_file)
+        return (int(data.get('format_version', 0)) == CLOUD_FORMAT_VERSION and
+                os.stat(filename).st_mtime_ns <= int(data.get('source_mtime_ns', -1)))
+
+    @staticmethod
+    def load_raw_arrays(filename, num_workers=None):
+        """
+        Load the arrays of a point cloud as stored in the binary layout (see encode): memory-mapped from its binary
+        cache if it is up to date, otherwise parsed from the text file, creating the cache for the next loads
+        """
+        cache_file = PointCloudCache.cache_path(filename)
+        if PointCloudCache.is_valid(filename):
+            return PointCloudCache.load_raw(cache_file)
+
+        source_mtime_ns = os.stat(filename).st_mtime_ns
+        xyz, rgb, normals = PointCloudCache.parse_text(filename, num_workers)
+        try:
+            PointCloudCache.save(cache_file, xyz, rgb, normals, source_mtime_ns)
+        except OSError as e:
+            print(f"⚠️ Could not save the point cloud cache: {cache_file}")
+            print(f"   Error: {e}")
+            # Same (quantised) values as the loads from the cache
+            return PointCloudCache.encode(xyz, rgb, normals)
+
+        return PointCloudCache.load_raw(cache_file)
+
+    @staticmethod
+    def load_arrays(filename, num_workers=None):
+        """
+        Load the arrays of a point cloud (see load_raw_arrays) decoded to full arrays in memory
+        Returns xyz (N, 3) float64, rgb (N, 3) uint8 and normals (N, 3) float32
+        """
+        return PointCloudCache.decode(*PointCloudCache.load_raw_arrays(filename, num_workers))
+
+    @staticmethod
+    def convert(filename, num_workers=None):
+        """One-time conversion of a text point cloud to its binary cache. Returns the cache path"""
+        PointCloudCache.load_raw_arrays(filename, num_workers)
+        return PointCloudCache.cache_path(filename)
@@ -1,6 +1,7 @@
 import os 
 import numpy as np
 import open3d as o3d
+from pointcloud.pointcloud_cache import PointCloudCache
 from pointcloud.pointcloud_loader import PointCloudLoader
 
 class PointCloudDownsampler:
@@ -71,7 +72,13 @@ class PointCloudDownsampler:
         p = np.asarray(cloud.points)
         c = (np.asarray(cloud.colors) * 255).astype(int)  # Denormalize
         n = np.asarray(cloud.normals)
-        data = np.hstack((p, c, n))
-        np.savetxt(output_path, data, fmt="%.3f %.3f %.3f %d %d %d %.6f %.6f %.6f")
+
+        # The binary cache is always saved, the text file only if requested (load_cloud uses the cache)
+        source_mtime_ns = None
+        if self.config["data_sources"].get("save_text_cloud", False):
+            data = np.hstack((p, c, n))
+            np.savetxt(output_path, data, fmt="%.3f %.3f %.3f %d %d %d %.6f %.6f %.6f")
+            source_mtime_ns = os.stat(output_path).st_mtime_ns
+        PointCloudCache.save(PointCloudCache.cache_path(output_path), p, c, n, source_mtime_ns)
         print(f"  Saved downsampled cloud to: {output_path}\n")
 
@@ -1,9 +1,11 @@
 """
 Point cloud loading and processing utilities
 """
+import os
 import sys
 import numpy as np
 import open3d as o3d
+from pointcloud.pointcloud_cache import PointCloudCache
 from utils.utils import rotation_matrix_from_vectors
 
 
@@ -23,17 +25,31 @@ class PointCloudLoader:
             suffix=suffix
         )
     
+    @staticmethod
+    def cloud_exists(filename):
+        """Check if a text point cloud or its binary cache exists"""
+        return os.path.exists(filename) or os.path.exists(PointCloudCache.cache_path(filename))
+
+    @staticmethod
+    def cloud_file(filename):
+        """Get the file that holds the data of a point cloud: the text file, or its binary cache if there is no text"""
+        return filename if os.path.exists(filename) else PointCloudCache.cache_path(filename)
+
     @staticmethod
     def load_cloud(filename):
         """
         Load point cloud from text file with format: x y z r g b nx ny nz
+        The binary cache next to the file (.cloud.npz) is used if it is up to date, otherwise it is created.
+        Its memory-mapped arrays are decoded straight into the open3d cloud (one float64 array at a time), with
+        the points as offsets translated by the origin in open3d
         """
         try:
-            data = np.loadtxt(filename)
+            origin, xyz, rgb, normals = PointCloudCache.load_raw_arrays(filename)
             cloud = o3d.geometry.PointCloud()
-            cloud.points = o3d.utility.Vector3dVector(data[:, :3])
-            cloud.colors = o3d.utility.Vector3dVector(data[:, 3:6] / 255.0)            
-            cloud.normals = o3d.utility.Vector3dVector(data[:, 6:9])
+            cloud.points = o3d.utility.Vector3dVector(xyz.astype(np.float64))
+            cloud.translate(origin)
+            cloud.colors = o3d.utility.Vector3dVector(rgb / 255.0)
+            cloud.normals = o3d.utility.Vector3dVector(normals / 127.0)
             return cloud
         except Exception as e:
             print(f"❌ Failed to load point cloud: {filename}")
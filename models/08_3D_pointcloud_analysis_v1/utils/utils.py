@@ -1,8 +1,12 @@
 import os
 import yaml
 import json
+import struct
+import zipfile
 import numpy as np
 
+GRID_FORMAT_VERSION = 1  # Version of the parcel grid file (.npz) written by top_view/create_grid
+
 
 def load_config(filename: str):
     if os.path.exists(filename):
@@ -16,9 +20,67 @@ def load_json(filename):
             return json.load(f)
     raise FileNotFoundError(f"File {filename} not found.")
 
+def load_npz(filename):
+    """
+    Load the arrays of an uncompressed .npz file memory-mapped (read only), without reading them into memory
+    """
+    if not os.path.exists(filename):
+        raise FileNotFoundError(f"File {filename} not found.")
+
+    arrays = {}
+    with zipfile.ZipFile(filename) as archive, open(filename, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+
+            # Compressed members can not be memory-mapped
+            if info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+
+            # The .npy file starts after the local file header (30 bytes, file name and extra field)
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if len(shape) == 0 or np.prod(shape) == 0:
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                arrays[name] = np.lib.format.read_array(f)
+            else:
+                arrays[name] = np.memmap(filename, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                       order='F' if fortran_order else 'C')
+    return arrays
+
+def load_grid(filename):
+    """
+    Load a parcel grid file (.npz) with memory-mapped arrays: quads (N, 4, 2), centers (N, 2), areas (N,),
+    rows (N,), cols (N,), row_offsets (R + 1,) and row_points (K, 2, 2)
+    """
+    grid = load_npz(filename)
+    version = int(grid.pop('format_version', 0))
+    if version != GRID_FORMAT_VERSION:
+        raise ValueError(f"Unsupported parcel grid version {version} in {filename}, expected {GRID_FORMAT_VERSION}")
+    return grid
+
+def save_npz(filename, **arrays):
+    """
+    Save arrays to an uncompressed .npz file (written to a temporary file and renamed, so a file is never partial)
+    """
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_file, filename)
+
 def save_json(filename, data):
-    with open(filename, "w") as f:
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, "w") as f:
         json.dump(data, f, indent=4)
+    os.replace(tmp_file, filename)
 
 def rotation_matrix_from_vectors(vec1, vec2):
     a = vec1 / np.linalg.norm(vec1)
@@ -75,8 +75,7 @@ def main():
 
     # Load RGB orthomosaic
     tif_path = base_path_images + 'orthomosaic_cropped_230609.tif'
-    ortho_image, r_image, g_image, b_image, mask  =  op.read_orthomosaic(tif_path)
-    ortho_image_res, r_image_res, _, _, mask_res = op.resize_orthomosaic(ortho_image, r_image, g_image, b_image, mask, tam)
+    ortho_image_res, r_image_res, _, _, mask_res = op.read_orthomosaic_resized(tif_path, tam)
     print(ortho_image_res.shape)
 
     # Load parcel points
@@ -86,15 +85,13 @@ def main():
 
     # Load NIR 
     tif_path = base_path_images +'cropped_NIR_orthomosaic_230609.tif'
-    nir_image =  op.read_one_channel_orthomosaic(tif_path)
-    nir_image_res = op.resize_and_convert_type(nir_image, tam)
+    nir_image_res = op.read_one_channel_resized(tif_path, tam)
     #cv2.imwrite('nir_image_res.jpg', nir_image_res)
     print(nir_image_res.shape)
 
     # Load r_spectral image
     tif_path = base_path_images + 'cropped_R_orthomosaic_230609.tif'
-    r_spectral = op.read_one_channel_orthomosaic(tif_path)
-    r_spectral_res = op.resize_and_convert_type(r_spectral, tam)
+    r_spectral_res = op.read_one_channel_resized(tif_path, tam)
 
 
     # Calculate NDVI and generate labels based on NDVI
@@ -103,8 +100,9 @@ def main():
     # Calculate nvdi image
     ndvi_image = vi.ndvi(nir_image_res, r_spectral_res)
 
-    # Calculate mean NDVI for each parcel 
-    ndvi_parcels = pp.calculate_mean_per_parcel(ndvi_image, all_parcels, False) 
+    # Rasterise the parcels once per grid (cached in the features folder) and calculate mean NDVI for each parcel 
+    parcel_labels = pp.get_parcel_labels(all_parcels, ndvi_image.shape, base_path_features)
+    ndvi_parcels = pp.calculate_mean_per_parcel(ndvi_image, all_parcels, False, parcel_labels) 
     
     # Generate labels based on NDVI 
     labels = pp.generate_ndvi_labels(ndvi_parcels)
@@ -1,6 +1,8 @@
+import os
 import numpy as np 
 import random
 import json
+import hashlib
 from tqdm import tqdm 
 import cv2
 
@@ -47,31 +49,129 @@ class ParcelProcessor:
         return labels
 
 
-    def calculate_mean_per_parcel(self, array_aux, all_parcels, lai_process): 
-        h, w = array_aux.shape[0:2]
-        mean_values = []
-        for parcel in tqdm(all_parcels, desc='Processing parcels...', unit='parcel'): 
-
-            # Get actual parcel mask  
-            parcel_mask = np.zeros((h, w, 1), dtype=np.uint8)
-            cv2.fillPoly(parcel_mask, [np.array(parcel)], color = (255,255,255))
-            masked_parcel = cv2.bitwise_and(array_aux, array_aux, mask=parcel_mask)
-            area_parcel = np.count_nonzero(masked_parcel)
-            
-
-            if(not lai_process):
-                value = np.sum(masked_parcel) / area_parcel
-
-            else: 
-                all_values = masked_parcel[masked_parcel > self.NDVI_LIM].tolist()
-                if(len(all_values)>0):
-                    value = np.sum(all_values) / area_parcel
-                else: 
-                    value = 0.0
-
-            mean_values.append(value)
-
-        return mean_values
+    def rasterize_parcels(self, all_parcels, shape): 
+        """
+        Rasterises every parcel once into a label image. Pixel value 0 is background and 
+        parcel i is stored as i + 1. Where two parcels share border pixels, the later parcel wins.
+
+        Args:
+            all_parcels (list): Flattened list of parcels, each one defined by its 4 corner points.
+            shape (tuple): Height and width of the image the parcels are defined in.
+
+        Returns:
+            numpy.ndarray: int32 label image with one parcel id per pixel.
+        """
+        h, w = shape[0:2]
+        parcel_labels = np.zeros((h, w), dtype=np.int32)
+        for i, parcel in enumerate(tqdm(all_parcels, desc='Rasterising parcels...', unit='parcel')): 
+            cv2.fillPoly(parcel_labels, [np.array(parcel, dtype=np.int32)], color=i + 1)
+
+        return parcel_labels
+
+
+    def get_parcel_labels(self, all_parcels, shape, cache_dir=None): 
+        """
+        Returns the parcel label image, loading it from disk if it was already rasterised for 
+        the same grid and image size. The cache file name is a hash of the parcel points and the shape, 
+        so a new grid never reuses stale labels.
+
+        Args:
+            all_parcels (list): Flattened list of parcels, each one defined by its 4 corner points.
+            shape (tuple): Height and width of the image the parcels are defined in.
+            cache_dir (str): Folder where the label images are cached. If None, nothing is cached.
+
+        Returns:
+            numpy.ndarray: int32 label image with one parcel id per pixel.
+        """
+        if cache_dir is None:
+            return self.rasterize_parcels(all_parcels, shape)
+
+        key = hashlib.sha1(np.asarray(all_parcels, dtype=np.int32).tobytes())
+        key.update(np.asarray(shape[0:2], dtype=np.int64).tobytes())
+        path_labels = os.path.join(cache_dir, 'parcel_labels_{0}.npy'.format(key.hexdigest()[:16]))
+
+        if os.path.exists(path_labels):
+            return np.load(path_labels, mmap_mode='r')
+
+        parcel_labels = self.rasterize_parcels(all_parcels, shape)
+        os.makedirs(cache_dir, exist_ok=True)
+        np.save(path_labels, parcel_labels)
+
+        return parcel_labels
+
+
+    def calculate_stats_per_parcel(self, array_aux, parcel_labels, total_parcels, valid_mask=None): 
+        """
+        Computes count, sum, mean, min, max and std of the image values for every parcel in a single pass.
+
+        Args:
+            array_aux (numpy.ndarray): Image with the values to aggregate (e.g. NDVI).
+            parcel_labels (numpy.ndarray): Label image returned by get_parcel_labels.
+            total_parcels (int): Number of parcels in the grid.
+            valid_mask (numpy.ndarray): Optional boolean image, only True pixels are aggregated.
+
+        Returns:
+            dict: Arrays of length total_parcels with keys 'count', 'sum', 'mean', 'min', 'max' and 'std'. 
+                  Parcels without pixels get NaN in the mean, min, max and std.
+        """
+        labels = np.asarray(parcel_labels).ravel()
+        values = np.asarray(array_aux, dtype=np.float64).ravel()
+
+        # Only pixels inside a parcel (and valid, if requested) take part in the reductions
+        inside = labels > 0
+        if valid_mask is not None:
+            inside &= np.asarray(valid_mask, dtype=bool).ravel()
+        labels = labels[inside] - 1
+        values = values[inside]
+
+        count = np.bincount(labels, minlength=total_parcels).astype(np.float64)
+        total = np.bincount(labels, weights=values, minlength=total_parcels)
+        total_sq = np.bincount(labels, weights=values * values, minlength=total_parcels)
+
+        min_values = np.full(total_parcels, np.inf)
+        max_values = np.full(total_parcels, -np.inf)
+        np.minimum.at(min_values, labels, values)
+        np.maximum.at(max_values, labels, values)
+
+        empty = count == 0
+        mean = np.divide(total, count, out=np.full(total_parcels, np.nan), where=~empty)
+        var = np.divide(total_sq, count, out=np.full(total_parcels, np.nan), where=~empty) - mean * mean
+        min_values[empty] = np.nan
+        max_values[empty] = np.nan
+
+        return {
+            'count': count,
+            'sum': total,
+            'mean': mean,
+            'min': min_values,
+            'max': max_values,
+            'std': np.sqrt(np.maximum(var, 0.0)),
+        }
+
+
+    def calculate_mean_per_parcel(self, array_aux, all_parcels, lai_process, parcel_labels=None): 
+        if parcel_labels is None:
+            parcel_labels = self.rasterize_parcels(all_parcels, array_aux.shape)
+
+        total_parcels = len(all_parcels)
+        labels = np.asarray(parcel_labels).ravel()
+        values = np.asarray(array_aux, dtype=np.float64).ravel()
+
+        # Area of each parcel only takes into account the non-zero values (bin 0 is the background)
+        area_parcels = np.bincount(labels, weights=(values != 0), minlength=total_parcels + 1)[1:]
+
+        if(not lai_process):
+            sum_parcels = np.bincount(labels, weights=values, minlength=total_parcels + 1)[1:]
+        else: 
+            sum_parcels = np.bincount(labels, weights=np.where(values > self.NDVI_LIM, values, 0.0), minlength=total_parcels + 1)[1:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_values = sum_parcels / area_parcels
+
+        if(lai_process):
+            mean_values[sum_parcels == 0] = 0.0
+
+        return mean_values.tolist()
 
 
 
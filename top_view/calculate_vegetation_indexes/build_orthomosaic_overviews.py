@@ -0,0 +1,48 @@
+""" Code to build the overview pyramid of the orthomosaics once, so decimated reads do not decode the full image """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2024, Noumena"
+__credits__ = ["Esther Vera, Oriol Arroyo, Salvador Calgua, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import os
+from tqdm import tqdm
+
+from src.tiled_orthomosaic_reader import TiledOrthomosaicReader
+
+
+# Setup paths (local images and ZENODO tree)
+base_paths = ['./../../data/images/', '/run/media/noumena/8TB/ZENODO']
+
+# Overviews
+FACTORS = (2, 4, 8, 16)
+EXTERNAL = True  # If True, overviews are saved in a .ovr file next to each TIF; otherwise inside the TIF
+
+
+
+# MAIN
+##################################################################################################################
+
+def main():
+
+    # Find all orthomosaics
+    tif_paths = []
+    for base_path in base_paths:
+        for root, _, files in os.walk(base_path):
+            tif_paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.tif', '.tiff'))]
+
+    # Build the overviews of the files that do not have them yet
+    built = 0
+    for tif_path in tqdm(tif_paths, desc='Building overviews'):
+        built += TiledOrthomosaicReader.build_overviews(tif_path, FACTORS, EXTERNAL)
+
+    print(f'Overviews built for {built} of {len(tif_paths)} orthomosaics')
+
+
+
+if __name__ == '__main__':
+    main()
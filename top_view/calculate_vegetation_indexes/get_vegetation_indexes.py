@@ -37,78 +37,46 @@ def main():
     # Load images
     ##########################################################################
     tif_path = base_path_images + 'orthomosaic_cropped_230609.tif'
-    ortho_image, r_image, g_image, b_image, mask = op.read_orthomosaic(tif_path)
-    ortho_image_res, r_image_res, g_image_res, b_image_res, mask_res = op.resize_orthomosaic(ortho_image, r_image, g_image, b_image, mask, tam)
+    ortho_image_res, r_image_res, g_image_res, b_image_res, mask_res = op.read_orthomosaic_resized(tif_path, tam)
     mask_res_rgb = cv2.cvtColor(mask_res, cv2.COLOR_GRAY2RGB)
     print(ortho_image_res.shape)
 
     # Load NIR 
     tif_path = base_path_images +'cropped_NIR_orthomosaic_230609.tif'
-    nir_image = op.read_one_channel_orthomosaic(tif_path)
-    nir_image_res = op.resize_and_convert_type(nir_image, tam)
+    nir_image_res = op.read_one_channel_resized(tif_path, tam)
 
     # Load spectral R
     tif_path = base_path_images + 'cropped_R_orthomosaic_230609.tif'
-    r_spectral = op.read_one_channel_orthomosaic(tif_path)
-    r_spectral_res = op.resize_and_convert_type(r_spectral, tam)
+    r_spectral_res = op.read_one_channel_resized(tif_path, tam)
 
     # Load spectral G
     tif_path = base_path_images + 'cropped_G_orthomosaic_230609.tif'
-    g_spectral = op.read_one_channel_orthomosaic(tif_path)
-    g_spectral_res = op.resize_and_convert_type(g_spectral, tam)
+    g_spectral_res = op.read_one_channel_resized(tif_path, tam)
 
     # Load RE
     tif_path = base_path_images + 'cropped_RE_orthomosaic_230609.tif'
-    re_image = op.read_one_channel_orthomosaic(tif_path)
-    re_image_res = op.resize_and_convert_type(re_image, tam)
+    re_image_res = op.read_one_channel_resized(tif_path, tam)
   
 
     # Calculate vegetation indexes
     ##########################################################################
     
-    # Calculate nvdi
-    ndvi_image = vi.ndvi(nir_image_res, r_spectral_res)
-    ndvi_image = op.normalize_image(ndvi_image)
-  
-    # Get colormap and save
-    ndvi_final = apply_colormap(ndvi_image, mask_res_rgb, 0, 255)
-    save_colormap(ndvi_final, 'ndvi_map.png', False)
-
-
-    # Calculate gndvi
-    gndvi_image = vi.gndvi(nir_image_res, g_spectral_res)
-    gndvi_image = op.normalize_image(gndvi_image)
-  
-    # Get colormap and save
-    gndvi_final = apply_colormap(gndvi_image, mask_res_rgb, 0, 255)
-    save_colormap(gndvi_final, 'gndvi_map.png', False)
-
-  
-    # Calculate ndwi
-    ndwi_image = vi.ndwi(nir_image_res, g_spectral_res)
-    ndwi_image = op.normalize_image(ndwi_image)
-  
-    # Get colormap and save
-    ndwi_final = apply_colormap(np.max(ndwi_image) - ndwi_image, mask_res_rgb, 0, 255)
-    save_colormap(ndwi_final, 'ndwi_map.png', False)
-
-
-    # Calculate ndre
-    ndre_image = vi.ndre(nir_image_res, re_image_res)
-    ndre_image = op.normalize_image(ndre_image)
-  
-    # Get colormap and save
-    ndre_final = apply_colormap(ndre_image, mask_res_rgb, 0, 255)
-    save_colormap(ndre_final, 'ndre_map.png', True)
-    
-
-    # Calculate vari
-    vari_image = vi.vari(r_image_res, g_image_res, b_image_res)
-    vari_image = op.normalize_image(vari_image)
-  
-    # Get colormap and save
-    vari_final = apply_colormap(vari_image, mask_res_rgb, 0, 255)
-    save_colormap(vari_final, 'vari_map.png', False)
+    # All the indexes in a single pass (bands are loaded once), saved as a memory-mapped array
+    indices = ['ndvi', 'gndvi', 'ndwi', 'ndre', 'vari']
+    bands = {'nir': nir_image_res, 'r_spectral': r_spectral_res, 'g_spectral': g_spectral_res, 're': re_image_res,
+             'r': r_image_res, 'g': g_image_res, 'b': b_image_res}
+    index_images = vi.compute(indices, bands, out_path=base_path_features + 'vegetation_indexes.npy')
+
+    for index_image, name in zip(index_images, indices):
+        index_image = op.normalize_image(index_image)
+
+        # NDWI colormap is inverted
+        if name == 'ndwi':
+            index_image = np.max(index_image) - index_image
+
+        # Get colormap and save
+        index_final = apply_colormap(index_image, mask_res_rgb, 0, 255)
+        save_colormap(index_final, name + '_map.png', name == 'ndre')
  
 
 
@@ -7,6 +7,8 @@ from osgeo import gdal
 import copy 
 import numpy as np
 
+from src.tiled_orthomosaic_reader import TiledOrthomosaicReader
+
 class OrthomosaicProcessor:
     def __init__(self):
         pass
@@ -19,12 +21,12 @@ class OrthomosaicProcessor:
 
     @staticmethod
     def read_orthomosaic(tif_path):
-        with rasterio.open(tif_path) as src:
-            red_band = src.read(1)
-            green_band = src.read(2)
-            blue_band = src.read(3)
-            rgb_image = cv2.merge([blue_band, green_band, red_band])
-            mask = src.read(4)
+        # The BGR image is filled tile by tile and the bands are views of it (no extra copy per band)
+        with TiledOrthomosaicReader(tif_path) as reader:
+            rgb_image = reader.read_bgr()
+            mask = reader.read_mask()
+
+        blue_band, green_band, red_band = rgb_image[:, :, 0], rgb_image[:, :, 1], rgb_image[:, :, 2]
 
         return rgb_image, red_band, green_band, blue_band, mask
 
@@ -38,12 +40,32 @@ class OrthomosaicProcessor:
 
         return ortho_image_res, r_image_res, g_image_res, b_image_res, mask_res
 
+    @staticmethod
+    def read_orthomosaic_resized(tif_path, tam=(2346, 1805)):
+        # Reads the bands directly at the target size (from the overviews if the file has them) instead of
+        # reading the full resolution image and calling resize_orthomosaic
+        with TiledOrthomosaicReader(tif_path) as reader:
+            rgb_image_res = np.ascontiguousarray(np.moveaxis(reader.read_decimated((3, 2, 1), tam), 0, -1))
+            mask_res = reader.read_mask(out_shape=(tam[1], tam[0]))
+
+        b_image_res, g_image_res, r_image_res = rgb_image_res[:, :, 0], rgb_image_res[:, :, 1], rgb_image_res[:, :, 2]
+
+        return rgb_image_res, r_image_res, g_image_res, b_image_res, mask_res
+
     @staticmethod
     def read_one_channel_orthomosaic(tif_path):
         with rasterio.open(tif_path) as src:
             img = src.read(1)
         return img
 
+    @staticmethod
+    def read_one_channel_resized(tif_path, tam=(2346, 1805)):
+        # Same result as read_one_channel_orthomosaic + resize_and_convert_type without decoding the full image
+        with TiledOrthomosaicReader(tif_path) as reader:
+            img_res = reader.read_decimated(1, tam)
+        img_res = ((img_res / 65535.0) * 255.0).astype(np.uint8)
+        return img_res
+
     @staticmethod
     def read_dem(dem_path):
         dataset = gdal.Open(dem_path, gdal.GA_ReadOnly)
@@ -10,6 +10,7 @@ Functions:
 - `ndre(nir, re)`: Computes the Normalized Difference Red Edge Index (NDRE).
 - `ndwi(nir, g)`: Computes the Normalized Difference Water Index (NDWI).
 - `vari(nir, g)`: Computes the Atmospheric Visible Resistance Index (VARI).
+- `compute(indices, bands)`: Computes several of the indices above in a single tiled pass.
 
 Args:
     r (numpy.ndarray): Red band image captured by RGB camera..
@@ -31,12 +32,28 @@ Usage:
     ndvi_image = vegetation_indices.ndvi(nir_image, red_spectral, image)
 
     # Other vegetation index calculations can be performed similarly.
+
+    # Several indices at once, streamed by tiles into a multi-band GeoTIFF:
+    VegetationIndices.compute(['ndvi', 'ndre'], {'nir': nir_image, 'r_spectral': red_spectral, 're': re_image},
+                              out_path='indices.tif')
 """
 
+import contextlib
 import numpy as np
+import rasterio
+from rasterio.windows import Window
 
 
 class VegetationIndices:
+
+    # Bands of each index as (a, b, c), index = (a - b) / (a + b - c). c is None for the normalized differences
+    INDEX_BANDS = {
+        'ndvi': ('nir', 'r_spectral', None),
+        'gndvi': ('nir', 'g_spectral', None),
+        'ndwi': ('g_spectral', 'nir', None),
+        'ndre': ('nir', 're', None),
+        'vari': ('g', 'r', 'b'),
+    }
    
     @staticmethod
     def ndvi(nir, r_spectral): 
@@ -145,3 +162,103 @@ class VegetationIndices:
         
         except Exception as e:
             raise ValueError("Error computing VARI: {}".format(str(e)))
+
+    @staticmethod
+    def compute(indices, bands, out_path=None, tile_rows=512, transform=None, crs=None):
+        """
+        Computes any subset of the indices in a single pass over the image, strip by strip. Each band is loaded
+        (and cast to float32) once per strip into preallocated buffers that are shared by all the indices, and the
+        division is done in place with np.divide(..., where=), so pixels with a zero denominator are set to 0.
+
+        Args:
+            indices (list): Names of the indices to compute (keys of INDEX_BANDS), e.g. ['ndvi', 'ndre'].
+            bands (dict): Band name ('nir', 'r_spectral', 'g_spectral', 're', 'r', 'g', 'b') to a 2D array
+                          (np.ndarray or np.memmap) or to the path of a single band raster, read by windows.
+            out_path (str): None to return an in-memory array, a '.npy' path to return a memory-mapped array or a
+                            '.tif' path to write a multi-band float32 GeoTIFF (one band per index, in order).
+            tile_rows (int): Number of rows of each strip.
+            transform (affine.Affine): Transform of the GeoTIFF output. If None, the one of the first raster band.
+            crs (rasterio.crs.CRS): CRS of the GeoTIFF output. If None, the one of the first raster band.
+
+        Returns:
+            numpy.ndarray or str: Array with shape (len(indices), h, w), or out_path if the output is a GeoTIFF.
+        """
+        try:
+            unknown = [name for name in indices if name not in VegetationIndices.INDEX_BANDS]
+            if unknown:
+                raise ValueError("unknown indices {}".format(unknown))
+
+            needed = {band for name in indices for band in VegetationIndices.INDEX_BANDS[name] if band is not None}
+            missing = sorted(needed - set(bands))
+            if missing:
+                raise ValueError("missing bands {}".format(missing))
+
+            with contextlib.ExitStack() as stack:
+
+                # Open the bands given as paths, the arrays are sliced directly
+                sources = {}
+                for band in sorted(needed):
+                    if isinstance(bands[band], str):
+                        sources[band] = stack.enter_context(rasterio.open(bands[band]))
+                        transform = sources[band].transform if transform is None else transform
+                        crs = sources[band].crs if crs is None else crs
+                    else:
+                        sources[band] = bands[band]
+
+                shapes = {(src.height, src.width) if hasattr(src, 'height') else src.shape for src in sources.values()}
+                if len(shapes) != 1:
+                    raise ValueError("bands with different shapes {}".format(shapes))
+                h, w = shapes.pop()
+
+                # Output
+                dst, out = None, None
+                if out_path is None:
+                    out = np.empty((len(indices), h, w), dtype=np.float32)
+                elif out_path.endswith('.npy'):
+                    out = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=(len(indices), h, w))
+                else:
+                    dst = stack.enter_context(rasterio.open(out_path, 'w', driver='GTiff', height=h, width=w,
+                                                            count=len(indices), dtype='float32', transform=transform,
+                                                            crs=crs, tiled=True, compress='deflate'))
+                    for i, name in enumerate(indices):
+                        dst.set_band_description(i + 1, name)
+
+                # Preallocated buffers of one strip
+                band_buf = {band: np.empty((tile_rows, w), dtype=np.float32) for band in sources}
+                num = np.empty((tile_rows, w), dtype=np.float32)
+                den = np.empty((tile_rows, w), dtype=np.float32)
+                valid = np.empty((tile_rows, w), dtype=bool)
+                out_tile = np.empty((len(indices), tile_rows, w), dtype=np.float32) if dst is not None else None
+
+                for row in range(0, h, tile_rows):
+                    rows = min(tile_rows, h - row)
+
+                    # Load every band once for all the indices
+                    for band, src in sources.items():
+                        if isinstance(src, rasterio.io.DatasetReader):
+                            band_buf[band][:rows] = src.read(1, window=Window(0, row, w, rows))
+                        else:
+                            np.copyto(band_buf[band][:rows], src[row:row + rows], casting='unsafe')
+
+                    for k, name in enumerate(indices):
+                        a, b, c = VegetationIndices.INDEX_BANDS[name]
+                        np.subtract(band_buf[a][:rows], band_buf[b][:rows], out=num[:rows])
+                        np.add(band_buf[a][:rows], band_buf[b][:rows], out=den[:rows])
+                        if c is not None:
+                            np.subtract(den[:rows], band_buf[c][:rows], out=den[:rows])
+                        np.not_equal(den[:rows], 0, out=valid[:rows])
+
+                        target = out_tile[k, :rows] if dst is not None else out[k, row:row + rows]
+                        target[...] = 0
+                        np.divide(num[:rows], den[:rows], out=target, where=valid[:rows])
+
+                    if dst is not None:
+                        dst.write(out_tile[:, :rows], window=Window(0, row, w, rows))
+
+                if isinstance(out, np.memmap):
+                    out.flush()
+
+            return out_path if dst is not None else out
+
+        except Exception as e:
+            raise ValueError("Error computing vegetation indices: {}".format(str(e)))
@@ -20,7 +20,7 @@ from src.utils import save_data, save_images, show_images
 # VARIABLES 
 # ===============================================================================================
 
-# If true, the start point for the first row can be defined manually; if false, it will use the predefined coordinate
+# If true, the start point for the first row can be defined manually; if false, it will be estimated from the vegetation mask
 select_points = False 
 #select_points = True
 
@@ -32,7 +32,7 @@ VINEYARD_HEIGHT = 30  # Height of the vineyard row
 #PARCEL_LEN = 14      # Size of the parcels (1 m in real life when taking into account image resized and resolution)
 #PARCEL_LEN = 27      # Size of the parcels (1 m in real life when taking into account image resized and resolution)
 
-VINEYARD_SEP = 74     # Separation between vineyards rows
+VINEYARD_SEP = None   # Separation between vineyards rows (None to estimate it from the vegetation mask, 74 for 230609)
 PARCEL_LEN = 141.9    # Size of the parcels (5.2 m in real life when vineyard image in real size)
 
 # Paths to saved data
@@ -67,7 +67,7 @@ def main():
 
     # ===============================================================================================
     # Save and show data
-    save_data(base_path, all_parcel_points, parallel_rows_points, centers_parcels)
+    save_data(base_path, all_parcel_points, parallel_rows_points, centers_parcels, pdet.parcel_grid)
     save_images(masked_rows_image, parcel_rows_image, map_rows_image)
     show_images(masked_rows_image, parcel_rows_image, map_rows_image)
 
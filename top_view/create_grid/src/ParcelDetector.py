@@ -32,122 +32,66 @@ class ParcelDetector:
         self._filtered_rows_image = filtered_rows_image
         self._parallel_rows_points = parallel_rows_points
         self._parcel_len = PARCEL_LEN
+        self.parcel_grid = None
 
 
-    def get_center_of_parcel(self, parcel, center_parcels) -> list: 
+    def get_parcel_grid(self, rows_corners) -> dict:
         """
-        Calculates the centroid (center of mass) of a given parcel (polygon).
+        Builds the parcels of all the vineyard rows at once. Each row (defined by its corners) is divided in parcels
+        of PARCEL_LEN along the direction from the left-up to the right-up corner; the last parcel ends in the right
+        corners. If the remaining length is at least 0.4 parcels it is a new parcel (ex. 5.3 parcels >> 6 parcels).
 
         Args:
-            parcel (list or ndarray): List of coordinates representing the vertices of the parcel.
-                                    Assumes that the parcel has 4 vertices.
-            center_parcels (list): A list where the computed centroid will be appended.
+            rows_corners (np.ndarray): Corners of each row with shape (R, 4, 2), in order left-up, left-down,
+                                       right-up and right-down (as returned by get_corners).
 
         Returns:
-            list: The updated list `center_parcels` containing the centroid coordinates of the parcel.
+            dict: Parcel grid with:
+                - quads (np.ndarray): Parcel points with shape (N, 4, 2), int32.
+                - centers (np.ndarray): Centroid of each parcel with shape (N, 2).
+                - areas (np.ndarray): Area of each parcel with shape (N,).
+                - rows (np.ndarray): Index of the row of each parcel with shape (N,).
+                - cols (np.ndarray): Index of each parcel inside its row with shape (N,).
+                - row_offsets (np.ndarray): Parcels of row r are quads[row_offsets[r]:row_offsets[r + 1]], shape (R + 1,).
         """
-        n = 4     # The number of vertices
-        A = 0     # Initialize the area of the polygon
-        C_x = 0   # Initialize the x-coordinate of the centroid
-        C_y = 0   # Initialize the y-coordinate of the centroid
-
-        # Convert the parcel to a list and ensure the polygon is closed by appending the first point at the end
-        closed_parcel = parcel.tolist()
-        closed_parcel.append(parcel[0])
-
-        # Calculate the center of the parcel 
-        for i in range(n):
-            factor = closed_parcel[i][0] * closed_parcel[i + 1][1] - closed_parcel[i + 1][0] * closed_parcel[i][1]
-            A += factor
-            C_x += (closed_parcel[i][0] + closed_parcel[i + 1][0]) * factor
-            C_y += (closed_parcel[i][1] + closed_parcel[i + 1][1]) * factor
-
-        A = A / 2
-        C_x = C_x / (6 * A)
-        C_y = C_y / (6 * A)
-        center_parcels.append([])
-        center_parcels[-1].append([C_x, C_y])
-
-        return center_parcels
-
-
-    def get_total_parcels_and_deltas(self, all_corners) -> tuple[int, list]: 
-        """
-        Gets the total number of parcels that can fit in a vineyard row defined by its corner points,
-        along with the displacement (deltas) in the x and y directions for each parcel.
-
-        Args:
-            all_corners (list): A list containing the coordinates of the four corners of the vineyard row.
-
-        Returns:
-            tuple: A tuple containing the following values:
-                - total_parcels (int): The total number of parcels that can fit within the defined vineyard row.
-                - deltas (list): A list containing two elements:
-                    - delta_x (float): The displacement in the x-direction for each parcel.
-                    - delta_y (float): The displacement in the y-direction for each parcel.
-        """
-        # Calculates total length of the actual vineyard row
-        dist_total = int(np.sqrt((all_corners[2][0] - all_corners[0][0])**2 + (all_corners[2][1] - all_corners[0][1])**2))
-        
-        # Calculates the total of parcel dividing the total distance between the length ot the parcel
-        total_parcels = (dist_total/self._parcel_len)
-
-        # Calculates displacement of x,y for each parcel 
-        delta_x = (all_corners[2][0] - all_corners[0][0]) / total_parcels
-        delta_y = (all_corners[2][1] - all_corners[0][1]) / total_parcels
-        deltas = [delta_x, delta_y]
-
-        # If the total parcels is not a round number, one parcel is added (ex. 5.3 parcels >> 6 parcels)
-        if(total_parcels - int(total_parcels) >=0.4):
-            total_parcels = int(total_parcels) + 1
-        else: 
-            total_parcels = int(total_parcels)
-
-        return total_parcels, deltas
-
-
-    def get_parcel_points(self, k, all_parcel_points, center_parcels, total_parcels, all_corners, deltas) -> tuple[list, list]:
-        """
-        Gets the points that define each parcel in the vineyard row.
-
-        Args:
-            all_parcel_points (list): List containing the points of each parcel.
-            center_parcels (list): List containing the central points of each parcel.
-            total_parcels (int): Total number of parcels.
-            all_corners (list): List of corner points of the vineyard row.
-
-        Returns:
-            tuple: Updated all_parcel_points (list), center_parcels (list).
-        """
-        # Calculates the angle between the left-up corner and the right-up corner
-        angle = np.arctan2(all_corners[2][1] - all_corners[0][1], all_corners[2][0] - all_corners[0][0])
-
-        # Get parcel points depending on k, displacement and size of parcel
-        p1_init_x = all_corners[0][0] + k * deltas[0]
-        p1_init_y = all_corners[0][1] + k * deltas[1]
-        p2_init_x = all_corners[1][0] + k * deltas[0]
-        p2_init_y = all_corners[1][1] + k * deltas[1]
-
-        p1_end_x = p1_init_x + self._parcel_len * np.cos(angle)
-        p1_end_y = p1_init_y + self._parcel_len * np.sin(angle)
-        p2_end_x = p2_init_x + self._parcel_len * np.cos(angle)
-        p2_end_y = p2_init_y + self._parcel_len * np.sin(angle)
-
-        p1_init = (p1_init_x, p1_init_y)
-        p2_init = (p2_init_x, p2_init_y)
-
-        # If it's the last parcel, the end points will be the ones in all_corners
-        if(k == total_parcels - 1):
-            p1_end = all_corners[2]
-            p2_end = all_corners[3]
-        else: 
-            p1_end = (p1_end_x, p1_end_y)
-            p2_end = (p2_end_x, p2_end_y)
-
-        parcel = np.array([p1_init, p2_init, p2_end, p1_end], np.int32)
-        center_parcels = self.get_center_of_parcel(parcel, center_parcels)
-
-        return parcel, center_parcels
+        rows_corners = np.asarray(rows_corners, dtype=np.float64).reshape(-1, 4, 2)
+        corner_LU, corner_LD = rows_corners[:, 0], rows_corners[:, 1]
+        corner_RU, corner_RD = rows_corners[:, 2], rows_corners[:, 3]
+
+        # Total of parcels in each row and displacement in x,y (deltas) for each parcel
+        length = corner_RU - corner_LU
+        dist_total = np.trunc(np.hypot(length[:, 0], length[:, 1]))
+        total_parcels = dist_total / self._parcel_len
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deltas = length / total_parcels[:, None]
+        total_parcels = np.where(total_parcels - np.trunc(total_parcels) >= 0.4, np.trunc(total_parcels) + 1, np.trunc(total_parcels)).astype(int)
+
+        # Row and column index of every parcel
+        rows = np.repeat(np.arange(len(rows_corners)), total_parcels)
+        cols = np.arange(total_parcels.sum()) - np.repeat(np.cumsum(total_parcels) - total_parcels, total_parcels)
+        last = cols == total_parcels[rows] - 1
+
+        # Parcel points: init points displaced k times, end points at PARCEL_LEN (or the right corners in the last one)
+        angle = np.arctan2(length[:, 1], length[:, 0])
+        step = self._parcel_len * np.stack([np.cos(angle), np.sin(angle)], axis=1)
+        p1_init = corner_LU[rows] + cols[:, None] * deltas[rows]
+        p2_init = corner_LD[rows] + cols[:, None] * deltas[rows]
+        p1_end = np.where(last[:, None], corner_RU[rows], p1_init + step[rows])
+        p2_end = np.where(last[:, None], corner_RD[rows], p2_init + step[rows])
+        quads = np.stack([p1_init, p2_init, p2_end, p1_end], axis=1).astype(np.int32)
+
+        # Centroid (center of mass) and area of each parcel with the shoelace formula
+        x, y = quads[:, :, 0].astype(np.float64), quads[:, :, 1].astype(np.float64)
+        x_next, y_next = np.roll(x, -1, axis=1), np.roll(y, -1, axis=1)
+        factor = x * y_next - x_next * y
+        signed_area = factor.sum(axis=1) / 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            centers = np.stack([((x + x_next) * factor).sum(axis=1), ((y + y_next) * factor).sum(axis=1)], axis=1) / (6 * signed_area[:, None])
+
+        row_offsets = np.concatenate([[0], np.cumsum(total_parcels)])
+
+        return {'quads': quads, 'centers': centers, 'areas': np.abs(signed_area), 'rows': rows, 'cols': cols,
+                'row_offsets': row_offsets}
 
 
     def get_corners(self, contour) -> list:
@@ -181,46 +125,119 @@ class ParcelDetector:
 
     def get_all_parcel_points(self)-> tuple[list, list]: 
         """
-        Calculates the position of each parcel in the vineyard rows.
+        Calculates the position of each parcel in the vineyard rows. The parcel grid (arrays) is also kept,
+        see get_parcel_grid and save_data.
 
         Returns:
             tuple: all_parcel_points (list), center_parcels (list).
         """
-        all_parcel_points = []
-        center_parcels = []
-
         # Detects edges and contours
         edges = cv2.Canny(self._filtered_rows_image,10,50) 
         contours = cv2.findContours(edges,cv2.RETR_EXTERNAL,cv2.CHAIN_APPROX_NONE)[0]
         sorted_contours = self.sort_contours(contours)
 
         # For each contour
+        rows_corners = []
         for cnt in tqdm(sorted_contours, desc="Defining parcel points"): 
             # Draw contour 
             self._filtered_rows_image = cv2.drawContours(self._filtered_rows_image, [cnt], -1, (255, 155, 0), 2)
 
             # Get 4 corners of the rectangle that defines the contour
-            all_corners = self.get_corners(cnt)
-
-            # Get the total of parcels in the rows and the displacement in x,y (deltas)
-            total_parcels, deltas = self.get_total_parcels_and_deltas(all_corners)
+            rows_corners.append(self.get_corners(cnt))
 
-            if(total_parcels>0):
-                all_parcel_points.append([])
+        # Get all parcels points of all the rows at once
+        self.parcel_grid = self.get_parcel_grid(rows_corners)
 
-            # For each parcel in the row
-            for k in range(total_parcels):
-                # Get all parcels points
-                parcel, center_parcels = self.get_parcel_points(k, all_parcel_points, center_parcels, total_parcels, all_corners, deltas)   
-                all_parcel_points[-1].append(parcel.tolist())    
+        # Nested lists (rows without parcels are skipped)
+        quads, rows = self.parcel_grid['quads'], self.parcel_grid['rows']
+        all_parcel_points = [quads[rows == row].tolist() for row in np.unique(rows)]
+        center_parcels = [[center] for center in self.parcel_grid['centers'].tolist()]
 
         return all_parcel_points, center_parcels
 
 
+    def get_contours_boxes(self, contours) -> np.ndarray:
+        """
+        Gets the bounding box of each contour.
+
+        Args:
+            contours (list): List of contours.
+
+        Returns:
+            boxes (np.ndarray): Array with shape (N, 4) with x_min, y_min, x_max, y_max (inclusive) of each contour.
+        """
+        boxes = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=np.float64).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2] - 1
+
+        return boxes
+
+
+    @staticmethod
+    def segment_intersects_boxes(point1, point2, boxes, margin) -> np.ndarray:
+        """
+        Checks which boxes are crossed by a segment (Liang-Barsky clipping, vectorized over all the boxes).
+
+        Args:
+            point1 (tuple): Start point (x, y) of the segment.
+            point2 (tuple): End point (x, y) of the segment.
+            boxes (np.ndarray): Array with shape (N, 4) with x_min, y_min, x_max, y_max of each box.
+            margin (float): Distance added to every side of the boxes (e.g. the thickness of the line).
+
+        Returns:
+            np.ndarray: Boolean array with shape (N,), True where the segment crosses the box.
+        """
+        x0, y0 = float(point1[0]), float(point1[1])
+        dx, dy = float(point2[0]) - x0, float(point2[1]) - y0
+
+        # Clip the segment (t in [0, 1]) against the 4 sides of every box
+        t_min = np.zeros(len(boxes))
+        t_max = np.ones(len(boxes))
+        inside = np.ones(len(boxes), dtype=bool)
+        sides = [(-dx, x0 - (boxes[:, 0] - margin)), (dx, (boxes[:, 2] + margin) - x0),
+                 (-dy, y0 - (boxes[:, 1] - margin)), (dy, (boxes[:, 3] + margin) - y0)]
+        for p, q in sides:
+            if p == 0:
+                inside &= q >= 0
+            elif p < 0:
+                t_min = np.maximum(t_min, q / p)
+            else:
+                t_max = np.minimum(t_max, q / p)
+
+        return inside & (t_min <= t_max)
+
+
+    def line_overlaps_contour(self, line_image, cnt, box) -> bool:
+        """
+        Checks if a row line overlaps a filled contour. The contour is only drawn inside its bounding box (clipped
+        to the image) and compared with the same region of the line image.
+
+        Args:
+            line_image (np.ndarray): Single channel image with the row line drawn.
+            cnt (np.ndarray): Contour.
+            box (np.ndarray): Bounding box of the contour (x_min, y_min, x_max, y_max).
+
+        Returns:
+            bool: True if the line and the contour overlap.
+        """
+        h, w = line_image.shape[:2]
+        x_min, y_min = max(int(box[0]), 0), max(int(box[1]), 0)
+        x_max, y_max = min(int(box[2]), w - 1), min(int(box[3]), h - 1)
+        if x_min > x_max or y_min > y_max:
+            return False
+        line_roi = line_image[y_min:y_max + 1, x_min:x_max + 1]
+
+        blank = np.zeros_like(line_roi)
+        blank = cv2.drawContours(blank, [cnt], -1, 255, -1, offset=(-x_min, -y_min))
+
+        return bool(np.any(cv2.bitwise_and(line_roi, blank)))
+
+
     def sort_contours(self, contours) -> list:
         """
         Sorts the contours based on the vineyard rows and returns them in order. 
         Red lines stored in parallel_rows_points are in order but not the contours.
+        Only the contours whose bounding box is crossed by a row line are checked pixel-wise, and only inside
+        their bounding box, instead of drawing every (row, contour) pair on two full-size images.
 
         Args:
             contours (list): List of contours.
@@ -231,42 +248,35 @@ class ParcelDetector:
         self._rows = []
         sorted_contours = []
         contours = list(contours)
+        boxes = self.get_contours_boxes(contours)
+        remaining = np.ones(len(contours), dtype=bool)
 
         # For each row defined in parallel_rows_points (red lines)
         for points in tqdm(self._parallel_rows_points, desc="Sorting contours defining rows"):
-            appended_contours = []
-            indexes = []
+
+            # Contours not assigned yet whose bounding box is crossed by the line (9 px thick)
+            candidates = np.flatnonzero(remaining & self.segment_intersects_boxes(points[0], points[1], boxes, 9))
 
             # Draw the line on the blank image to represent the current row
-            blank1 = np.zeros_like(self._filtered_rows_image)
-            blank1 = cv2.line(blank1, points[0], points[1], (255,255,255), 9)
-
-            # For each one of the contours detected 
-            for i,cnt in enumerate(contours): 
-                # Draw the contour
-                blank2 = np.zeros_like(self._filtered_rows_image)
-                blank2 = cv2.drawContours(blank2, [cnt], -1, (255, 255, 255), -1)
-
-                # Check if the line and the contour detected are overlapping
-                mask = cv2.bitwise_and(blank1, blank2)
-                if np.any(mask): 
-                    # Save contour and index overlapped in a list. It can be more than one contour overlapped with a row line 
-                    indexes.append(i)
-                    appended_contours.append(cnt) 
-            
+            indexes = []
+            if len(candidates):
+                blank = np.zeros(self._filtered_rows_image.shape[:2], dtype=np.uint8)
+                blank = cv2.line(blank, points[0], points[1], 255, 9)
+
+                # Check if the line and the contour detected are overlapping. It can be more than one contour overlapped with a row line
+                indexes = [i for i in candidates if self.line_overlaps_contour(blank, contours[i], boxes[i])]
+
             # For every contour overlapped
-            if appended_contours:
+            if indexes:
                 # Sort contours overlapped
-                appended_contours = sorted(appended_contours, key=lambda c: cv2.boundingRect(c)[0])
+                appended_contours = sorted([contours[i] for i in indexes], key=lambda c: cv2.boundingRect(c)[0])
                 rect = cv2.minAreaRect(appended_contours[0])
                 box = np.int0(cv2.boxPoints(rect))
                 self._rows.append(box[0])
 
-                # Delete contours overlapped from contours to reduce executing time 
-                indexes = sorted(indexes, reverse=True)
-                for index, appended_cnt in zip(indexes, appended_contours): 
-                    sorted_contours.append(appended_cnt)
-                    contours.pop(index)
+                # Remove contours overlapped from the candidates of the next rows
+                sorted_contours.extend(appended_contours)
+                remaining[indexes] = False
 
         return sorted_contours
 
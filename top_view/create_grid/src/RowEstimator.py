@@ -0,0 +1,213 @@
+""" Class to estimate the orientation, separation and position of the vineyard rows from the vegetation mask """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2024, Noumena"
+__credits__ = ["Esther Vera, Oriol Arroyo, Salvador Calgua, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import cv2
+import numpy as np
+
+
+class RowEstimator:
+    def __init__(self, ortho_image, mask, max_size=1024, max_samples=40000):
+        """
+        Initializes the RowEstimator class. The estimation is done on a downsampled copy of the orthomosaic,
+        the results are given in pixels of the original image.
+
+        Args:
+            ortho_image (np.ndarray): The orthomosaic image of the vineyard (BGR).
+            mask (np.ndarray): The mask defining the vineyard area.
+            max_size (int): Size of the longest side of the downsampled image.
+            max_samples (int): Maximum number of vegetation pixels used to refine the estimation.
+        """
+        self._h, self._w = mask.shape[:2]
+        self._scale = min(1.0, max_size / max(self._h, self._w))
+        size = (max(int(self._w * self._scale), 1), max(int(self._h * self._scale), 1))
+        self._small_image = cv2.resize(ortho_image, size, interpolation=cv2.INTER_AREA)
+        self._small_mask = cv2.resize(mask, size, interpolation=cv2.INTER_NEAREST) > 0
+        self._max_samples = max_samples
+        self.angle = None    # Direction of the rows in degrees (image coordinates, in (-90, 90])
+        self.spacing = None  # Separation between rows in pixels
+        self.offset = None   # Position of a row along the normal direction, in [0, spacing)
+
+
+    def get_vegetation_mask(self) -> np.ndarray:
+        """
+        Segments the vegetation inside the vineyard area with the excess green index (2G - R - B) and Otsu.
+
+        Returns:
+            vegetation_mask (np.ndarray): Boolean mask of the vegetation in the downsampled image.
+        """
+        b, g, r = cv2.split(self._small_image.astype(np.int16))
+        exg = ((2 * g - r - b + 510) // 4).astype(np.uint8)
+
+        threshold, _ = cv2.threshold(exg[self._small_mask].reshape(-1, 1), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        vegetation_mask = (exg > threshold) & self._small_mask
+
+        return vegetation_mask
+
+
+    def get_spectrum_peak(self, vegetation_mask, min_period=3) -> tuple[float, float]:
+        """
+        Gets the strongest periodic pattern of the vegetation mask from the peak of its 2D FFT.
+
+        Args:
+            vegetation_mask (np.ndarray): Boolean mask of the vegetation in the downsampled image.
+            min_period (float): Minimum separation between rows in pixels of the downsampled image.
+
+        Returns:
+            tuple: phi (float), angle of the normal to the rows in radians, and period (float) in pixels
+                   of the downsampled image.
+        """
+        signal = vegetation_mask.astype(np.float32)
+        signal[self._small_mask] -= signal[self._small_mask].mean()
+
+        # Zero padding to get a finer frequency grid
+        size = cv2.getOptimalDFTSize(2 * max(signal.shape))
+        spectrum = np.abs(np.fft.rfft2(signal, s=(size, size)))
+
+        # Only frequencies between a few rows in the image and min_period
+        fy = np.fft.fftfreq(size)[:, None]
+        fx = np.fft.rfftfreq(size)[None, :]
+        freq = np.hypot(fx, fy)
+        valid = (freq >= 4 / min(signal.shape)) & (freq <= 1 / min_period)
+        spectrum[~valid] = 0
+
+        ky, kx = np.unravel_index(np.argmax(spectrum), spectrum.shape)
+        phi = np.arctan2(fy[ky, 0], fx[0, kx])
+
+        return phi, 1 / freq[ky, kx]
+
+
+    def refine(self, points, phi, period, phi_range, period_range, steps=11) -> tuple[float, float, complex]:
+        """
+        Refines the angle and period by maximizing the periodogram of the vegetation pixels projected on the normal
+        direction, in a grid around the initial values.
+
+        Args:
+            points (np.ndarray): Coordinates (x, y) of vegetation pixels, with shape (N, 2).
+            phi (float): Angle of the normal to the rows in radians.
+            period (float): Separation between rows in pixels.
+            phi_range (float): Half width of the search range of phi.
+            period_range (float): Half width of the search range of the period.
+            steps (int): Number of values tested in each range.
+
+        Returns:
+            tuple: phi (float), period (float) and the periodogram value (complex) at the maximum.
+        """
+        phis = phi + np.linspace(-phi_range, phi_range, steps)
+        periods = period + np.linspace(-period_range, period_range, steps)
+
+        # Projection of the points on every normal direction, and periodogram for every period
+        projections = points @ np.stack([np.cos(phis), np.sin(phis)])
+        values = np.exp(2j * np.pi * projections[:, :, None] / periods[None, None, :]).mean(axis=0)
+
+        i, j = np.unravel_index(np.argmax(np.abs(values)), values.shape)
+
+        return phis[i], periods[j], values[i, j]
+
+
+    def estimate(self) -> tuple[float, float, float]:
+        """
+        Estimates the dominant orientation, separation and position of the rows: coarse estimation with the FFT
+        of the downsampled vegetation mask and refinement on the vegetation pixels in original image coordinates.
+
+        Returns:
+            tuple: angle (float) of the rows in degrees, spacing (float) between rows in pixels and offset (float),
+                   position of a row along the normal direction (-sin(angle), cos(angle)).
+        """
+        vegetation_mask = self.get_vegetation_mask()
+        phi, period = self.get_spectrum_peak(vegetation_mask)
+        period = period / self._scale
+
+        # Vegetation pixels in original image coordinates (random subset to bound the cost)
+        ys, xs = np.nonzero(vegetation_mask)
+        points = (np.stack([xs, ys], axis=1) + 0.5) / self._scale - 0.5
+        if len(points) > self._max_samples:
+            points = points[np.random.default_rng(0).choice(len(points), self._max_samples, replace=False)]
+
+        # Refinement, each time in a smaller range
+        phi_range = np.radians(2.0)
+        period_range = 0.05 * period
+        for _ in range(3):
+            phi, period, value = self.refine(points, phi, period, phi_range, period_range)
+            phi_range /= 5
+            period_range /= 5
+
+        # Normal angle in (0, 180] degrees, so the rows angle is in (-90, 90]. Flipping the normal mirrors the phase
+        if not 0 < phi <= np.pi:
+            phi = phi + np.pi if phi <= 0 else phi - np.pi
+            value = np.conj(value)
+
+        self.angle = float(np.degrees(phi) - 90)
+        self.spacing = float(period)
+        self.offset = float((np.angle(value) / (2 * np.pi) * period) % period)
+
+        return self.angle, self.spacing, self.offset
+
+
+    def get_rows_coordinates(self) -> list:
+        """
+        Gets two points of every row that crosses the image, centered on the center of the image.
+
+        Returns:
+            rows_coordinates (list): List of rows, each one as [[x1, y1], [x2, y2]].
+        """
+        if self.angle is None:
+            self.estimate()
+
+        direction = np.array([np.cos(np.radians(self.angle)), np.sin(np.radians(self.angle))])
+        normal = np.array([-direction[1], direction[0]])
+        center = np.array([self._w / 2, self._h / 2])
+        length = np.hypot(self._w, self._h)
+
+        # Rows whose position along the normal is inside the image
+        corners = np.array([[0, 0], [self._w, 0], [0, self._h], [self._w, self._h]]) @ normal
+        first = int(np.ceil((corners.min() - self.offset) / self.spacing))
+        last = int(np.floor((corners.max() - self.offset) / self.spacing))
+
+        rows_coordinates = []
+        for k in range(first, last + 1):
+            point = center + (self.offset + k * self.spacing - center @ normal) * normal
+            point1 = point - length / 2 * direction
+            point2 = point + length / 2 * direction
+            rows_coordinates.append([[int(point1[0]), int(point1[1])], [int(point2[0]), int(point2[1])]])
+
+        return rows_coordinates
+
+
+    def get_row_coordinates(self, point=None, length=None) -> list:
+        """
+        Gets two points of the row closest to a point, to be used as the initial row of VineyardRowDetector.
+
+        Args:
+            point (tuple): Point (x, y) in the image. If None, the centroid of the vineyard area.
+            length (float): Distance between the two points. If None, a quarter of the shortest side of the image.
+
+        Returns:
+            coordinates (list): Points of the row as [[x1, y1], [x2, y2]].
+        """
+        if self.angle is None:
+            self.estimate()
+
+        if point is None:
+            ys, xs = np.nonzero(self._small_mask)
+            point = ((xs.mean() + 0.5) / self._scale - 0.5, (ys.mean() + 0.5) / self._scale - 0.5)
+        length = min(self._h, self._w) / 4 if length is None else length
+
+        direction = np.array([np.cos(np.radians(self.angle)), np.sin(np.radians(self.angle))])
+        normal = np.array([-direction[1], direction[0]])
+        point = np.asarray(point, dtype=np.float64)
+
+        # Projection of the point on the closest row
+        k = np.round((point @ normal - self.offset) / self.spacing)
+        point = point + (self.offset + k * self.spacing - point @ normal) * normal
+        point1 = point - length / 2 * direction
+        point2 = point + length / 2 * direction
+
+        return [[int(point1[0]), int(point1[1])], [int(point2[0]), int(point2[1])]]
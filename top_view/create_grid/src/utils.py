@@ -12,9 +12,13 @@ __license__ = "MIT"
 import os 
 import cv2 
 import json 
+import struct
+import zipfile
 import numpy as np 
 
-def save_data(base_path, parcel_points, parallel_rows_points, centers_parcels): 
+GRID_FORMAT_VERSION = 1  # Version of the parcel grid file (.npz), increase it when the arrays change
+
+def save_data(base_path, parcel_points, parallel_rows_points, centers_parcels, parcel_grid=None): 
     """
     Saves parcel and row data into JSON files.
 
@@ -23,6 +27,8 @@ def save_data(base_path, parcel_points, parallel_rows_points, centers_parcels):
         parcel_points (list): A list containing the points that define each parcel.
         parallel_rows_points (list): A list of points representing parallel rows.
         centers_parcels (list): A list containing the center points of each parcel.
+        parcel_grid (dict): Optional parcel grid arrays (see ParcelDetector.get_parcel_grid), saved as a binary
+                            grid file (see save_grid).
     """
     base_path_features = base_path + 'features/'
 
@@ -31,12 +37,114 @@ def save_data(base_path, parcel_points, parallel_rows_points, centers_parcels):
         with open(os.path.join(base_path_features, filename), 'w') as f:
             json.dump(data, f)
 
-    # Save all JSON files
+    # Save all JSON files (kept for compatibility)
     save_json(parcel_points, 'parcel_points_oriented.json')
     save_json(parallel_rows_points, 'parallel_rows_points_oriented.json')
     save_json(centers_parcels, 'parcel_centers_points_oriented.json')
+
+    # Save the parcel grid arrays, so they can be loaded without parsing the JSON files
+    if parcel_grid is not None:
+        save_grid(os.path.join(base_path_features, 'parcel_grid_oriented.npz'), parcel_grid, parallel_rows_points)
     print("Data saved successfully")
 
+
+def save_grid(grid_path, parcel_grid, parallel_rows_points): 
+    """
+    Saves the parcel grid as a versioned binary file (.npz). The arrays are stored uncompressed so that
+    load_grid can memory-map them.
+
+    Contents:
+        - format_version: GRID_FORMAT_VERSION.
+        - quads (N, 4, 2) int32: Points of each parcel.
+        - centers (N, 2) float64: Centroid of each parcel.
+        - areas (N,) float64: Area of each parcel in pixels.
+        - rows (N,), cols (N,): Row of each parcel and position inside its row.
+        - row_offsets (R + 1,): Parcels of row r are quads[row_offsets[r]:row_offsets[r + 1]].
+        - row_points (K, 2, 2) int32: Points of the parallel rows.
+
+    Args:
+        grid_path (str): The path to the .npz file.
+        parcel_grid (dict): Parcel grid arrays (see ParcelDetector.get_parcel_grid).
+        parallel_rows_points (list): A list of points representing parallel rows.
+    """
+    np.savez(grid_path,
+             format_version=np.int64(GRID_FORMAT_VERSION),
+             quads=np.ascontiguousarray(parcel_grid['quads'], dtype=np.int32).reshape(-1, 4, 2),
+             centers=np.ascontiguousarray(parcel_grid['centers'], dtype=np.float64).reshape(-1, 2),
+             areas=np.ascontiguousarray(parcel_grid['areas'], dtype=np.float64),
+             rows=np.ascontiguousarray(parcel_grid['rows'], dtype=np.int64),
+             cols=np.ascontiguousarray(parcel_grid['cols'], dtype=np.int64),
+             row_offsets=np.ascontiguousarray(parcel_grid['row_offsets'], dtype=np.int64),
+             row_points=np.asarray(parallel_rows_points, dtype=np.int32).reshape(-1, 2, 2))
+
+
+def load_grid(grid_path, mmap=True) -> dict: 
+    """
+    Loads a parcel grid file (see save_grid). The arrays are memory-mapped from the .npz file (np.load does not
+    memory-map the members of a .npz), so loading the grid does not create a Python object per parcel.
+
+    Args:
+        grid_path (str): The path to the .npz file.
+        mmap (bool): If True, the arrays are memory-mapped (read-only); otherwise they are read into memory.
+
+    Returns:
+        grid (dict): Grid arrays by name (quads, centers, areas, rows, cols, row_offsets, row_points).
+    """
+    grid = {}
+    with zipfile.ZipFile(grid_path) as archive, open(grid_path, 'rb') as f:
+        for info in archive.infolist():
+            name = info.filename[:-len('.npy')]
+
+            # Compressed members can not be memory-mapped
+            if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                with archive.open(info) as member:
+                    grid[name] = np.lib.format.read_array(member)
+                continue
+
+            # The .npy file starts after the local file header (30 bytes, file name and extra field)
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack('<HH', f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            if len(shape) == 0 or np.prod(shape) == 0:
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+                grid[name] = np.lib.format.read_array(f)
+            else:
+                grid[name] = np.memmap(grid_path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                       order='F' if fortran_order else 'C')
+
+    version = int(grid.pop('format_version', 0))
+    if version != GRID_FORMAT_VERSION:
+        raise ValueError(f"Unsupported parcel grid version {version} in {grid_path}, expected {GRID_FORMAT_VERSION}")
+
+    return grid
+
+
+def export_grid_json(grid, base_path_features, suffix='_oriented'): 
+    """
+    Exports a parcel grid (see load_grid) to the JSON files used before the binary grid file, with the same
+    nested lists as save_data (rows without parcels are skipped).
+
+    Args:
+        grid (dict): Grid arrays.
+        base_path_features (str): Directory where the JSON files are saved.
+        suffix (str): Suffix of the file names (e.g. parcel_points_oriented.json).
+    """
+    quads, row_offsets = grid['quads'], grid['row_offsets']
+    parcel_points = [quads[start:end].tolist() for start, end in zip(row_offsets[:-1], row_offsets[1:]) if end > start]
+    centers_parcels = [[center] for center in grid['centers'].tolist()]
+
+    files = {'parcel_points': parcel_points, 'parallel_rows_points': grid['row_points'].tolist(),
+             'parcel_centers_points': centers_parcels}
+    for filename, data in files.items():
+        with open(os.path.join(base_path_features, f'{filename}{suffix}.json'), 'w') as f:
+            json.dump(data, f)
+
     
 def save_images(masked_rows_image, parcel_rows_image, map_rows_image): 
     """
@@ -0,0 +1,131 @@
+""" Regression check of ParcelDetector.sort_contours against the previous raster implementation with synthetic rows """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2024, Noumena"
+__credits__ = ["Esther Vera, Oriol Arroyo, Salvador Calgua, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import sys
+import cv2
+import numpy as np
+from src.ParcelDetector import ParcelDetector
+
+
+# VARIABLES
+# ===============================================================================================
+
+N_LAYOUTS = 100            # Number of synthetic layouts compared
+IMAGE_SIZE = (600, 900)    # Size (height, width) of the synthetic filtered rows image
+N_ROWS = 12                # Number of row lines in each layout
+N_CONTOURS = 60            # Number of contours drawn in each layout
+
+
+def sort_contours_raster(detector, contours) -> list:
+    """
+    Previous implementation of sort_contours: every (row, contour) pair is drawn on two full-size images.
+
+    Args:
+        detector (ParcelDetector): Parcel detector with the filtered rows image and the row lines.
+        contours (list): List of contours.
+
+    Returns:
+        tuple: Sorted contours and the rows (first box point of each row).
+    """
+    rows = []
+    sorted_contours = []
+    contours = list(contours)
+
+    for points in detector._parallel_rows_points:
+        appended_contours = []
+        indexes = []
+
+        blank1 = np.zeros_like(detector._filtered_rows_image)
+        blank1 = cv2.line(blank1, points[0], points[1], (255,255,255), 9)
+
+        for i,cnt in enumerate(contours):
+            blank2 = np.zeros_like(detector._filtered_rows_image)
+            blank2 = cv2.drawContours(blank2, [cnt], -1, (255, 255, 255), -1)
+
+            mask = cv2.bitwise_and(blank1, blank2)
+            if np.any(mask):
+                indexes.append(i)
+                appended_contours.append(cnt)
+
+        if appended_contours:
+            appended_contours = sorted(appended_contours, key=lambda c: cv2.boundingRect(c)[0])
+            rect = cv2.minAreaRect(appended_contours[0])
+            box = np.int0(cv2.boxPoints(rect))
+            rows.append(box[0])
+
+            indexes = sorted(indexes, reverse=True)
+            for index, appended_cnt in zip(indexes, appended_contours):
+                sorted_contours.append(appended_cnt)
+                contours.pop(index)
+
+    return sorted_contours, rows
+
+
+def create_layout(rng) -> tuple:
+    """
+    Creates synthetic slanted row lines and contours (rotated rectangles and irregular blobs) around them.
+
+    Args:
+        rng (np.random.Generator): Random generator.
+
+    Returns:
+        tuple: Filtered rows image, row lines and contours.
+    """
+    h, w = IMAGE_SIZE
+    image = np.zeros((h, w, 3), dtype=np.uint8)
+
+    ys = np.sort(rng.uniform(20, h - 20, N_ROWS))
+    slope = rng.uniform(-0.1, 0.1)
+    rows_points = [[(0, int(y)), (w - 1, int(y + slope * w))] for y in ys]
+
+    contours = []
+    for _ in range(N_CONTOURS):
+        center = (float(rng.uniform(0, w)), float(rng.uniform(0, h)))
+        if rng.random() < 0.5:
+            rect = (center, (float(rng.uniform(5, 120)), float(rng.uniform(2, 25))), float(rng.uniform(-20, 20)))
+            contours.append(np.int32(cv2.boxPoints(rect)).reshape(-1, 1, 2))
+        else:
+            blob = np.zeros((h, w), dtype=np.uint8)
+            angles = np.sort(rng.uniform(0, 2 * np.pi, 8))
+            radius = rng.uniform(3, 30, 8)
+            polygon = np.stack([center[0] + radius * np.cos(angles), center[1] + radius * np.sin(angles)], axis=1)
+            cv2.fillPoly(blob, [np.int32(polygon)], 255)
+            found, _ = cv2.findContours(blob, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours.extend(found)
+
+    return image, rows_points, contours
+
+
+def main():
+    rng = np.random.default_rng(0)
+    mismatches = 0
+
+    for layout in range(N_LAYOUTS):
+        image, rows_points, contours = create_layout(rng)
+        detector = ParcelDetector(image, None, image, rows_points, 50)
+
+        sorted_contours = detector.sort_contours(contours)
+        expected_contours, expected_rows = sort_contours_raster(detector, contours)
+
+        same = (len(sorted_contours) == len(expected_contours) and
+                all(np.array_equal(a, b) for a, b in zip(sorted_contours, expected_contours)) and
+                len(detector._rows) == len(expected_rows) and
+                all(np.array_equal(a, b) for a, b in zip(detector._rows, expected_rows)))
+        if not same:
+            mismatches += 1
+            print(f"Layout {layout}: sort_contours differs from the raster implementation")
+
+    print(f"{N_LAYOUTS - mismatches}/{N_LAYOUTS} layouts with the same sorted contours and rows")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,21 +15,22 @@ import os
 from src.OrthomosaicProcessor import OrthomosaicProcessor
 from src.VineyardRowDetector import VineyardRowDetector
 from src.ParcelDetector import ParcelDetector
+from src.RowEstimator import RowEstimator
 from src.utils import save_data, save_images, show_images
 
 
 # VARIABLES 
 # ===============================================================================================
 
-# If true, the start point for the first row can be defined manually; if false, it will use the predefined coordinate
+# If true, the start point for the first row can be defined manually; if false, it will be estimated from the vegetation mask
 select_point = False 
 # select_point = True
 
 # Depending on the vineyard or the image size, this should be defined 
 VINEYARD_HEIGHT = 30  # Height of the vineyard row
-VINEYARD_SEP = 74     # Separation between vineyards rows
+VINEYARD_SEP = None   # Separation between vineyards rows (None to estimate it from the vegetation mask, 74 for 230609)
 PARCEL_LEN = 141.9    # Size of the parcels (1 m in real life when vineyard image in real size)
-ORIENTATION = -13     # Angle to rotate the vineyard image so the rows are aligned with the image 
+ORIENTATION = None    # Angle to rotate the vineyard image so the rows are aligned with the image (None to estimate it, -13 for 230609)
 
 # Paths to saved data
 base_path = './../../data/'
@@ -45,8 +46,9 @@ def main():
     op = OrthomosaicProcessor()
     tif_path = os.path.join(base_path_images, "orthomosaic_cropped_230609.tif")
     ortho_image, _, _, _, mask = op.read_orthomosaic(tif_path) 
-    # Rotates the vineyard orthomosaic and mask to aligned them with the image
-    ortho_image, mask = op.preprocess_images(ortho_image, mask, ORIENTATION) 
+    # Rotates the vineyard orthomosaic and mask to aligned them with the image (orientation of the rows estimated if not defined)
+    orientation = ORIENTATION if ORIENTATION is not None else RowEstimator(ortho_image, mask).estimate()[0]
+    ortho_image, mask = op.preprocess_images(ortho_image, mask, orientation) 
 
     # ===============================================================================================
     # Create a VineyardRowDetector object to get the rows in the vineyard
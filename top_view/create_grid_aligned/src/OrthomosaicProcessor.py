@@ -13,6 +13,8 @@ import cv2
 import rasterio
 import numpy as np
 
+from src.TiledOrthomosaicReader import TiledOrthomosaicReader
+
 
 class OrthomosaicProcessor:
     def __init__(self):
@@ -29,15 +31,15 @@ class OrthomosaicProcessor:
             tif_path (str): The file path to the TIF orthomosaic image.
 
         Returns:
-            tuple: A tuple containing the RGB image (as a numpy array), 
-                   the red band, green band, blue band, and a mask (numpy arrays).
+            tuple: A tuple containing the RGB image (as a numpy array in BGR order), 
+                   the red band, green band, blue band (views of the RGB image), and a mask (numpy arrays).
         """
-        with rasterio.open(tif_path) as src:
-            red_band = src.read(1)
-            green_band = src.read(2)
-            blue_band = src.read(3)
-            rgb_image = cv2.merge([blue_band, green_band, red_band])
-            mask = src.read(4)
+        # The BGR image is filled tile by tile and the bands are views of it (no extra copy per band)
+        with TiledOrthomosaicReader(tif_path) as reader:
+            rgb_image = reader.read_bgr()
+            mask = reader.read_mask()
+
+        blue_band, green_band, red_band = rgb_image[:, :, 0], rgb_image[:, :, 1], rgb_image[:, :, 2]
 
         return rgb_image, red_band, green_band, blue_band, mask
 
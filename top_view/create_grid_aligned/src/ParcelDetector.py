@@ -146,9 +146,87 @@ class ParcelDetector:
         return all_parcel_points, center_parcels
 
 
+    def get_contours_boxes(self, contours) -> np.ndarray:
+        """
+        Gets the bounding box of each contour.
+
+        Args:
+            contours (list): List of contours.
+
+        Returns:
+            boxes (np.ndarray): Array with shape (N, 4) with x_min, y_min, x_max, y_max (inclusive) of each contour.
+        """
+        boxes = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=np.float64).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2] - 1
+
+        return boxes
+
+
+    @staticmethod
+    def segment_intersects_boxes(point1, point2, boxes, margin) -> np.ndarray:
+        """
+        Checks which boxes are crossed by a segment (Liang-Barsky clipping, vectorized over all the boxes).
+
+        Args:
+            point1 (tuple): Start point (x, y) of the segment.
+            point2 (tuple): End point (x, y) of the segment.
+            boxes (np.ndarray): Array with shape (N, 4) with x_min, y_min, x_max, y_max of each box.
+            margin (float): Distance added to every side of the boxes (e.g. the thickness of the line).
+
+        Returns:
+            np.ndarray: Boolean array with shape (N,), True where the segment crosses the box.
+        """
+        x0, y0 = float(point1[0]), float(point1[1])
+        dx, dy = float(point2[0]) - x0, float(point2[1]) - y0
+
+        # Clip the segment (t in [0, 1]) against the 4 sides of every box
+        t_min = np.zeros(len(boxes))
+        t_max = np.ones(len(boxes))
+        inside = np.ones(len(boxes), dtype=bool)
+        sides = [(-dx, x0 - (boxes[:, 0] - margin)), (dx, (boxes[:, 2] + margin) - x0),
+                 (-dy, y0 - (boxes[:, 1] - margin)), (dy, (boxes[:, 3] + margin) - y0)]
+        for p, q in sides:
+            if p == 0:
+                inside &= q >= 0
+            elif p < 0:
+                t_min = np.maximum(t_min, q / p)
+            else:
+                t_max = np.minimum(t_max, q / p)
+
+        return inside & (t_min <= t_max)
+
+
+    def line_overlaps_contour(self, line_image, cnt, box) -> bool:
+        """
+        Checks if a row line overlaps a filled contour. The contour is only drawn inside its bounding box (clipped
+        to the image) and compared with the same region of the line image.
+
+        Args:
+            line_image (np.ndarray): Single channel image with the row line drawn.
+            cnt (np.ndarray): Contour.
+            box (np.ndarray): Bounding box of the contour (x_min, y_min, x_max, y_max).
+
+        Returns:
+            bool: True if the line and the contour overlap.
+        """
+        h, w = line_image.shape[:2]
+        x_min, y_min = max(int(box[0]), 0), max(int(box[1]), 0)
+        x_max, y_max = min(int(box[2]), w - 1), min(int(box[3]), h - 1)
+        if x_min > x_max or y_min > y_max:
+            return False
+        line_roi = line_image[y_min:y_max + 1, x_min:x_max + 1]
+
+        blank = np.zeros_like(line_roi)
+        blank = cv2.drawContours(blank, [cnt], -1, 255, -1, offset=(-x_min, -y_min))
+
+        return bool(np.any(cv2.bitwise_and(line_roi, blank)))
+
+
     def sort_contours(self, contours) -> list:
         """
         Sorts the contours based on the vineyard rows and returns them in order.
+        Only the contours whose bounding box is crossed by a row line are checked pixel-wise, and only inside
+        their bounding box, instead of drawing every (row, contour) pair on two full-size images.
 
         Args:
             contours (list): List of contours.
@@ -159,42 +237,35 @@ class ParcelDetector:
         self._rows = []
         sorted_contours = []
         contours = list(contours)
+        boxes = self.get_contours_boxes(contours)
+        remaining = np.ones(len(contours), dtype=bool)
 
         # For each row defined in parallel_rows_points (red lines)
         for points in tqdm(self._parallel_rows_points, desc="Sorting contours defining rows"):
-            appended_contours = []
-            indexes = []
+
+            # Contours not assigned yet whose bounding box is crossed by the line (9 px thick)
+            candidates = np.flatnonzero(remaining & self.segment_intersects_boxes(points[0], points[1], boxes, 9))
 
             # Draw the line on the blank image to represent the current row
-            blank1 = np.zeros_like(self._filtered_rows_image)
-            blank1 = cv2.line(blank1, points[0], points[1], (255,255,255), 9)
-
-            # For each one of the contours detected 
-            for i,cnt in enumerate(contours): 
-                # Draw the contour
-                blank2 = np.zeros_like(self._filtered_rows_image)
-                blank2 = cv2.drawContours(blank2, [cnt], -1, (255, 255, 255), -1)
-
-                # Check if the line and the contour detected are overlapping
-                mask = cv2.bitwise_and(blank1, blank2)
-                if np.any(mask): 
-                    # Save contour and index overlapped in a list. It can be more than one contour overlapped with a row line 
-                    indexes.append(i)
-                    appended_contours.append(cnt) 
-            
+            indexes = []
+            if len(candidates):
+                blank = np.zeros(self._filtered_rows_image.shape[:2], dtype=np.uint8)
+                blank = cv2.line(blank, points[0], points[1], 255, 9)
+
+                # Check if the line and the contour detected are overlapping. It can be more than one contour overlapped with a row line
+                indexes = [i for i in candidates if self.line_overlaps_contour(blank, contours[i], boxes[i])]
+
             # For every contour overlapped
-            if appended_contours:
+            if indexes:
                 # Sort contours overlapped
-                appended_contours = sorted(appended_contours, key=lambda c: cv2.boundingRect(c)[0])
+                appended_contours = sorted([contours[i] for i in indexes], key=lambda c: cv2.boundingRect(c)[0])
                 rect = cv2.minAreaRect(appended_contours[0])
                 box = np.int0(cv2.boxPoints(rect))
                 self._rows.append(box[0])
 
-                # Delete contours overlapped from contours to reduce executing time 
-                indexes = sorted(indexes, reverse=True)
-                for index, appended_cnt in zip(indexes, appended_contours): 
-                    sorted_contours.append(appended_cnt)
-                    contours.pop(index)
+                # Remove contours overlapped from the candidates of the next rows
+                sorted_contours.extend(appended_contours)
+                remaining[indexes] = False
 
         return sorted_contours
 
@@ -0,0 +1,210 @@
+""" Class to read orthomosaic images by tiles (rasterio windows) without loading the whole file """
+
+__author__ = "Esther Vera"
+__copyright__ = "Copyright 2024, Noumena"
+__credits__ = ["Esther Vera, Oriol Arroyo, Salvador Calgua, Aldo Sollazzo"]
+__version__ = "1.0.0"
+__maintainer__ = "Esther Vera"
+__email__ = "esther@noumena.io"
+__status__ = "Production"
+__license__ = "MIT"
+
+import rasterio
+import numpy as np
+from rasterio.windows import Window
+from rasterio.enums import Resampling
+
+
+class TiledOrthomosaicReader:
+    def __init__(self, tif_path, tile_size=1024, mask_band=4):
+        """
+        Opens the orthomosaic. Nothing is read until a tile, a decimated image or a region of the RGB view is requested.
+
+        Args:
+            tif_path (str): The file path to the TIF orthomosaic image.
+            tile_size (int): Number of rows of each tile when the TIF is not internally tiled.
+            mask_band (int): Band that stores the mask. If the file has fewer bands, the GDAL dataset mask is used.
+        """
+        self._src = rasterio.open(tif_path)
+        self._tile_size = tile_size
+        self._mask_band = mask_band if self._src.count >= mask_band else None
+        self.height = self._src.height
+        self.width = self._src.width
+        self.transform = self._src.transform
+        self.crs = self._src.crs
+        self.rgb = LazyRGBView(self)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        """
+        Closes the underlying rasterio dataset.
+        """
+        self._src.close()
+
+
+    def windows(self):
+        """
+        Yields the windows that cover the whole orthomosaic. If the GeoTIFF is internally tiled its own blocks are used,
+        so every block is decoded only once; otherwise the image is split in strips of tile_size rows.
+
+        Yields:
+            window (rasterio.windows.Window): Window of the current tile.
+        """
+        if self._src.profile.get('tiled', False):
+            for _, window in self._src.block_windows(1):
+                yield window
+        else:
+            for row in range(0, self.height, self._tile_size):
+                yield Window(0, row, self.width, min(self._tile_size, self.height - row))
+
+
+    def read_mask(self, window=None, out_shape=None):
+        """
+        Reads the mask of the orthomosaic (or of a window of it).
+
+        Args:
+            window (rasterio.windows.Window): Region to read. If None, the whole image is read.
+            out_shape (tuple): Optional (height, width) to get a decimated mask.
+
+        Returns:
+            mask (np.ndarray): The mask image.
+        """
+        if self._mask_band is None:
+            return self._src.dataset_mask(window=window, out_shape=out_shape)
+        return self._src.read(self._mask_band, window=window, out_shape=out_shape, resampling=Resampling.bilinear)
+
+
+    def iter_tiles(self, bands=(1, 2, 3), with_mask=True):
+        """
+        Iterates over the orthomosaic tile by tile, so only one tile is in memory at a time.
+
+        Args:
+            bands (tuple): Bands to read in each tile (1-based, as in rasterio).
+            with_mask (bool): If True, the mask of each tile is read too.
+
+        Yields:
+            tuple: window (rasterio.windows.Window), bands (np.ndarray with shape (len(bands), h, w)) and
+                   mask (np.ndarray with shape (h, w), or None if with_mask is False).
+        """
+        for window in self.windows():
+            data = self._src.read(list(bands), window=window)
+            mask = self.read_mask(window) if with_mask else None
+            yield window, data, mask
+
+
+    def read_decimated(self, bands, tam=(2346, 1805), resampling=Resampling.bilinear):
+        """
+        Reads bands directly at a lower resolution. It replaces reading the full image and calling cv2.resize(img, tam).
+        If the GeoTIFF has overviews (internal or .ovr, see build_overviews), GDAL decodes the closest overview
+        instead of the full resolution image.
+
+        Args:
+            bands (int or tuple): Band or bands to read (1-based).
+            tam (tuple): Target size as (width, height), same convention as cv2.resize.
+            resampling (rasterio.enums.Resampling): Resampling method (bilinear matches cv2.INTER_LINEAR).
+
+        Returns:
+            np.ndarray: Image with shape (height, width) for a single band or (len(bands), height, width).
+        """
+        if isinstance(bands, int):
+            out_shape = (tam[1], tam[0])
+        else:
+            bands = list(bands)
+            out_shape = (len(bands), tam[1], tam[0])
+        return self._src.read(bands, out_shape=out_shape, resampling=resampling)
+
+
+    def overview_factors(self):
+        """
+        Gets the decimation factors of the overviews stored in the GeoTIFF (internal or .ovr).
+
+        Returns:
+            list: Overview factors (e.g. [2, 4, 8, 16]), empty if the file has no overviews.
+        """
+        return self._src.overviews(1)
+
+
+    @staticmethod
+    def build_overviews(tif_path, factors=(2, 4, 8, 16), external=True, resampling=Resampling.average):
+        """
+        Builds the overview pyramid of a GeoTIFF. It only needs to be done once per file, afterwards every
+        decimated read (read_decimated) is served from the overviews.
+
+        Args:
+            tif_path (str): The file path to the TIF orthomosaic image.
+            factors (tuple): Decimation factors of the overviews.
+            external (bool): If True, overviews are saved in a .ovr file next to the TIF; otherwise inside the TIF.
+            resampling (rasterio.enums.Resampling): Resampling method used to build the overviews.
+
+        Returns:
+            bool: True if the overviews were built, False if the file already had them.
+        """
+        with rasterio.open(tif_path) as src:
+            if src.overviews(1):
+                return False
+
+        with rasterio.Env(TIFF_USE_OVR=external):
+            with rasterio.open(tif_path, 'r+') as dst:
+                dst.build_overviews(list(factors), resampling)
+
+        return True
+
+
+    def read_bgr(self):
+        """
+        Reads the RGB bands into a single (h, w, 3) image in BGR order (OpenCV). The image is filled tile by tile,
+        so there is no intermediate copy per band as with cv2.merge.
+
+        Returns:
+            bgr_image (np.ndarray): The BGR orthomosaic image.
+        """
+        bgr_image = np.empty((self.height, self.width, 3), dtype=self._src.dtypes[0])
+        for window, data, _ in self.iter_tiles(bands=(3, 2, 1), with_mask=False):
+            rows, cols = window.toslices()
+            bgr_image[rows, cols] = np.moveaxis(data, 0, -1)
+        return bgr_image
+
+
+
+class LazyRGBView:
+    def __init__(self, reader):
+        """
+        BGR view of the orthomosaic that behaves like an (h, w, 3) array but only reads the region being sliced.
+
+        Args:
+            reader (TiledOrthomosaicReader): Reader of the orthomosaic.
+        """
+        self._reader = reader
+        self.shape = (reader.height, reader.width, 3)
+
+
+    def __getitem__(self, key):
+        """
+        Reads a region of the orthomosaic, e.g. view[y0:y1, x0:x1].
+
+        Args:
+            key (tuple): Row slice and column slice (step 1).
+
+        Returns:
+            np.ndarray: The BGR region with shape (rows, cols, 3).
+        """
+        if not isinstance(key, tuple):
+            key = (key, slice(None))
+        rows, cols = key[0:2]
+        if rows.step not in (None, 1) or cols.step not in (None, 1):
+            raise ValueError("Only slices with step 1 are supported, use read_decimated for subsampled reads")
+
+        row_start, row_stop, _ = rows.indices(self.shape[0])
+        col_start, col_stop, _ = cols.indices(self.shape[1])
+        window = Window(col_start, row_start, max(col_stop - col_start, 0), max(row_stop - row_start, 0))
+        data = self._reader._src.read([3, 2, 1], window=window)
+
+        return np.ascontiguousarray(np.moveaxis(data, 0, -1))
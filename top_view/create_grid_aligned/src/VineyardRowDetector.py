@@ -14,6 +14,8 @@ import copy
 import numpy as np
 from tqdm import tqdm
 
+from src.RowEstimator import RowEstimator
+
 
 class VineyardRowDetector:
     def __init__(self, ortho_image, mask, VINEYARD_HEIGHT, VINEYARD_SEP):
@@ -23,15 +25,21 @@ class VineyardRowDetector:
         Args:
             ortho_image (numpy.ndarray): The orthomosaic image of the vineyard.
             mask (numpy.ndarray): The mask defining the vineyard area.
-            VINEYARD_SEP (float): Separation between vineyard rows.
+            VINEYARD_SEP (float): Separation between vineyard rows. If None, it is estimated from the vegetation mask.
         """
         self._coordinates = []
+        self._row_estimator = None
         self._vineyard_height = VINEYARD_HEIGHT    
         self._vineyard_sep = VINEYARD_SEP    
         self._ortho_image = ortho_image
         self._mask = mask
         self._ortho_image_rows = copy.deepcopy(ortho_image)
         self._smoothed_mask = self.smooth_mask()
+        # Vineyard area, and vineyard area grown 3 px (long lines of thickness 2 are drawn up to ~2.5 px away
+        # from their ideal position), to check if a row is visible
+        self._visible_area = self._smoothed_mask > 0
+        self._visible_area_dilated = cv2.dilate(self._smoothed_mask, np.ones((7, 7), np.uint8)) > 0
+        self._h, self._w, _ = self._ortho_image_rows.shape
 
 
     def smooth_mask(self) -> np.ndarray: 
@@ -72,7 +80,8 @@ class VineyardRowDetector:
         Obtains the coordinates of the selected point on the image, either manually or automatically.
 
         Args:
-            select_point (bool): If True, allows manual point selection; otherwise, uses predefined coordinates.
+            select_point (bool): If True, allows manual point selection; otherwise, the first row of the vineyard
+                                 is estimated from the vegetation mask.
 
         Returns:
             coordinates (list): List containing the selected coordinates.
@@ -86,7 +95,90 @@ class VineyardRowDetector:
                 cv2.waitKey(1)
             cv2.destroyAllWindows()
         else: # Automatic selection 
-            self._coordinates = [1033, 971]  # Predefined coordinates 
+            # self._coordinates = [1033, 971]  # Predefined coordinates 
+            # Rows estimated from the vegetation mask (horizontal, the image is aligned), the first one inside the vineyard
+            rows_coordinates = np.array(self.get_row_estimator().get_rows_coordinates())
+            rows_y = np.sort(rows_coordinates[:, :, 1].mean(axis=1))
+            points1 = np.stack([np.zeros_like(rows_y), rows_y], axis=1).astype(int)
+            points2 = np.stack([np.full_like(rows_y, self._w), rows_y], axis=1).astype(int)
+            visible = np.flatnonzero(self.get_visible_lines(points1, points2))
+            first_row_y = int(rows_y[visible[0]]) if len(visible) else int(rows_y[0])
+            self._coordinates = [self._w // 2, first_row_y]
+
+        # Separation between rows estimated from the vegetation mask if it is not defined
+        if self._vineyard_sep is None:
+            self._vineyard_sep = self.get_row_estimator().spacing
+
+
+    def get_row_estimator(self) -> RowEstimator:
+        """
+        Estimates the orientation, separation and position of the rows from the vegetation mask (only once).
+
+        Returns:
+            row_estimator (RowEstimator): Estimator with the angle, spacing and offset of the rows.
+        """
+        if self._row_estimator is None:
+            self._row_estimator = RowEstimator(self._ortho_image, self._mask)
+            self._row_estimator.estimate()
+
+        return self._row_estimator
+
+
+    def get_visible_lines(self, points1, points2) -> np.ndarray:
+        """
+        Checks which lines cross the vineyard area. The smoothed mask is sampled along all the lines at once
+        (one vectorized gather, at most one pixel between samples) instead of drawing each line on a blank image.
+        Only the lines that touch the border of the vineyard area, where sampling and drawing a line of thickness 2
+        can differ, are drawn to get the same result.
+
+        Args:
+            points1 (np.ndarray): Start points (x, y) of the lines, with shape (K, 2).
+            points2 (np.ndarray): End points (x, y) of the lines, with shape (K, 2).
+
+        Returns:
+            np.ndarray: Boolean array with shape (K,), True where the line is visible.
+        """
+        p1 = np.asarray(points1, dtype=np.float64).reshape(-1, 2)
+        p2 = np.asarray(points2, dtype=np.float64).reshape(-1, 2)
+        d = p2 - p1
+
+        # Clip the lines to the image plus a margin of 4 px, lines just outside can still reach the image (Liang-Barsky)
+        t_min = np.zeros(len(p1))
+        t_max = np.ones(len(p1))
+        sides = [(-d[:, 0], p1[:, 0] + 4), (d[:, 0], (self._w + 3) - p1[:, 0]),
+                 (-d[:, 1], p1[:, 1] + 4), (d[:, 1], (self._h + 3) - p1[:, 1])]
+        for p, q in sides:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                r = q / p
+            t_min = np.where(p < 0, np.maximum(t_min, r), t_min)
+            t_max = np.where(p > 0, np.minimum(t_max, r), t_max)
+            t_max = np.where((p == 0) & (q < 0), -1, t_max)
+        inside = t_min <= t_max
+        if not np.any(inside):
+            return inside
+
+        # Sample the clipped segments
+        c1 = p1 + t_min[:, None] * d
+        c2 = p1 + t_max[:, None] * d
+        n_samples = int(np.ceil(np.abs(c2 - c1)[inside].max())) + 1
+        steps = np.linspace(0, 1, n_samples)
+        xs = np.rint(c1[:, 0, None] + steps * (c2[:, 0] - c1[:, 0])[:, None]).astype(np.intp)
+        ys = np.rint(c1[:, 1, None] + steps * (c2[:, 1] - c1[:, 1])[:, None]).astype(np.intp)
+        in_image = (xs >= 0) & (xs < self._w) & (ys >= 0) & (ys < self._h)
+        xs = np.clip(xs, 0, self._w - 1)
+        ys = np.clip(ys, 0, self._h - 1)
+
+        # Lines whose center crosses the vineyard area are visible, lines close to it must be checked
+        visible = inside & (self._visible_area[ys, xs] & in_image).any(axis=1)
+        border = inside & ~visible & self._visible_area_dilated[ys, xs].any(axis=1)
+
+        # Lines in the border of the vineyard area are drawn as before
+        for k in np.flatnonzero(border):
+            blank_rows = np.zeros((self._h, self._w), dtype=np.uint8)
+            cv2.line(blank_rows, tuple(points1[k]), tuple(points2[k]), 255, 2)
+            visible[k] = np.any(cv2.bitwise_and(blank_rows, blank_rows, mask=self._smoothed_mask))
+
+        return visible
 
 
     def get_parallel_rows(self) -> list:
@@ -101,33 +193,24 @@ class VineyardRowDetector:
         Returns:
             parallel_rows_points (list): A list of points defining the parallel rows.
         """
-        reached = False
         parallel_rows_points = [] # To store the parallel rows points
-        h, w, _ = self._ortho_image_rows.shape
-
-        # Define the initial points for the first row line
-        x1, y1, x2, y2 = 0, self._coordinates[1], w, self._coordinates[1]
-            
-        # Generate parallel rows until no more valid rows can be found
-        while not reached:
-            point1 = (int(x1), int(y1))
-            point2 = (int(x2), int(y2))
-
-            # Mask the row with vineyard area 
-            blank_rows = np.zeros((h, w, 1), dtype=np.uint8)
-            cv2.line(blank_rows, point1, point2, (255), 2)
-            rows_mask = cv2.bitwise_and(blank_rows, blank_rows, mask=self._smoothed_mask)  
-
-            # If the row intersects the vineyard mask
-            if np.any(rows_mask): 
-                parallel_rows_points.append([point1, point2])
-                cv2.line(self._ortho_image_rows, point1, point2, (0, 0, 255), self._vineyard_height)
-            else:
-                reached = True  #
-
-            # Position of new row depending on vineyard row separation
-            y1 += self._vineyard_sep
-            y2 += self._vineyard_sep
+
+        # Candidate rows: from the initial row to the bottom of the image, depending on vineyard row separation
+        total_rows = max(int(np.ceil((self._h - self._coordinates[1]) / self._vineyard_sep)), 0) + 1
+        ys = self._coordinates[1] + np.arange(total_rows) * self._vineyard_sep
+        points1 = np.stack([np.zeros_like(ys), ys], axis=1).astype(int)
+        points2 = np.stack([np.full_like(ys, self._w), ys], axis=1).astype(int)
+
+        # Check which rows intersect the vineyard mask, all of them at once
+        visible = self.get_visible_lines(points1, points2)
+
+        # Keep rows until the first one that does not intersect the vineyard mask
+        for point1, point2, is_visible in zip(points1.tolist(), points2.tolist(), visible):
+            if not is_visible:
+                break
+            point1, point2 = tuple(point1), tuple(point2)
+            parallel_rows_points.append([point1, point2])
+            cv2.line(self._ortho_image_rows, point1, point2, (0, 0, 255), self._vineyard_height)
 
         return parallel_rows_points
 